@@ -8,6 +8,8 @@ Created on Mon Jan 16 17:49:02 2017
 
 import tensorflow as tf
 import tflearn
+from target_update import soft_update, hard_update
+from actor_np import actor_layers
 import math
 import pdb
 
@@ -40,10 +42,8 @@ class ActorNetwork(object):
         self.target_network_params = tf.trainable_variables()[len(self.network_params):]
 
         # Op for periodically updating target network with online network weights
-        self.update_target_network_params = \
-            [self.target_network_params[i].assign(tf.multiply(self.network_params[i], self.tau) +
-                                                  tf.multiply(self.target_network_params[i], 1. - self.tau))
-             for i in range(len(self.target_network_params))]
+        self.update_target_network_params = soft_update(self.network_params, self.target_network_params, self.tau)
+        self.copy_target_network_params = hard_update(self.network_params, self.target_network_params)
 
         # This gradient will be provided by the critic network
         self.action_gradient = tf.placeholder(tf.float32, [None, self.a_dim])
@@ -52,8 +52,8 @@ class ActorNetwork(object):
         self.actor_gradients = tf.gradients(self.scaled_out, self.network_params, -self.action_gradient)
 
         # Optimization Op
-        self.optimizer = tf.train.AdamOptimizer(self.learning_rate). \
-            apply_gradients(zip(self.actor_gradients, self.network_params))
+        self.adam = tf.train.AdamOptimizer(self.learning_rate)
+        self.optimizer = self.adam.apply_gradients(zip(self.actor_gradients, self.network_params))
 
         self.num_trainable_vars = len(self.network_params) + len(self.target_network_params)
 
@@ -101,6 +101,12 @@ class ActorNetwork(object):
             self.target_inputs: inputs
         })
 
+    def get_weights(self, sess):
+        """ Snapshot of the actor layers for inference outside of TensorFlow, see actor_np.py """
+        # the actor may live in another graph than the default one, e.g. compare_with_actor
+        variables = {v.op.name: v for v in self.inputs.graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES)}
+        return sess.run(actor_layers(variables))
+
     def update_target_network(self, sess):
         sess.run(self.update_target_network_params)
 
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Actor inference in NumPy.
+
+Action selection through sess.run costs more than the forward pass of the
+actor itself for a single observation. NumpyActor evaluates the same network
+from a snapshot of its weights, see ActorNetwork.get_weights. The module does
+not depend on TensorFlow.
+"""
+import os
+import numpy as np
+
+BN_EPSILON = 1e-5 # tflearn default
+ACTOR_LAYERS = ('actorLayer1', 'actorLayer2', 'actorOutput')
+NPZ_EXT = '.npz'
+
+
+class NumpyActor(object):
+    """
+    Layers are dicts with 'W' and 'b' and, if batch normalization is used,
+    'beta', 'gamma', 'moving_mean' and 'moving_variance'. Batch normalization
+    in inference mode is folded into weights of the preceding layer.
+    """
+
+    def __init__(self, layers, action_bound=1, updates=0):
+        self.action_bound = action_bound
+        self.set_weights(layers, updates)
+
+    def set_weights(self, layers, updates=0):
+        folded = []
+        for layer in layers:
+            W = np.array(layer['W'], dtype=np.float32)
+            b = np.array(layer['b'], dtype=np.float32)
+            if 'gamma' in layer:
+                scale = layer['gamma'] / np.sqrt(layer['moving_variance'] + BN_EPSILON)
+                W = (W * scale).astype(np.float32)
+                b = ((b - layer['moving_mean']) * scale + layer['beta']).astype(np.float32)
+            folded.append((W, b))
+        # a single assignment keeps the switch atomic for concurrent readers
+        self.layers = folded
+        self.updates = updates
+
+    def predict(self, inputs):
+        layers = self.layers
+        x = np.asarray(inputs, dtype=np.float32)
+        for W, b in layers[:-1]:
+            x = np.dot(x, W)
+            x += b
+            np.maximum(x, 0, out=x)
+        W, b = layers[-1]
+        return np.tanh(np.dot(x, W) + b) * self.action_bound
+
+
+def actor_layers(values):
+    """ Actor layers from variable values keyed by variable names, e.g. 'actorLayer1/W' """
+    layers = []
+    for name in ACTOR_LAYERS:
+        layer = {}
+        for scope in [name, name + '_norm']:
+            for key, value in values.items():
+                names = key.split('/')
+                if len(names) == 2 and names[0] == scope:
+                    layer[names[1]] = value
+        layers.append(layer)
+    return layers
+
+
+def save_policy_npz(filename, layers, obs_rms=None, action_bound=1):
+    """
+    Save actor layers and, optionally, observation normalization statistics
+    given as a dict with 'mean' and 'std'.
+    """
+    arrays = {'action_bound': action_bound}
+    for i, layer in enumerate(layers):
+        for key, value in layer.items():
+            arrays['layer{}_{}'.format(i, key)] = value
+    if obs_rms is not None:
+        arrays['obs_rms_mean'] = obs_rms['mean']
+        arrays['obs_rms_std'] = obs_rms['std']
+    # write to a temporary file first, so that readers never see a partial policy
+    tmp = filename + '.tmp' + NPZ_EXT
+    np.savez(tmp, **arrays)
+    os.replace(tmp, filename + NPZ_EXT)
+
+
+def load_policy_npz(filename):
+    """ Returns NumpyActor and observation normalization statistics (None if not saved) """
+    if not filename.endswith(NPZ_EXT):
+        filename += NPZ_EXT
+    with np.load(filename) as data:
+        layers = []
+        for key in data.files:
+            if key.startswith('layer'):
+                i, name = key[len('layer'):].split('_', 1)
+                while len(layers) <= int(i):
+                    layers.append({})
+                layers[int(i)][name] = data[key]
+        obs_rms = None
+        if 'obs_rms_mean' in data.files:
+            obs_rms = {'mean': data['obs_rms_mean'], 'std': data['obs_rms_std']}
+        return NumpyActor(layers, float(data['action_bound'])), obs_rms
+
+
+def find_policy_npz(load_file):
+    """ Exported policy of a checkpoint name as used by preload_policy, None if there is none """
+    path = os.path.dirname(os.path.abspath(__file__))
+    for sfx in ['', '-best', '-last']:
+        for filename in [load_file + sfx, "{}/{}".format(path, load_file + sfx)]:
+            if os.path.isfile(filename + NPZ_EXT):
+                return filename
+    return None
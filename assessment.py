@@ -2,7 +2,9 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 from collections import deque
+import numpy as np
 import pdb
+from replaybuffer_ddpg import ArrayReplayBuffer, experiences_to_columns
 
 
 class Evaluator(object):
@@ -25,35 +27,64 @@ class Evaluator(object):
         if len(items) > 1: rwForward = float(items[1])
         if len(items) > 2: rwTime = float(items[2])
 
-        new_replay_buffer = deque()
-        for e in replay_buffer.replay_buffer:
-            r_old = e[2]
-            r_new = r_old + rwForward*e[5] + rwTime
-            #print('reassess ', r_old, r_new, e[5])
-            #pdb.set_trace()
-            new_e = (e[0], e[1], r_new, e[3], e[4], e[5])
-            new_replay_buffer.append(new_e)
-        replay_buffer.replay_buffer = new_replay_buffer
-        return replay_buffer
+        c = self._columns(replay_buffer)
+        r_new = c['r'] + rwForward*c['fw'] + rwTime
+        return self._set_rewards(replay_buffer, r_new)
 
 
     def reassess(self, replay_buffer, rwForward=300, verify=False,
                    task = 'walking', knee_mode = "punish_and_continue"):
-        new_replay_buffer = deque()
-        for e in replay_buffer.replay_buffer:
-            r_old = e[2]
-            r_new = self.evaluateExperience(e[0], e[1]*self.max_action,
-                                            e[3], e[4],
-                                            e[5], rwForward,
-                                            task, knee_mode)
-            new_e = (e[0], e[1], r_new, e[3], e[4], e[5])
-            new_replay_buffer.append(new_e)
-            if verify:
-                assert(r_old == r_new)
-        replay_buffer.replay_buffer = new_replay_buffer
+        c = self._columns(replay_buffer)
+        r_new = self.evaluateExperiences(c['s'], c['a']*self.max_action,
+                                         c['t'], c['s2'],
+                                         c['fw'], rwForward,
+                                         task, knee_mode)
+        if verify:
+            assert(np.array_equal(c['r'], r_new))
+        return self._set_rewards(replay_buffer, r_new)
+
+
+    def _columns(self, replay_buffer):
+        """ Experiences of the buffer as arrays, views for the array storage """
+        n = replay_buffer.replay_buffer_count
+        if isinstance(replay_buffer, ArrayReplayBuffer):
+            return dict((name, column[:n]) for name, column in replay_buffer.columns().items() if column is not None)
+        _, columns = experiences_to_columns(replay_buffer.replay_buffer)
+        return columns
+
+
+    def _set_rewards(self, replay_buffer, r_new):
+        """ Update rewards in place, in the same order as returned by _columns """
+        if isinstance(replay_buffer, ArrayReplayBuffer):
+            replay_buffer.r[:replay_buffer.replay_buffer_count] = r_new
+        else:
+            replay_buffer.replay_buffer = deque((e[0], e[1], r, e[3], e[4], e[5])
+                for e, r in zip(replay_buffer.replay_buffer, r_new))
         return replay_buffer
 
 
+    def evaluateExperiences(self, s, a, t, s2, fw = 0, rwForward=300,
+                            task = 'walking', knee_mode = "punish_and_continue"):
+        """ Batch version of evaluateExperience, experiences are in rows """
+        rwFail = -75
+        rwTime = -1.5
+        rwBrokenKnee = -10
+        rwWork = -2
+
+        r = np.zeros(len(t))
+        if knee_mode == "punish_and_continue":
+            r[self.isKneeBrokenBatch(s2)] = rwBrokenKnee
+        r[t] = rwFail
+
+        if task == 'walking':
+            r += rwTime
+            r += rwForward*fw
+
+        stepEnergy = self.getMotorWorkBatch(s, s2, a)
+        r += rwWork*stepEnergy
+        return r
+
+
     def evaluateExperience(self, s, a, t, s2, fw = 0, rwForward=300,
                            task = 'walking', knee_mode = "punish_and_continue"):
         """ When walking, time penalty and rwForward are added """
@@ -95,11 +126,28 @@ class Evaluator(object):
             motorWork += max([0.0, U*I]) / desiredFrequency  # Divide power by frequency to get energy (work)
         return motorWork
 
+    def getMotorWorkBatch(self, s, s2, a):
+        """ Batch version of getMotorWork, summation order is preserved """
+        motorWork = np.zeros(len(s))
+        desiredFrequency = 30
+
+        dof = s.shape[1]//2
+        omega = 0.5*(s[:, dof+1:2*dof] + s2[:, dof+1:2*dof])
+        U = a[:, 0:dof-1]
+        I = (U - self.DXL_XM430_210_TORQUE_CONST*self.DXL_XM430_210_GEARBOX_RATIO*omega)/self.DXL_RESISTANCE
+        work = np.maximum(0.0, U*I) / desiredFrequency
+        for ii in range(dof-1):
+            motorWork += work[:, ii]
+        return motorWork
+
     def isKneeBroken(self, s):
         if s[3] > 0 or s[4] > 0:
             return True
         else:
             return False
 
+    def isKneeBrokenBatch(self, s):
+        return (s[:, 3] > 0) | (s[:, 4] > 0)
+
 
 
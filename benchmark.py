@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the DDPG training iteration without a simulator.
+
+A synthetic environment with observation and action sizes of Leo, Hopper and
+Walker2d feeds the replay buffer. Adding and sampling experiences, critic and
+actor updates, target network updates and action selection are timed
+separately for several minibatch and replay buffer sizes. Results are written
+to '<output>.json'; if --baseline names an earlier report, operations which
+became slower than --tolerance times are listed and the exit status is 1.
+
+Usage: python3 benchmark.py [--baseline report.json] [--tolerance 1.2] [ddpg options]
+"""
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+import sys
+import time
+import argparse
+import json
+import platform
+import numpy as np
+import tensorflow as tf
+from gym import spaces
+
+from ddpg import parse_args
+from ddpg_loop import compute_action, create_np_actor
+from actor import ActorNetwork
+from critic import CriticNetwork
+from fused_update import FusedUpdate
+from replaybuffer_ddpg import create_replay_buffer
+
+ENVS = {'Leo': (14, 6), 'Hopper': (15, 3), 'Walker2d': (22, 6)}
+BATCH_SIZES = [64, 128, 256]
+BUFFER_SIZES = [10000, 300000]
+STORAGES = ['deque', 'array']
+REPEAT = 200
+BASELINE = ''
+TOLERANCE = 1.2
+
+
+class SyntheticEnv(object):
+    """ Environment stub producing random observations of the given size """
+
+    def __init__(self, obs_dim, act_dim, timeout=100, seed=0):
+        self.observation_space = spaces.Box(low=-np.ones(obs_dim), high=np.ones(obs_dim))
+        self.action_space = spaces.Box(low=-np.ones(act_dim), high=np.ones(act_dim))
+        self.timeout = timeout
+        self.rng = np.random.RandomState(seed)
+        self.t = 0
+
+    def seed(self, seed):
+        self.rng = np.random.RandomState(seed)
+
+    def reset(self, test=False):
+        self.t = 0
+        return self.rng.uniform(-1, 1, self.observation_space.shape)
+
+    def step(self, action):
+        self.t += 1
+        obs = self.rng.uniform(-1, 1, self.observation_space.shape)
+        terminal = 2 if self.t >= self.timeout else 0
+        return obs, self.rng.randn(), terminal, ''
+
+
+def measure(fn, repeat=REPEAT):
+    """ Per-call time of 'fn' in microseconds """
+    times = np.empty(repeat)
+    for i in range(repeat):
+        t = time.perf_counter()
+        fn()
+        times[i] = time.perf_counter() - t
+    times *= 1e6
+    return {'n': repeat, 'mean_us': float(np.mean(times)), 'median_us': float(np.median(times)),
+            'min_us': float(np.min(times))}
+
+
+def fill(replay_buffer, env, count):
+    obs = env.reset()
+    for _ in range(count):
+        action = np.random.uniform(-1, 1, env.action_space.shape)
+        next_obs, reward, terminal, _ = env.step(action)
+        replay_buffer.replay_buffer_add(obs, action, reward, terminal == 2, next_obs)
+        obs = env.reset() if terminal else next_obs
+
+
+def bench_replay_buffer(env_name, env, config):
+    results = []
+    o_dims = env.observation_space.shape[-1]
+    obs = env.reset()
+    action = np.zeros(env.action_space.shape)
+    for storage in STORAGES:
+        for rb_size in BUFFER_SIZES:
+            cfg = dict(config, rb_storage=storage, rb_max_size=rb_size, rb_load_filename='', rb_save_filename='')
+            replay_buffer = create_replay_buffer(cfg, o_dims=o_dims)
+            fill(replay_buffer, env, rb_size)
+            res = measure(lambda: replay_buffer.replay_buffer_add(obs, action, 0., False, obs))
+            results.append(dict(res, env=env_name, op='replay_buffer_add', storage=storage, buffer_size=rb_size))
+            for batch_size in BATCH_SIZES:
+                res = measure(lambda: replay_buffer.sample_batch(batch_size))
+                results.append(dict(res, env=env_name, op='sample_batch', storage=storage,
+                                    buffer_size=rb_size, batch_size=batch_size))
+    return results
+
+
+def bench_networks(env_name, env, config):
+    results = []
+    obs_dim = env.observation_space.shape[-1]
+    act_dim = env.action_space.shape[-1]
+
+    with tf.Graph().as_default() as graph:
+        tf.set_random_seed(0)
+        actor = ActorNetwork(obs_dim, act_dim, 1, config)
+        critic = CriticNetwork(obs_dim, act_dim, config, actor.get_num_trainable_vars(), actor)
+        # the fused update does not support batch normalization
+        fused_update = None if config['batch_norm'] else FusedUpdate(actor, critic, config)
+
+    with tf.Session(graph=graph) as sess:
+        sess.run(tf.global_variables_initializer())
+        rng = np.random.RandomState(0)
+
+        for batch_size in BATCH_SIZES:
+            s = rng.uniform(-1, 1, (batch_size, obs_dim))
+            a = rng.uniform(-1, 1, (batch_size, act_dim))
+            r = rng.randn(batch_size)
+            t = np.zeros(batch_size)
+            y = rng.randn(batch_size, 1)
+
+            def critic_train():
+                target_q = critic.predict_target(sess, s, actor.predict_target(sess, s))
+                critic.train(sess, s, a, r[:, None] + config['gamma'] * target_q)
+
+            def actor_train():
+                grad = critic.action_gradients(sess, s, actor.predict(sess, s))[0]
+                actor.train(sess, s, grad)
+
+            ops = [('critic_train', critic_train),
+                   ('critic_train_step', lambda: critic.train(sess, s, a, y)),
+                   ('actor_train', actor_train),
+                   ('target_update', lambda: sess.run([actor.update_target_network_params,
+                                                       critic.update_target_network_params]))]
+            if fused_update:
+                ops.append(('fused_update', lambda: fused_update.train(sess, s, a, r, t, s)))
+            for op, fn in ops:
+                results.append(dict(measure(fn), env=env_name, op=op, batch_size=batch_size))
+
+        obs = env.reset()
+        noise = np.zeros(act_dim)
+        np_actor = create_np_actor(sess, actor, dict(config, np_actor_sync=1))
+        results.append(dict(measure(lambda: compute_action(sess, actor, obs, noise, False)),
+                            env=env_name, op='compute_action'))
+        results.append(dict(measure(lambda: compute_action(sess, actor, obs, noise, False, np_actor)),
+                            env=env_name, op='compute_action_np'))
+    return results
+
+
+def key(res):
+    return tuple(res.get(k) for k in ['env', 'op', 'storage', 'buffer_size', 'batch_size'])
+
+
+def compare_reports(baseline, report, tolerance=TOLERANCE):
+    """ Operations of 'report' which are slower than in 'baseline' by more than 'tolerance' times """
+    old = {key(res): res for res in baseline['results']}
+    slower = []
+    for res in report['results']:
+        k = key(res)
+        if k in old and res['median_us'] > tolerance * old[k]['median_us']:
+            slower.append((k, old[k]['median_us'], res['median_us']))
+    return slower
+
+
+def parse_benchmark_args():
+    """ Options of the benchmark, the rest of the command line is left to ddpg.parse_args """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--baseline', type=str, default=BASELINE, help='Earlier report to compare with')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='Slowdown factor reported as a regression')
+    args, rest = parser.parse_known_args()
+    sys.argv = sys.argv[:1] + rest
+    return vars(args)
+
+
+def main():
+    bench_args = parse_benchmark_args()
+    config = parse_args()
+    config['output'] = config['output'] if config['output'] != 'default' else 'benchmark'
+    np.random.seed(0)
+
+    results = []
+    for env_name, (obs_dim, act_dim) in ENVS.items():
+        env = SyntheticEnv(obs_dim, act_dim)
+        results += bench_replay_buffer(env_name, env, config)
+        results += bench_networks(env_name, env, config)
+        print('benchmark: {} done'.format(env_name))
+
+    report = {'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'platform': platform.platform(),
+              'python': sys.version.split()[0],
+              'numpy': np.__version__,
+              'tensorflow': tf.__version__,
+              'config': {k: config[k] for k in ['batch_norm', 'critic_l2_reg', 'minibatch_size', 'clip_norm']},
+              'results': results}
+    with open(config['output'] + '.json', 'w') as f:
+        json.dump(report, f, indent=1)
+
+    for res in results:
+        print('{:<10} {:<18} {:>6} {:>7} {:>5} {:>12.1f} us'.format(
+            res['env'], res['op'], res.get('storage', ''), res.get('buffer_size', ''),
+            res.get('batch_size', ''), res['median_us']))
+
+    if bench_args['baseline']:
+        with open(bench_args['baseline']) as f:
+            slower = compare_reports(json.load(f), report, bench_args['tolerance'])
+        for k, old, new in slower:
+            print('slower: {} {:.1f} us -> {:.1f} us'.format(k, old, new))
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
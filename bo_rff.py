@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bayesian optimization with a random Fourier feature surrogate.
+
+The GP of skopt is approximated by Bayesian linear regression on D random
+cosine features of an RBF kernel. tell() adds the outer product of the new
+features to a D x D precision matrix, so an update costs O(D^2) whatever the
+number of observations, and ask() needs one Cholesky factorization of size D.
+Candidates for the expected improvement are drawn in a trust region around
+the best point, which grows after consecutive improvements, shrinks after
+consecutive failures and restarts when it becomes too small.
+
+RFFOptimizer mimics the parts of skopt.Optimizer used by opt_bo: ask, tell,
+copy, Xi and yi.
+"""
+import copy
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve, solve_triangular
+from scipy.stats import norm
+
+
+class RFFOptimizer(object):
+
+    def __init__(self, bounds, n_initial_points=10, n_features=500, n_points=10000,
+                 lengthscale=None, noise=0.1, trust_region=True, random_state=None):
+        self.lo = np.array([b[0] for b in bounds], dtype=float)
+        self.hi = np.array([b[1] for b in bounds], dtype=float)
+        self.dim = len(bounds)
+        self.n_initial_points = n_initial_points
+        self.n_points = n_points
+        self.noise = noise # variance of normalized damage
+        self.rng = np.random.RandomState(random_state)
+
+        # features of the RBF kernel on the unit cube
+        if lengthscale is None:
+            lengthscale = 0.25 * np.sqrt(self.dim)
+        self.W = self.rng.randn(n_features, self.dim) / lengthscale
+        self.b = self.rng.uniform(0, 2*np.pi, n_features)
+        self.A = np.eye(n_features) * noise # precision of weights times noise
+        self.phi_y = np.zeros(n_features)
+        self.phi_1 = np.zeros(n_features)
+
+        self.Xi = []
+        self.yi = []
+
+        # trust region on the unit cube
+        self.trust_region = trust_region
+        self.tr_length = self.tr_init = 0.8
+        self.tr_min, self.tr_max = 0.5**7, 1.6
+        self.succ_tol, self.fail_tol = 3, max(4, self.dim // 4)
+        self.succ, self.fail = 0, 0
+
+    def features(self, u):
+        return np.sqrt(2.0 / len(self.b)) * np.cos(u.dot(self.W.T) + self.b)
+
+    def to_unit(self, x):
+        return (np.asarray(x, dtype=float) - self.lo) / (self.hi - self.lo)
+
+    def tell(self, x, y):
+        """ One point and its damage, or lists of both """
+        if len(x) == 0: # e.g. all runs of a generation failed
+            return
+        if np.ndim(x) == 1:
+            x, y = [x], [y]
+        for xx, yy in zip(x, y):
+            self.update_trust_region(yy)
+            phi = self.features(self.to_unit(xx))
+            self.A += np.outer(phi, phi)
+            self.phi_y += phi * yy
+            self.phi_1 += phi
+            self.Xi.append(list(xx))
+            self.yi.append(yy)
+
+    def update_trust_region(self, y):
+        if not self.trust_region or len(self.yi) < self.n_initial_points:
+            return
+        if y < min(self.yi) - 1e-3 * abs(min(self.yi)):
+            self.succ, self.fail = self.succ + 1, 0
+        else:
+            self.succ, self.fail = 0, self.fail + 1
+        if self.succ >= self.succ_tol:
+            self.tr_length = min(2 * self.tr_length, self.tr_max)
+            self.succ = 0
+        elif self.fail >= self.fail_tol:
+            self.tr_length /= 2
+            self.fail = 0
+        if self.tr_length < self.tr_min:
+            self.tr_length = self.tr_init # restart, observations are kept
+
+    def posterior(self, u):
+        """ Mean and standard deviation of normalized damage at points 'u' of the unit cube """
+        mu, sd = np.mean(self.yi), np.std(self.yi) or 1.0
+        L = cho_factor(self.A, lower=True)
+        w = cho_solve(L, (self.phi_y - mu * self.phi_1) / sd)
+        phi = self.features(u)
+        v = solve_triangular(L[0], phi.T, lower=True)
+        return phi.dot(w), np.sqrt(self.noise * np.sum(v**2, axis=0))
+
+    def candidates(self):
+        best = self.to_unit(self.Xi[int(np.argmin(self.yi))])
+        if self.trust_region:
+            lo = np.clip(best - self.tr_length / 2, 0, 1)
+            hi = np.clip(best + self.tr_length / 2, 0, 1)
+        else:
+            lo, hi = np.zeros(self.dim), np.ones(self.dim)
+        u = self.rng.uniform(lo, hi, (self.n_points, self.dim))
+        # perturb only a few coordinates of the best point in high dimensions
+        n = self.n_points // 2
+        mask = self.rng.uniform(size=(n, self.dim)) < min(1.0, 20.0 / self.dim)
+        u[:n] = np.where(mask, u[:n], best)
+        return u
+
+    def ask_point(self):
+        if len(self.yi) < self.n_initial_points:
+            return list(self.rng.uniform(self.lo, self.hi))
+        u = self.candidates()
+        mean, std = self.posterior(u)
+        best = (min(self.yi) - np.mean(self.yi)) / (np.std(self.yi) or 1.0)
+        z = (best - mean) / np.maximum(std, 1e-12)
+        ei = (best - mean) * norm.cdf(z) + std * norm.pdf(z)
+        return list(self.lo + u[np.argmax(ei)] * (self.hi - self.lo))
+
+    def ask(self, n_points=None):
+        """ One point, or a list of 'n_points' using the constant liar for points of the batch """
+        if n_points is None:
+            return self.ask_point()
+        opt = self.copy()
+        points = []
+        for _ in range(n_points):
+            x = opt.ask_point()
+            opt.tell(x, min(opt.yi) if opt.yi else 0.0)
+            points.append(x)
+        return points
+
+    def copy(self):
+        """ Copy with its own random stream, the stream of the original advances """
+        seed = self.rng.randint(2**31)
+        opt = copy.deepcopy(self)
+        opt.rng = np.random.RandomState(seed)
+        return opt
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Policy checkpoints written in the background.
+
+CheckpointManager snapshots variable values with one sess.run and hands them
+to a writer thread. The writer owns a small graph that only holds copies of
+the variables, so a single Saver per suffix is created once and the training
+graph never grows. Checkpoints are read back by name with any Saver, as in
+preload_policy. If a snapshot for the same suffix is still waiting, it is
+replaced by the newer one. Every checkpoint is accompanied by the actor
+exported to '.npz', see actor_np.py, and by observation normalization in
+'.obs_rms' if it is used. Both are removed together with the checkpoint.
+"""
+import os
+import sys
+import json
+import threading
+import tensorflow as tf
+from actor_np import actor_layers, save_policy_npz
+
+
+def policy_variables():
+    """ Variables saved with the policy, the curriculum network is saved separately """
+    return [v for v in tf.global_variables() if not 'curriculum' in v.name]
+
+
+def latest_filename(path):
+    """ Name of the checkpoint state file used when several checkpoints of 'path' are kept """
+    return os.path.basename(path) + '.checkpoint'
+
+
+def resolve_checkpoint(path):
+    """ 'path' itself or the newest of the checkpoints kept for it, None if there are none """
+    if os.path.isfile(path + '.meta'):
+        return path
+    return tf.train.latest_checkpoint(os.path.dirname(path) or '.', latest_filename(path))
+
+
+class CheckpointManager(object):
+    """
+    With 'checkpoint_keep' equal to 1 each suffix is saved to '<output><suffix>',
+    otherwise to '<output><suffix>-<step>' and only the newest 'checkpoint_keep'
+    of them are kept.
+    """
+
+    def __init__(self, sess, config):
+        self.sess = sess
+        self.output = config['output']
+        self.keep = config['checkpoint_keep']
+        self.asynchronous = config['checkpoint_async']
+        self.variables = policy_variables()
+
+        # Copies of the variables in an own graph
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.shadows = [tf.Variable(tf.zeros(v.get_shape(), dtype=v.dtype.base_dtype), name=v.op.name)
+                            for v in self.variables]
+            self.var_list = {v.op.name: s for v, s in zip(self.variables, self.shadows)}
+        self.writer_sess = tf.Session(graph=self.graph)
+        self.savers = {}
+        self.written = {} # suffix -> paths of kept checkpoints with step numbers
+
+        self.cond = threading.Condition()
+        self.pending = {}
+        self.writing = False
+        self.stopped = False
+        self.error = None
+        if self.asynchronous:
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def save(self, suffix='', global_step=None, obs_rms=None):
+        """ Snapshot variables and observation normalization now and write them later """
+        if not self.output:
+            return
+        values = self.sess.run(self.variables)
+        if obs_rms is not None:
+            obs_rms = {'count': obs_rms.count, 'mean': obs_rms.mean.copy(), 'std': obs_rms.std.copy(),
+                       'var': obs_rms.var.copy()}
+        if not self.asynchronous:
+            self._write(suffix, values, global_step, obs_rms)
+            return
+        with self.cond:
+            if self.error:
+                raise self.error
+            self.pending[suffix] = (values, global_step, obs_rms)
+            self.cond.notify_all()
+
+    def flush(self):
+        """ Wait until all snapshots are written """
+        if not self.asynchronous:
+            return
+        with self.cond:
+            while (self.pending or self.writing) and not self.error:
+                self.cond.wait()
+            if self.error:
+                raise self.error
+
+    def close(self):
+        self.flush()
+        if self.asynchronous:
+            with self.cond:
+                self.stopped = True
+                self.cond.notify_all()
+            self.thread.join()
+        self.writer_sess.close()
+
+    def _write(self, suffix, values, global_step, obs_rms):
+        with self.graph.as_default():
+            for shadow, value in zip(self.shadows, values):
+                shadow.load(value, self.writer_sess)
+            if suffix not in self.savers:
+                self.savers[suffix] = tf.train.Saver(self.var_list, max_to_keep=self.keep)
+        path = "./{}{}".format(self.output, suffix)
+        if self.keep > 1:
+            path = self.savers[suffix].save(self.writer_sess, path, global_step, latest_filename=latest_filename(path))
+        else:
+            path = self.savers[suffix].save(self.writer_sess, path)
+        layers = actor_layers({v.op.name: value for v, value in zip(self.variables, values)})
+        save_policy_npz(path, layers, obs_rms)
+        if obs_rms is not None:
+            with open(path + '.obs_rms', 'w') as f:
+                json.dump({k: v.tolist() if hasattr(v, 'tolist') else v for k, v in obs_rms.items()}, f)
+        if self.keep > 1:
+            # files of checkpoints deleted by the Saver
+            kept = list(self.savers[suffix].last_checkpoints)
+            for old in self.written.get(suffix, []):
+                if old not in kept:
+                    remove_files(old)
+            self.written[suffix] = kept
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.stopped:
+                    self.cond.wait()
+                if not self.pending:
+                    break
+                suffix, (values, global_step, obs_rms) = self.pending.popitem()
+                self.writing = True
+            try:
+                self._write(suffix, values, global_step, obs_rms)
+            except Exception as e:
+                with self.cond:
+                    self.error = e
+            with self.cond:
+                self.writing = False
+                self.cond.notify_all()
+
+
+def remove_files(path):
+    """ Remove the files which accompany checkpoint 'path' """
+    for ext in ('.npz', '.obs_rms'):
+        if os.path.isfile(path + ext):
+            os.remove(path + ext)
+
+
+def export_npz(path):
+    """ Export the actor of an existing checkpoint, with observation normalization if it was saved """
+    reader = tf.train.NewCheckpointReader(path)
+    values = {name: reader.get_tensor(name) for name in reader.get_variable_to_shape_map()}
+    obs_rms = None
+    if os.path.isfile(path + '.obs_rms'):
+        with open(path + '.obs_rms') as f:
+            obs_rms = json.load(f)
+    save_policy_npz(path, actor_layers(values), obs_rms)
+
+
+if __name__ == "__main__":
+    # Export actors of checkpoints given as arguments
+    for path in sys.argv[1:]:
+        export_npz(path)
+        print('Exported {}.npz'.format(path))
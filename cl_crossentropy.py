@@ -1,47 +1,37 @@
 from __future__ import division
 import multiprocessing
-import traceback
-import signal
 import random
 from datetime import datetime
 import os
 import numpy as np
 import sys
 import pdb
-import time
+import itertools
 from logger import Logger
-from random import randint
 import pickle
 
-from cl_main import cl_run
 from ddpg import parse_args
-from cl_learning import Helper
+from cl_learning import Helper, prepare_multiprocessing, run_async
+from opt_checkpoint import save_checkpoint, load_checkpoint, Journal
+from eval_cache import EvaluationCache
 
 from opt_ce import opt_ce
 
 random.seed(datetime.now())
 
-def comb_to_sol(comb, steps, steps_delta_a, steps_delta_b):
-    a = int(comb[0] * steps_delta_a)
-    b = int(comb[1] * steps_delta_b)
-    if   a == 0 and b == 0:
-        sol = (-1, -1, steps)
-    elif a == 0 and b > 0:
-        sol = (-1, b, steps-b)
-    elif a > 0 and b == 0:
-        sol = (a, -1, steps-a)
-    elif a > 0 and b > 0:
-        sol = (a, b, steps-a-b)
-    else:
+def comb_to_sol(comb, steps, steps_delta):
+    """ Steps of every stage, a stage with 0 steps is skipped (-1), the last stage gets the rest """
+    stages = [int(c * delta) for c, delta in zip(comb, steps_delta)]
+    if min(stages) < 0:
         print('something bad happened')
         pdb.set_trace()
-    return sol
+    return tuple(s if s > 0 else -1 for s in stages) + (steps - sum(stages),)
 
 
 def main():
-    prepare_multiprocessing()
     alg = 'ddpg'
     args = parse_args()
+    prepare_multiprocessing(args['resume'])
 
     if args['cores']:
         arg_cores = min(multiprocessing.cpu_count(), args['cores'])
@@ -50,6 +40,10 @@ def main():
     print('Using {} cores.'.format(arg_cores))
 
     args['mp_debug'] = True
+    args['env_cache'] = True
+    args['results_db'] = True # catalogue used by the analysis scripts
+    if not args['mp_timeout']:
+        args['mp_timeout'] = 6*3600 # a run which hangs is killed and retried, unless --mp-timeout is given
     #args['reach_return'] = 1422.66
     #args['default_damage'] = 4035.00
     args['reach_return'] = 526.0
@@ -60,8 +54,7 @@ def main():
     args['cl_l2_reg'] = 0
     steps = 400000
     args['rb_max_size'] = steps
-    steps_delta_a = 1000
-    steps_delta_b = 4000
+    steps_delta = [1000, 4000] # one entry per stage before the last one
     popsize = 16*6
     G = 100
     use_mp = True
@@ -69,8 +62,7 @@ def main():
 #    ### For debugging
 #    args['mp_debug'] = False
 #    steps       = 3000
-#    steps_delta_a = 50
-#    steps_delta_b = 50
+#    steps_delta = [50, 50]
 #    G = 100
 #    popsize = 3
 #    use_mp = False
@@ -96,37 +88,54 @@ def main():
 
 
     # To ensure fair sampling, enumberate all step_options and select unique ones!
-    step_combinations, step_solutions = [], []
-    for a in categories:
-        for b in categories:
-            sol = comb_to_sol((a,b), steps, steps_delta_a, steps_delta_b)
-            if sol not in step_solutions:
-                step_combinations.append((a,b))
-                step_solutions.append(sol)
+    step_combinations, step_solutions = [], set()
+    for comb in itertools.product(categories, repeat=len(steps_delta)):
+        sol = comb_to_sol(comb, steps, steps_delta)
+        if sol not in step_solutions:
+            step_combinations.append(comb)
+            step_solutions.add(sol)
 
     opt = opt_ce(popsize, step_combinations, categories)
     g = 1
-    #opt = opt_ce.load(root, 'opt.pkl')
-    #g = 2
 
-    hp = Helper(args, root, alg, tasks, starting_task, arg_cores, use_mp=use_mp)
+    ckpt = load_checkpoint(root) if args['resume'] else None
+    if ckpt:
+        opt, g = ckpt['opt'], ckpt['g']
+        print('Resuming at generation {}'.format(g))
+
+    hp = Helper(args, root, alg, tasks, starting_task, arg_cores, use_mp=use_mp,
+                journal=Journal(root, resume=bool(ckpt)),
+                cache=EvaluationCache(root) if args['eval_cache'] else None)
+
+    if args['opt_async']:
+        if args['mp_debug']:
+            sys.stdout = Logger(root + "/stdout.log")
+        def make_cfgs(comb, g, begin):
+            mp_cfgs = hp.gen_cfg_steps([comb_to_sol(comb, steps, steps_delta)], g, begin, options=options)
+            for cfg in mp_cfgs:
+                cfg[0]['test_interval'] = 1 + cfg[0]['seed'] % 30 # spread tests of runs, the same for a repeated seed
+            return mp_cfgs
+        run_async(opt, hp, make_cfgs, root, alg, G, ckpt)
+        hp.close()
+        return
 
     while not opt.stop() and g <= G:
         if args['mp_debug']:
             sys.stdout = Logger(root + "/stdout-g{:04}.log".format(g))
             print("Should work")
 
+        # the random state is saved with the optimizer, a resumed generation asks for the same combinations
         combinations = opt.ask()
 
         # convert sampled options to solutions
         solutions = []
         for comb in combinations:
-            solutions.append(comb_to_sol(comb, steps, steps_delta_a, steps_delta_b))
+            solutions.append(comb_to_sol(comb, steps, steps_delta))
 
         # preparation
         mp_cfgs = hp.gen_cfg_steps(solutions, g, options=options)
         for cfg in mp_cfgs:
-            cfg[0]['test_interval'] = 1+randint(0, 29)
+            cfg[0]['test_interval'] = 1 + cfg[0]['seed'] % 30 # spread tests of runs, the same for a repeated seed
 
         # evaluate and backup immediately
         damage = hp.run(mp_cfgs)
@@ -146,70 +155,12 @@ def main():
 
         # logging
         opt.log(root, alg, g, hp.damage_info, hp.reeval_damage_info, best)
-        opt.save(root, 'opt.pkl')
 
         # new iteration
         g += 1
+        save_checkpoint(root, opt, g)
 
-
-######################################################################################
-def mp_run(mp_run):
-    config, tasks, starting_task = mp_run
-    bailing = None
-    time.sleep(3*random.random())
-    # Run the experiment
-    try:
-        ret = cl_run(tasks, starting_task, **config)
-        print('mp_run: ' +  config['output'] + ' returning ' + '{}'.format(ret))
-        return ret
-    except Exception:
-        bailing = "mp_run {}:\n{}\n".format(config['output'], traceback.format_exc())
-
-    print('mp_run: ' +  config['output'] + ' could not return correctly')
-
-    # take care of fails
-    if bailing:
-        f = open("bailing.out", "a")
-        try:
-            f.write(bailing + "\n")
-        finally:
-            f.close()
-
-    return (None, None, None)
-
-
-######################################################################################
-def do_multiprocessing_pool(arg_cores, mp_cfgs):
-    """Do multiprocesing"""
-    cores = multiprocessing.Value('i', arg_cores)
-    print('cores {0}'.format(cores.value))
-    original_sigint_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
-    pool = multiprocessing.Pool(arg_cores)
-    signal.signal(signal.SIGINT, original_sigint_handler)
-    damage_info = None
-    try:
-        damage_info = pool.map(mp_run, mp_cfgs)
-        print('Finished tasks')
-    except KeyboardInterrupt:
-        pool.terminate()
-        print('Termination complete')
-    else:
-        pool.close()
-        print('Closing complete')
-    pool.join()
-    print('Joining complete')
-
-    # Protection against a list with all None
-    if damage_info and all(di[0] is None for di in damage_info):
-        damage_info = None
-    return damage_info
-
-
-######################################################################################
-def prepare_multiprocessing():
-    # clean bailing.out file
-    f = open("bailing.out", "w")
-    f.close()
+    hp.close()
 
 
 ######################################################################################
@@ -1,18 +1,18 @@
 from __future__ import division
 import multiprocessing
-import traceback
-import signal
 import random
 from datetime import datetime
 import os
 import numpy as np
 import sys
-import pdb
 import time
 
 from ptracker import PerformanceTracker
 from cl_main import cl_run
 from ddpg import parse_args
+from scheduler import Scheduler, steps_cost
+from opt_checkpoint import save_checkpoint, load_checkpoint, Journal, History
+from eval_cache import EvaluationCache, replicate_seed, run_key, solution_key
 
 from opt_cmaes import opt_cmaes
 from opt_bo import opt_bo
@@ -21,9 +21,12 @@ from logger import Logger
 
 random.seed(datetime.now())
 
+# Failed runs of all generations, one JSON record per line
+FAILURES = 'failures.jsonl'
+
 
 class Helper(object):
-    def __init__(self, base_cfg, root, alg, tasks, starting_task, arg_cores, use_mp=True):
+    def __init__(self, base_cfg, root, alg, tasks, starting_task, arg_cores, use_mp=True, journal=None, cache=None):
         self.base_cfg = base_cfg
         self.root = root
         self.alg = alg
@@ -32,56 +35,89 @@ class Helper(object):
         self.arg_cores = arg_cores
         self.use_mp = use_mp
         self.reeval_damage_info = None
+        self.scheduler = None
+        self.journal = journal
+        self.cache = cache
+        self.cache_keys = {} # output -> (key, solution, replicate, seed) of runs not finished yet
 
-    def gen_base_(self, g, mp):
+    def gen_base_(self, g, mp, solution=None, replicate=0):
         cpy_cfg = self.base_cfg.copy()
         cpy_cfg['output']  = '{}/{}-g{:04}-mp{}'.format(self.root, self.alg, g, mp)
         if cpy_cfg['cl_structure']:
             cpy_cfg['cl_save'] = '{}/{}-nn-g{:04}-mp{}'.format(self.root, self.alg, g, mp)
             cpy_cfg['cl_load'] = '{}/{}-nn-g{:04}-mp{}'.format(self.root, self.alg, g-1, mp)
-        if cpy_cfg['seed'] == None:
+        if self.cache:
+            # a repeated solution gets the seeds of its stored runs
+            cpy_cfg['seed'] = replicate_seed(solution, replicate, cpy_cfg['seed'])
+        elif cpy_cfg['seed'] == None:
             cpy_cfg['seed'] = int.from_bytes(os.urandom(4), byteorder='big', signed=False) // 2
         return cpy_cfg
 
-    def gen_cfg(self, solutions=None, g=1, begin=0):
+    def replicates_(self, solutions, fresh):
+        """ Replicate numbers, repeats of a solution count up from 0 or from the first one not cached if 'fresh' """
+        if not self.cache:
+            return [0] * len(solutions)
+        count, replicates = {}, []
+        for solution in solutions:
+            k = solution_key(solution)
+            if k not in count:
+                count[k] = self.cache.replicates(solution) if fresh else 0
+            replicates.append(count[k])
+            count[k] += 1
+        return replicates
+
+    def cacheable_(self, mp_cfg, solution, replicate):
+        if self.cache:
+            self.cache_keys[mp_cfg[0]['output']] = (run_key(mp_cfg, solution), solution, replicate, mp_cfg[0]['seed'])
+        return mp_cfg
+
+    def gen_cfg(self, solutions=None, g=1, begin=0, fresh=False):
         mp_cfgs = []
-        for run, solution in enumerate(solutions):
-            cfg = self.gen_base_(g, begin+run)
+        for run, (solution, replicate) in enumerate(zip(solutions, self.replicates_(solutions, fresh))):
+            cfg = self.gen_base_(g, begin+run, solution, replicate)
             if solution and cfg['cl_load']:
                 np.save(cfg['cl_load'], solution)
-            mp_cfgs.append( (cfg, self.tasks, self.starting_task) )
+            mp_cfgs.append(self.cacheable_((cfg, self.tasks, self.starting_task), solution, replicate))
         return mp_cfgs
 
-    def gen_cfg_steps(self, solutions=None, g=1, begin=0, options=None):
+    def gen_cfg_steps(self, solutions=None, g=1, begin=0, options=None, fresh=False):
         mp_cfgs = []
-        for run, solution in enumerate(solutions):
-            cfg = self.gen_base_(g, begin+run)
+        for run, (solution, replicate) in enumerate(zip(solutions, self.replicates_(solutions, fresh))):
+            cfg = self.gen_base_(g, begin+run, solution, replicate)
             if solution:
                 cfg['steps'] = solution
             if options:
                 cfg['options'] = options
-            mp_cfgs.append( (cfg, self.tasks, self.starting_task) )
+            mp_cfgs.append(self.cacheable_((cfg, self.tasks, self.starting_task), solution, replicate))
         return mp_cfgs
 
     def run(self, mp_cfgs, reeval=False):
+        # runs which finished before the search was resumed or were cached are not repeated
+        done = {}
+        for i, cfg in enumerate(mp_cfgs):
+            di = self.lookup(cfg)
+            if di is not None:
+                done[i] = di
+        todo = [cfg for i, cfg in enumerate(mp_cfgs) if i not in done]
+
         if self.use_mp:
-            damage_info = None
-            while not damage_info: #protection from cases when something wrong happens with learning.
-                damage_info = do_multiprocessing_pool(self.arg_cores, mp_cfgs)
-                if not damage_info:
-                    print('do_multiprocessing_pool returned None')
-                    pdb.set_trace()
-            damage, info, params = zip(*damage_info)
+            self.start_scheduler()
+            # runs which failed all attempts have None damage, the optimizer is told about the rest
+            new_damage_info = do_multiprocessing_pool(self.arg_cores, todo, self.scheduler, record=self.record)
+            if new_damage_info is None:
+                sys.exit('Helper.run: interrupted')
         else:
             # for debug purpose
-            damage, info, params = [], [], []
-            for cfg in mp_cfgs:
+            new_damage_info = []
+            for cfg in todo:
                 config, tasks, starting_task = cfg
                 (damage0, cl_info0, params0) = cl_run(tasks, starting_task, **config)
-                damage.append(damage0)
-                info.append(cl_info0)
-                params.append(params0)
-            damage_info = zip(damage, info, params)
+                self.record(cfg, (damage0, cl_info0, params0))
+                new_damage_info.append((damage0, cl_info0, params0))
+
+        new_damage_info = iter(new_damage_info)
+        damage_info = [done[i] if i in done else next(new_damage_info) for i in range(len(mp_cfgs))]
+        damage, info, params = zip(*damage_info)
 
         if not reeval:
             self.damage_info = list(damage_info).copy()
@@ -90,15 +126,146 @@ class Helper(object):
         return damage
 
 
+    def lookup(self, mp_cfg):
+        """ Damage info of a run which does not have to be started, None otherwise """
+        output = mp_cfg[0]['output']
+        di = self.journal.get(mp_cfg) if self.journal else None
+        key = self.cache_keys.get(output)
+        if di is None and key:
+            di = self.cache.get(key[0])
+            if di is not None:
+                print('Helper: {} is cached'.format(output))
+        if di is not None:
+            self.cache_keys.pop(output, None)
+        return di
+
+    def record(self, mp_cfg, damage_info):
+        """ Called with the configuration which ran, damage_info is None if the run failed """
+        key = self.cache_keys.pop(mp_cfg[0]['output'], None)
+        if damage_info is None:
+            return
+        if self.journal:
+            self.journal.record(mp_cfg, damage_info)
+        # a run retried with a new seed is not the run of the key
+        if key and damage_info[0] is not None and mp_cfg[0]['seed'] == key[3]:
+            self.cache.put(key[0], key[1], key[2], key[3], damage_info)
+
     def reeval_cfgs(self, solutions, g, begin):
-        mp_cfgs = self.gen_cfg(solutions, g, begin)
+        # reevaluations are new runs, not repeats of the stored ones
+        mp_cfgs = self.gen_cfg(solutions, g, begin, fresh=True)
         return mp_cfgs
 
+    def start_scheduler(self):
+        # workers live through all generations
+        if self.scheduler is None or self.scheduler.closed:
+            self.scheduler = create_scheduler(self.arg_cores, self.base_cfg)
+        return self.scheduler
+
+    def close(self):
+        if self.scheduler:
+            self.scheduler.close()
+            self.scheduler = None
+        if self.cache:
+            self.cache.close()
+            self.cache = None
+
+
+def run_async(opt, hp, make_cfgs, root, alg, G, ckpt=None):
+    """
+    Steady-state search. Whenever a core frees up, the optimizer is asked for
+    a new candidate, which is evaluated by the runs make_cfgs(solution, g, begin)
+    returns. The optimizer is told the damage of a candidate as soon as all its
+    runs finished. Every popsize candidates are logged as a generation.
+    Asked and told candidates are appended to the history, the optimizer is
+    saved to the checkpoint once per generation. The search continues from
+    checkpoint 'ckpt' if given: the history after it is replayed, candidates
+    which were pending are evaluated again except for their runs in the journal.
+    opt.reeval is not called.
+    """
+    scheduler = hp.start_scheduler()
+    history = History(root, resume=bool(ckpt))
+    candidates = {} # candidate -> [solution, damage_info of its runs, number of runs left]
+    tasks = {} # task id -> (candidate, run)
+    block = []
+    asked, g = 0, 1
+
+    def checkpoint():
+        save_checkpoint(root, opt, g, pending={c: candidate[0] for c, candidate in candidates.items()},
+                        asked=asked, block=block, history=history.position())
+
+    def tell(solution, damage_info):
+        """ True if a generation is complete """
+        nonlocal block, g
+        opt.tell_one(solution, [d[0] for d in damage_info])
+        block += damage_info
+        if len(block) < opt.popsize * opt.resample:
+            return False
+        opt.log(root, alg, g, block, None)
+        block = []
+        g += 1
+        return True
+
+    def finish(c):
+        solution, damage_info, _ = candidates.pop(c)
+        history.append('tell', c, damage_info)
+        if tell(solution, damage_info):
+            checkpoint()
+
+    def submit(c, solution):
+        mp_cfgs = make_cfgs(solution, 1 + c // opt.popsize, (c % opt.popsize) * opt.resample)
+        candidates[c] = [solution, [None]*len(mp_cfgs), len(mp_cfgs)]
+        for k, mp_cfg in enumerate(mp_cfgs):
+            di = hp.lookup(mp_cfg)
+            if di is not None:
+                candidates[c][1][k] = di
+                candidates[c][2] -= 1
+            else:
+                tasks[scheduler.submit(mp_cfg)] = (c, k)
+        if candidates[c][2] == 0:
+            finish(c)
+
+    if ckpt:
+        asked, g, block = ckpt['asked'], ckpt['g'], ckpt['block']
+        pending = dict(ckpt['pending'])
+        for record in history.read(ckpt['history']):
+            if record[0] == 'ask':
+                _, c, solution = record
+                pending[c] = solution
+                asked = max(asked, c + 1)
+            else:
+                _, c, damage_info = record
+                tell(pending.pop(c), damage_info)
+    else:
+        pending = {}
+        checkpoint() # the history is replayed from the start
+
+    for c, solution in sorted(pending.items()):
+        submit(c, solution)
+
+    while candidates or (asked < G*opt.popsize and not opt.stop()):
+        while scheduler.idle() > 0 and asked < G*opt.popsize and not opt.stop():
+            solution = opt.ask_one([c[0] for c in candidates.values()])
+            c = asked
+            asked += 1
+            history.append('ask', c, solution) # before any run of the candidate can finish
+            submit(c, solution)
+        if not candidates:
+            continue
+
+        tid, di, ran = scheduler.collect(with_task=True)
+        c, k = tasks.pop(tid)
+        hp.record(ran, di)
+        candidate = candidates[c]
+        candidate[1][k] = di if di is not None else (None, None, None)
+        candidate[2] -= 1
+        if candidate[2] == 0:
+            finish(c)
+
 
 def main():
-    prepare_multiprocessing()
     alg = 'ddpg'
     args = parse_args()
+    prepare_multiprocessing(args['resume'])
 
     if args['cores']:
         arg_cores = min(multiprocessing.cpu_count(), args['cores'])
@@ -116,6 +283,10 @@ def main():
     starting_task = 'balancing_tf'
 
     args['mp_debug'] = True
+    args['env_cache'] = True
+    args['results_db'] = True # catalogue used by the analysis scripts
+    if not args['mp_timeout']:
+        args['mp_timeout'] = 6*3600 # a run which hangs is killed and retried, unless --mp-timeout is given
     args['perf_td_error'] = True
     args['perf_l2_reg'] = True
     args['rb_min_size'] = 1000
@@ -166,15 +337,36 @@ def main():
     #opt = opt_cmaes(args, w_num, popsize, reeval_num0)
     search_space = (-1.0, 1.0)
     opt = opt_bo(args, w_num, popsize, resample, search_space)
+    if args['opt_async'] and reeval and isinstance(opt, opt_cmaes):
+        raise Exception('The noise handler of CMA-ES reevaluates whole generations, run it without --opt-async')
+    g = 1
 
-    hp = Helper(args, root, alg, tasks, starting_task, arg_cores, use_mp=use_mp)
+    ckpt = load_checkpoint(root) if args['resume'] else None
+    if ckpt:
+        opt, g = ckpt['opt'], ckpt['g']
+        print('Resuming at generation {}'.format(g))
+
+    hp = Helper(args, root, alg, tasks, starting_task, arg_cores, use_mp=use_mp,
+                journal=Journal(root, resume=bool(ckpt)),
+                cache=EvaluationCache(root) if args['eval_cache'] else None)
+
+    if args['opt_async']:
+        if args['mp_debug']:
+            sys.stdout = Logger(root + "/stdout.log")
+        def make_cfgs(solution, g, begin):
+            if args["cl_reparam"] == "spherical":
+                solution = cart2sph(solution)
+            return hp.gen_cfg([solution]*opt.resample, g, begin)
+        run_async(opt, hp, make_cfgs, root, alg, G, ckpt)
+        hp.close()
+        return
 
-    g = 1
     while not opt.stop() and g <= G:
         if args['mp_debug']:
             sys.stdout = Logger(root + "/stdout-g{:04}.log".format(g))
             print("Should work")
 
+        # the random state is saved with the optimizer, a resumed generation asks for the same solutions
         solutions = opt.ask()
 
         if args["cl_reparam"] == "spherical":
@@ -199,70 +391,89 @@ def main():
 
         # logging
         opt.log(root, alg, g, hp.damage_info, hp.reeval_damage_info, rejected)
-        opt.save(root, 'opt.pkl')
 
         # new iteration
         g += 1
+        save_checkpoint(root, opt, g)
+
+    hp.close()
 
 
 ######################################################################################
+# Set in workers which already ran a job, see mp_run
+warm = False
+
 def mp_run(mp_run):
+    global warm
     config, tasks, starting_task = mp_run
-    bailing = None
-    time.sleep(3*random.random())
-    # Run the experiment
-    try:
-        ret = cl_run(tasks, starting_task, **config)
-        print('mp_run: ' +  config['output'] + ' returning ' + '{}'.format(ret))
-        return ret
-    except Exception:
-        bailing = "mp_run {}:\n{}\n".format(config['output'], traceback.format_exc())
+    if not warm:
+        time.sleep(3*random.random()) # spread the startup of fresh workers only
+    warm = True
+    # Run the experiment, exceptions are recorded by the scheduler
+    ret = cl_run(tasks, starting_task, **config)
+    print('mp_run: ' +  config['output'] + ' returning ' + '{}'.format(ret))
+    return ret
+
 
-    print('mp_run: ' +  config['output'] + ' could not return correctly')
+def reseed(mp_cfg, attempt):
+    """ Failed runs are repeated with a new seed """
+    config, tasks, starting_task = mp_cfg
+    config = dict(config, seed=int.from_bytes(os.urandom(4), byteorder='big', signed=False) // 2)
+    return (config, tasks, starting_task)
 
-    # take care of fails
-    if bailing:
-        f = open("bailing.out", "a")
-        try:
-            f.write(bailing + "\n")
-        finally:
-            f.close()
 
-    return (None, None, None)
+def describe_run(mp_cfg):
+    config, _, _ = mp_cfg
+    return {'output': config['output'], 'seed': config['seed']}
+
+
+def create_scheduler(arg_cores, config):
+    return Scheduler(mp_run, arg_cores, timeout=config['mp_timeout'], retries=config['mp_retries'],
+                     retry=reseed, failures=FAILURES, describe=describe_run)
 
 
 ######################################################################################
-def do_multiprocessing_pool(arg_cores, mp_cfgs):
-    """Do multiprocesing"""
-    cores = multiprocessing.Value('i', arg_cores)
-    print('cores {0}'.format(cores.value))
-    original_sigint_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
-    pool = multiprocessing.Pool(arg_cores)
-    signal.signal(signal.SIGINT, original_sigint_handler)
-    damage_info = None
+def do_multiprocessing_pool(arg_cores, mp_cfgs, scheduler=None, record=None):
+    """
+    Do multiprocesing, longer runs first. Workers of 'scheduler' are kept for the next call.
+    record(mp_cfg, damage_info) is called as soon as a run finished with the configuration
+    which ran, damage_info is None if all attempts failed.
+    """
+    print('cores {0}'.format(arg_cores))
+    if not mp_cfgs:
+        return []
+    costs = [steps_cost(config) for config, _, _ in mp_cfgs]
+    damage_info = [None] * len(mp_cfgs)
+
+    def collect(scheduler):
+        for i, di, ran in scheduler.imap_unordered(mp_cfgs, costs, with_task=True):
+            damage_info[i] = di
+            if record:
+                record(ran, di)
+
     try:
-        damage_info = pool.map(mp_run, mp_cfgs)
+        if scheduler:
+            collect(scheduler)
+        else:
+            with create_scheduler(arg_cores, mp_cfgs[0][0]) as scheduler:
+                collect(scheduler)
         print('Finished tasks')
     except KeyboardInterrupt:
-        pool.terminate()
+        if scheduler:
+            scheduler.terminate()
         print('Termination complete')
-    else:
-        pool.close()
-        print('Closing complete')
-    pool.join()
-    print('Joining complete')
+        return None
 
-    # Protection against a list with all None
-    if damage_info and all(di[0] is None for di in damage_info):
-        damage_info = None
-    return damage_info
+    # runs which failed all attempts
+    return [di if di is not None else (None, None, None) for di in damage_info]
 
 
 ######################################################################################
-def prepare_multiprocessing():
-    # clean bailing.out file
-    f = open("bailing.out", "w")
-    f.close()
+def prepare_multiprocessing(resume=False):
+    # clean failures file, a resumed search keeps the failures recorded before
+    if not resume:
+        f = open(FAILURES, "w")
+        f.close()
 
 
 ######################################################################################
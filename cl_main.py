@@ -14,6 +14,8 @@ os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 from ddpg_loop import start
 from my_monitor import MyMonitor
 from ptracker import PerformanceTracker
+from results_db import register
+from ddpg import with_defaults
 import random
 import numpy as np
 from os.path import exists
@@ -27,15 +29,30 @@ if importlib.util.find_spec("roboschool"):
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
 
-def env_connect(path):
+# Environments kept by long-lived workers between runs, see env_connect
+env_cache = {}
+
+
+def env_connect(path, cache=False, curriculum=None):
+    """
+    With 'cache', an environment is reused by runs with the same 'path' and
+    'curriculum'. The variables the curriculum reconfigures are set to their
+    first values when a run starts, so no state of the previous run is kept.
+    """
+    key = (path, curriculum)
+    if cache and key in env_cache:
+        return env_cache[key]
     if os.path.isfile(path):
         env = Leo(path)
     else:
         env = gym.make(path)
+    if cache:
+        env_cache[key] = env
     return env
 
 
 def cl_run(tasks, cl_mode, **base_cfg):
+    base_cfg = with_defaults(base_cfg)
     assert(base_cfg["trials"] == 0)
     assert(base_cfg["steps"]  != 0)
 
@@ -85,6 +102,7 @@ def cl_run(tasks, cl_mode, **base_cfg):
     avg_test_return = base_cfg['reach_return']
     task_sequence = ('balancing_tf', 'balancing', 'walking')
     norm_complexity = 0
+    replay_buffer = None
 
     while ss < steps and (not base_cfg['reach_return'] or avg_test_return <= base_cfg['reach_return']):
         stage = '-{:02d}_'.format(stage_counter) + cl_mode
@@ -93,7 +111,8 @@ def cl_run(tasks, cl_mode, **base_cfg):
         config['cfg'] = tasks[cl_mode]
         config['output']  = base_cfg['output']  + stage
         config['save']    = base_cfg['output']  + stage
-        config['rb_save_filename'] = base_cfg['output']  + stage
+        if not base_cfg['rb_handoff'] or base_cfg['rb_save_filename']:
+            config['rb_save_filename'] = base_cfg['output']  + stage
         if config['seed'] == None:
             config['seed'] = int.from_bytes(os.urandom(4), byteorder='big', signed=False) // 2
         if base_cfg['cl_save']:
@@ -116,24 +135,33 @@ def cl_run(tasks, cl_mode, **base_cfg):
             env.close()
             env = None
         #pdb.set_trace()
-        env = env_connect(config['cfg'])
-        env = MyMonitor(env, config['output'], report='all')
+        env = env_connect(config['cfg'], cache=config['env_cache'], curriculum=config['curriculum'])
+        env = MyMonitor(env, config['output'], report='all',
+                        log_format=config['monitor_format'], flush_rows=config['monitor_flush_rows'],
+                        close_env=not config['env_cache'])
 
         # load previous stage actor, critic and curriculum
+        rbload = False
         if prev_config:
             config['cl_load'] = prev_config['cl_save']
             if not base_cfg['options']:
                 config['load_file'] = prev_config['output']
-                config['rb_load_filename'] = prev_config['rb_save_filename']
+                rbload = True
             else:
                 opt = base_cfg['options'][cl_mode]
                 if 'nnload' in opt:
                     config['load_file'] = prev_config['output']
                 if 'rbload_re' in opt:
-                    config['rb_load_filename'] = prev_config['rb_save_filename']
+                    rbload = True
                     config['reassess_for'] = opt.split('rbload_re_')[1]
                 elif 'rbload' in opt:
-                    config['rb_load_filename'] = prev_config['rb_save_filename']
+                    rbload = True
+
+        # replay buffer is either handed over in memory or loaded from the file of the previous stage
+        if rbload and not base_cfg['rb_handoff']:
+            config['rb_load_filename'] = prev_config['rb_save_filename']
+        if not rbload or not base_cfg['rb_handoff']:
+            replay_buffer = None
 
         if cl_mode == 'walking':
             config['cl_structure'] = '' # forbid loading curriculum
@@ -146,7 +174,8 @@ def cl_run(tasks, cl_mode, **base_cfg):
             yaml.dump(config, file, default_flow_style=False, allow_unicode=True)
 
         # run the stage
-        avg_test_return, damage_new, ss_new, cl_mode_new, norm_complexity = start(env=env, pt=pt, cl_mode=cl_mode, norm_complexity=norm_complexity, **config)
+        avg_test_return, damage_new, ss_new, cl_mode_new, norm_complexity, replay_buffer = \
+            start(env=env, pt=pt, cl_mode=cl_mode, norm_complexity=norm_complexity, replay_buffer=replay_buffer, **config)
 
         damage += damage_new
         ss += ss_new
@@ -155,6 +184,8 @@ def cl_run(tasks, cl_mode, **base_cfg):
         cl_info += ('{:d}'.format(ss_new)).ljust(7) + ' '
 
         print('cl_run: {} stage {} done'.format(config['output'], stage))
+        if base_cfg['results_db']:
+            register(config, damage=damage_new, steps=ss_new)
         if cl_mode == 'walking':
             print('cl_run: {} exit from the loop {}'.format(config['output'], ss < steps))
             break
@@ -192,5 +223,8 @@ def cl_run(tasks, cl_mode, **base_cfg):
             #damage = 2*walking_avg_damage
             damage = None
 
+    if base_cfg['results_db']:
+        register(base_cfg, damage=damage, steps=ss)
+
     # return final performance
     return (damage, cl_info, list(params))
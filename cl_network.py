@@ -8,6 +8,7 @@ Created on Mon Jan 21 2017
 
 import tensorflow as tf
 import tflearn
+from target_update import soft_update
 from os.path import exists
 from math import sqrt
 import numpy as np
@@ -39,11 +40,7 @@ class NeuralNetwork(object):
         if 'critic' in self.network_type and config["cl_target"]:
             self.target_inputs, self.target_action, self.target_out = self._create_critic(prefix='cltg')
             self.target_network_params = [v for v in tf.trainable_variables() if 'cltg' in v.name]
-            self.update_target_network_params = \
-                [self.target_network_params[i].assign(
-                    tf.multiply(self.network_params[i], self.tau) + tf.multiply(self.target_network_params[i],
-                                                                                1. - self.tau))
-                 for i in range(len(self.target_network_params))]
+            self.update_target_network_params = soft_update(self.network_params, self.target_network_params, self.tau)
 
     def load(self, sess, fname):
         if exists(fname+'.npy'):
@@ -1,7 +1,6 @@
 from __future__ import division
 import numpy as np
 import tensorflow as tf
-import glob
 import pickle
 from sklearn.metrics import r2_score
 import matplotlib.pyplot as plt
@@ -16,6 +15,8 @@ tf.logging.set_verbosity(tf.logging.INFO)
 from ptracker import PerformanceTracker
 from cl_network import CurriculumNetwork
 from ddpg import parse_args
+from monitor_log import read_columns
+from results_db import find_monitors
 plt.close("all")
 
 tt  = 0 # duration
@@ -27,7 +28,9 @@ ns = 3 # number of curriculum stages
 
 def read_file(f, cl_mode=0):
     try:
-        data = np.loadtxt(f, skiprows=3, usecols=(11, 12, 13, 4, 5))
+        data = read_columns(f, ('norm_duration', 'norm_td_error', 'norm_complexity', 'damage', 'distance'))
+        if data is None:
+            data = np.loadtxt(f, skiprows=3, usecols=(11, 12, 13, 4, 5))
     except IndexError:
         return None
     except Exception as e:
@@ -68,7 +71,7 @@ def load_data(path, params, gens = [1]):
     dd = []
     for g in gens:
         pat = path + name_format.format(g, stage_name=stage_names[0])
-        for f in sorted(glob.glob(pat)):
+        for f in find_monitors(pat, 'ddpg', g, stage_names[0]):
             balancing_tf = read_file(f, cl_mode=0)
             balancing    = read_file(f.replace(stage_names[0], stage_names[1]), cl_mode=1)
             walking      = read_file(f.replace(stage_names[0], stage_names[2]), cl_mode=2)
@@ -9,6 +9,7 @@ Created on Mon Jan 16 17:49:02 2017
 import tensorflow as tf
 import tflearn
 from math import sqrt
+from target_update import soft_update, hard_update
 import pdb
 
 class CriticNetwork(object):
@@ -17,7 +18,7 @@ class CriticNetwork(object):
     The action must be obtained from the output of the Actor network.
     """
 
-    def __init__(self, state_dim, action_dim, config, num_actor_vars):
+    def __init__(self, state_dim, action_dim, config, num_actor_vars, actor=None):
         # self.sess = sess
         self.s_dim = state_dim
         self.a_dim = action_dim
@@ -26,38 +27,65 @@ class CriticNetwork(object):
         self.l2 = config["critic_l2_reg"]
         self.batch_norm = config["batch_norm"]
         self.version = config["version"]
+        self.gamma = config["gamma"]
+
+        if actor:
+            # Inputs of both networks are connected to the actor unless they are fed.
+            # Rows [:n] of the online network evaluate the minibatch (s, a), rows [n:]
+            # evaluate (s, mu(s)) for the actor update. Rows [:n] of the target
+            # network evaluate (s2, mu'(s2)) for TD targets, rows [n:] evaluate (s, a)
+            self.batch_action = tf.placeholder(tf.float32, [None, self.a_dim])
+            self.reward = tf.placeholder(tf.float32, [None])
+            self.terminal = tf.placeholder(tf.float32, [None])
+            defaults = (tf.concat([actor.inputs, actor.inputs], 0),
+                        tf.concat([self.batch_action, actor.scaled_out], 0))
+            target_defaults = (tf.concat([actor.target_inputs, actor.inputs], 0),
+                               tf.concat([actor.target_scaled_out, self.batch_action], 0))
+        else:
+            defaults, target_defaults = (None, None), (None, None)
 
         # Create the critic network
-        self.inputs, self.action, self.out = self.create_critic_network()
+        self.inputs, self.action, self.out = self.create_critic_network('', *defaults)
 
         self.network_params = tf.trainable_variables()[num_actor_vars:]
         # Target Network
-        self.target_inputs, self.target_action, self.target_out = self.create_critic_network(prefix='target_')
+        self.target_inputs, self.target_action, self.target_out = self.create_critic_network('target_', *target_defaults)
 
         self.target_network_params = tf.trainable_variables()[(len(self.network_params) + num_actor_vars):]
 
         # Op for periodically updating target network with online network weights with regularization
-        self.update_target_network_params = \
-            [self.target_network_params[i].assign(
-                tf.multiply(self.network_params[i], self.tau) + tf.multiply(self.target_network_params[i],
-                                                                            1. - self.tau))
-             for i in range(len(self.target_network_params))]
+        self.update_target_network_params = soft_update(self.network_params, self.target_network_params, self.tau)
+        self.copy_target_network_params = hard_update(self.network_params, self.target_network_params)
 
         # Network target (y_i)
-        self.predicted_q_value = tf.placeholder(tf.float32, [None, 1])
+        if actor:
+            n = tf.shape(self.reward)[0]
+            y = self.reward + self.gamma * (1. - self.terminal) * self.target_out[:n, 0]
+            self.predicted_q_value = tf.placeholder_with_default(tf.stop_gradient(tf.reshape(y, [-1, 1])), [None, 1])
+        else:
+            self.predicted_q_value = tf.placeholder(tf.float32, [None, 1])
+
+        # Importance-sampling weights of prioritized experience replay, ones by default
+        self.weights = tf.placeholder_with_default(tf.ones_like(self.predicted_q_value), [None, 1])
 
         # Define loss and optimization Op
         self.l2_reg = tf.add_n([ tf.nn.l2_loss(v) for v in self.network_params if 'bias' not in v.name ]) * self.l2
 
-        self.loss = tflearn.mean_square(self.predicted_q_value, self.out) + self.l2_reg
-        self.optimize = tf.train.AdamOptimizer(self.learning_rate).minimize(self.loss)
+        q = self.out[:tf.shape(self.predicted_q_value)[0]]
+        self.loss = tf.reduce_mean(self.weights * tf.square(q - self.predicted_q_value)) + self.l2_reg
+        self.adam = tf.train.AdamOptimizer(self.learning_rate)
+        self.optimize = self.adam.minimize(self.loss, var_list=self.network_params)
 
         # Get the gradient of the net w.r.t. the action
         self.action_grads = tf.gradients(self.out, self.action)
 
-    def create_critic_network(self, prefix=''):
-        inputs = tflearn.input_data(shape=[None, self.s_dim])
-        action = tflearn.input_data(shape=[None, self.a_dim])
+    def create_critic_network(self, prefix='', default_inputs=None, default_action=None):
+        if default_inputs is None:
+            inputs = tflearn.input_data(shape=[None, self.s_dim])
+            action = tflearn.input_data(shape=[None, self.a_dim])
+        else:
+            inputs = tf.placeholder_with_default(default_inputs, [None, self.s_dim])
+            action = tf.placeholder_with_default(default_action, [None, self.a_dim])
         weights_init1 = tflearn.initializations.uniform(minval=-1/sqrt(self.s_dim), maxval=1/sqrt(self.s_dim))
         critic_layer1 = tflearn.fully_connected(inputs, 400, name="{}criticLayer1".format(prefix), weights_init=weights_init1)
         if self.batch_norm:
@@ -88,19 +116,23 @@ class CriticNetwork(object):
         critic_output = tflearn.fully_connected(net, 1, weights_init=w_init, name="{}criticOutput".format(prefix))
         return inputs, action, critic_output
 
-    def train(self, sess, inputs, action, predicted_q_value):
-        return sess.run([self.out, self.optimize], feed_dict={
-            self.inputs: inputs,
-            self.action: action,
-            self.predicted_q_value: predicted_q_value
-        })
+    def train(self, sess, inputs, action, predicted_q_value, weights=None):
+        return sess.run([self.out, self.optimize], feed_dict=self._train_feed(
+            inputs, action, predicted_q_value, weights))
+
+    def train_(self, sess, inputs, action, predicted_q_value, weights=None):
+        return sess.run([self.out, self.optimize, self.l2_reg], feed_dict=self._train_feed(
+            inputs, action, predicted_q_value, weights))
 
-    def train_(self, sess, inputs, action, predicted_q_value):
-        return sess.run([self.out, self.optimize, self.l2_reg], feed_dict={
+    def _train_feed(self, inputs, action, predicted_q_value, weights):
+        feed_dict = {
             self.inputs: inputs,
             self.action: action,
             self.predicted_q_value: predicted_q_value
-        })
+        }
+        if weights is not None:
+            feed_dict[self.weights] = weights
+        return feed_dict
 
     def l2_reg_(self, sess):
         return sess.run(self.l2_reg)
@@ -14,12 +14,13 @@ import yaml
 import os
 import pdb
 from importlib import reload
-from ddpg_loop import start
 from my_monitor import MyMonitor
+from vec_env import make_vec_env
+from results_db import register
+from play import can_play, play
 
 import gym
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
-import tensorflow as tf
 
 def boolean_flag(parser, name, default=False, help=None):
     """Add a boolean flag to argparse parser."""
@@ -28,32 +29,48 @@ def boolean_flag(parser, name, default=False, help=None):
     parser.add_argument("--no-" + name, action="store_false", dest=dest)
 
 def cfg_run(**config):
+    config = with_defaults(config)
     with open("{}.yaml".format(config['output']), 'w', encoding='utf8') as file:
         yaml.dump(config, file, default_flow_style=False, allow_unicode=True)
     del config['cores']
     if config['seed'] == None:
         config['seed'] = int.from_bytes(os.urandom(4), byteorder='big', signed=False) // 2
     run(**config)
+    if config['results_db']:
+        register(config)
 
 def run(cfg, **config):
+    config = with_defaults(dict(config, cfg=cfg))
+
     # Create envs.
-    if os.path.isfile(cfg):
-        env = Leo(cfg)
+    if config['vec_envs'] > 1:
+        env = make_vec_env(cfg, config['vec_envs'], config['output'], report=config['env_report'],
+                           subproc=config['vec_subproc'], log_format=config['monitor_format'],
+                           flush_rows=config['monitor_flush_rows'])
     else:
-        import roboschool
-        env = gym.make(cfg)
-        #pdb.set_trace()
-        env.seed(config['seed'])
+        if os.path.isfile(cfg):
+            env = Leo(cfg)
+        else:
+            import roboschool
+            env = gym.make(cfg)
+            #pdb.set_trace()
+            env.seed(config['seed'])
 
-    env = MyMonitor(env, config['output'], report=config['env_report'])
+        env = MyMonitor(env, config['output'], report=config['env_report'],
+                        log_format=config['monitor_format'], flush_rows=config['monitor_flush_rows'])
 
     start_time = time.time()
-    start(env=env, **config)
+    if config['np_play'] and can_play(**config):
+        play(env, **config)
+    else:
+        # TensorFlow is imported only when needed
+        from ddpg_loop import start
+        start(env=env, **config)
     print('total runtime: {}s'.format(time.time() - start_time))
 
     env.close()
 
-def parse_args():
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
     # Flow options
@@ -61,6 +78,13 @@ def parse_args():
     boolean_flag(parser,  'tensorboard', default=False)
     parser.add_argument('--version', type=int, default=0)
     boolean_flag(parser,  'mp_debug', default=False)
+    parser.add_argument('--mp-timeout', type=float, default=0, help='Seconds after which a run of a sweep is killed and retried, 0 disables')
+    parser.add_argument('--mp-retries', type=int, default=2, help='Number of times a failed run of a sweep is repeated with a new seed')
+    boolean_flag(parser,  'opt-async', default=False, help='Ask the curriculum optimizer for a new candidate whenever a core frees up instead of per generation')
+    boolean_flag(parser,  'resume', default=False, help='Continue a curriculum search from the checkpoint in its directory')
+    boolean_flag(parser,  'eval-cache', default=False, help='Derive seeds from curriculum solutions and reuse runs of cache.db which were evaluated before')
+    boolean_flag(parser,  'results-db', default=False, help='Register finished runs in results.db next to their output')
+    boolean_flag(parser,  'env-cache', default=False, help='Keep environments of curriculum stages for the next run in the same process')
     parser.add_argument('--options', type=dict, default=None, help='Options which specify what to reload at each curriculum stage')
 
     # Task execution
@@ -69,6 +93,11 @@ def parse_args():
     parser.add_argument('--env-timestep', type=float, default=0.03)
     parser.add_argument('--env-td-error-scale', type=float, default=600.0, help='Approximate scale of TD errors')
     parser.add_argument('--env-report', type=str, default='test')
+    parser.add_argument('--monitor-format', type=str, default='csv', choices=['csv', 'binary', 'both'], help='Monitor log as text lines, typed binary columns or both')
+    parser.add_argument('--monitor-flush-rows', type=int, default=64, help='Rows buffered before a block of the binary monitor log is written')
+    boolean_flag(parser,  'profile', default=False, help='Export time spent in phases of the step loop next to the monitor file')
+    parser.add_argument('--vec-envs', type=int, default=1, help='Number of environment copies stepped in lockstep')
+    boolean_flag(parser,  'vec-subproc', default=True, help='Run environment copies in subprocesses rather than in-process')
     parser.add_argument('--trials', type=int, default=0)
     parser.add_argument('--steps', type=int, default=1000) #
     parser.add_argument('--reach_timeout', type=float, default=0, help='Finish if trial happend to be longer then reach_balance reach_timeout_num in a row. 0 means desabled')
@@ -88,6 +117,9 @@ def parse_args():
     parser.add_argument('--cl-lr', type=float, default=0.001)
     parser.add_argument('--cl-dropout-keep', type=float, default=1.0)
     parser.add_argument('--cl-cmaes-sigma0', type=float, default=4.0)
+    parser.add_argument('--cl-bo-surrogate', type=str, default='gp', choices=['gp', 'rff'], help='Surrogate of opt_bo, rff scales to many evaluations and dimensions')
+    parser.add_argument('--cl-bo-features', type=int, default=500, help='Number of random Fourier features of the rff surrogate')
+    boolean_flag(parser,  'cl-bo-trust-region', default=True, help='Search the rff surrogate in a trust region around the best point')
     boolean_flag(parser,  'cl-batch-norm', default=False)
     boolean_flag(parser,  'cl-input-norm', default=False)
     boolean_flag(parser,  'cl-running-norm', default=False)
@@ -117,13 +149,29 @@ def parse_args():
     parser.add_argument('--gamma', type=float, default=0.99)
     parser.add_argument('--reward-scale', type=float, default=1.)
     parser.add_argument('--clip-norm', type=float, default=None)
+    boolean_flag(parser,  'fused-update', default=False, help='Perform the whole DDPG update in a single session call, requires --no-batch-norm')
+    parser.add_argument('--train-every', type=int, default=1, help='Number of environment steps between updates')
+    parser.add_argument('--train-steps', type=int, default=1, help='Number of minibatch updates performed every --train-every steps')
+    boolean_flag(parser,  'async-learner', default=False, help='Perform updates in a learner thread running concurrently with the environment')
+    parser.add_argument('--async-max-lag', type=int, default=10, help='Number of update rounds the learner thread may be ahead or behind the schedule')
+    parser.add_argument('--np-actor-sync', type=int, default=0, help='Select actions with a NumPy copy of the actor refreshed every N updates (0 - use TensorFlow)')
+    parser.add_argument('--target-update-interval', type=int, default=1, help='Number of updates between target network updates')
+    boolean_flag(parser,  'hard-target-update', default=False, help='Copy networks to target networks instead of the soft update')
+    parser.add_argument('--checkpoint-keep', type=int, default=1, help='Number of -best and -last checkpoints kept, more than 1 appends step numbers')
+    boolean_flag(parser,  'checkpoint-async', default=True, help='Write policy checkpoints in a background thread')
+    boolean_flag(parser,  'np-play', default=False, help='Play the exported .npz policy without TensorFlow if it exists')
 
     # Replay Buffer options
     parser.add_argument('--minibatch-size', type=int, default=64)
-    parser.add_argument('--rb-max-size', type=int, default=None)
+    parser.add_argument('--rb-max-size', type=int, default=None, help='Replay buffer capacity in experiences, has to be set')
+    parser.add_argument('--rb-storage', type=str, default='deque', choices=['deque', 'array'], help='Replay buffer storage: deque of tuples or preallocated numpy arrays (array). Arrays are used anyway to load a .rb file or continue with arrays of the previous stage')
     parser.add_argument('--rb-min-size', type=int, default=1000)
     parser.add_argument('--rb-save-filename', type=str, default='')
     parser.add_argument('--rb-load-filename', type=str, default='')
+    boolean_flag(parser,  'rb-handoff', default=False, help='Pass replay buffer to the next curriculum stage in memory instead of through files')
+    boolean_flag(parser,  'rb-prioritized', default=False, help='Prioritized experience replay')
+    parser.add_argument('--rb-alpha', type=float, default=0.6, help='Prioritization exponent')
+    parser.add_argument('--rb-beta', type=float, default=0.4, help='Importance-sampling exponent')
     parser.add_argument('--reassess-for', type=str, default='')
 
     # Performance trackers
@@ -137,11 +185,21 @@ def parse_args():
     parser.add_argument('--trajectory', type=str, default=None)
     parser.add_argument('--load-file', type=str, default='')
     boolean_flag(parser,  'save', default=False)
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     dict_args = vars(args)
     return dict_args
 
 
+def with_defaults(config):
+    """
+    Default values of all options updated with 'config', which may lack options
+    added after it was written, e.g. a .yaml file of an earlier run
+    """
+    dict_args = parse_args([])
+    dict_args.update(config)
+    return dict_args
+
+
 if __name__ == '__main__':
     args = parse_args()
 
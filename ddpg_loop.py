@@ -8,15 +8,21 @@ Created on Mon Jan 16 17:49:02 2017
 import tensorflow as tf
 import numpy as np
 import os.path
-from replaybuffer_ddpg import ReplayBuffer
+from replaybuffer_ddpg import create_replay_buffer, LockedReplayBuffer
 from assessment import Evaluator
 from ExplorationNoise import ExplorationNoise
 from actor import ActorNetwork
+from actor_np import NumpyActor
+from play import dump_pkl_csv
+from profiler import PhaseProfiler
 from critic import CriticNetwork
+from fused_update import FusedUpdate
+from checkpoint import CheckpointManager, policy_variables, resolve_checkpoint
 from cl_network import CurriculumNetwork
 import random
 from running_mean_std import RunningMeanStd
-import json
+import time
+import threading
 import pdb
 import pickle
 
@@ -30,14 +36,11 @@ def preload_policy(sess, config):
         for sfx in suffixes:
             load_file = config["load_file"] + sfx
             path = os.path.dirname(os.path.abspath(__file__))
-            load_file = "{}/{}".format(path, load_file)
-            meta_file = "{}.meta".format(load_file)
-            if os.path.isfile(meta_file):
-                var_all = tf.global_variables() #tf.trainable_variables()
-                var_this = [v for v in var_all if not 'curriculum' in v.name]
-                saver = tf.train.Saver(var_this)
+            load_file = resolve_checkpoint("{}/{}".format(path, load_file))
+            if load_file:
+                saver = tf.train.Saver(policy_variables())
                 saver.restore(sess, load_file)
-                print("Loaded NN from {}".format(meta_file))
+                print("Loaded NN from {}.meta".format(load_file))
                 loaded = True
                 break
         if not loaded:
@@ -48,30 +51,15 @@ def preload_policy(sess, config):
     return sess
 
 
-def save_policy(sess, config, suffix = "", global_step = None):
-    if config["output"]:
-        var_all = tf.global_variables() #tf.trainable_variables()
-        var_this = [v for v in var_all if not 'curriculum' in v.name]
-        saver = tf.train.Saver(var_this)
-        saver.save(sess, "./{}{}".format(config["output"], suffix), global_step)
-
-
-def dump_pkl_csv(fname, data):
-    if len(data):
-        if '.pkl' in fname:
-            with open(fname,'wb') as f:
-                pickle.dump(np.array(data), f)
-        else:
-            np.savetxt(fname+'.csv', data)
-
 # ===========================
 # Helper function
 # ===========================
-def compute_action(sess, actor, obs, noise, test):
-    if test:
-        action = actor.predict(sess, np.reshape(obs, (1, actor.s_dim)))
+def compute_action(sess, actor, obs, noise, test, np_actor=None):
+    if np_actor:
+        action = np_actor.predict(np.reshape(obs, (1, actor.s_dim)))
     else:
         action = actor.predict(sess, np.reshape(obs, (1, actor.s_dim)))
+    if not test:
         action += noise
     action = np.reshape(action, (actor.a_dim,))
     action = np.clip(action, -1, 1)
@@ -89,6 +77,42 @@ def cur_gen(steps, x):
         while True:
             yield steps, x[0]
 
+def create_np_actor(sess, actor, config, check_size=16):
+    """
+    NumPy copy of the actor used for action selection, verified against TensorFlow.
+    If they differ, None is returned and actions are computed by TensorFlow.
+    """
+    if not config['np_actor_sync']:
+        return None
+    np_actor = NumpyActor(actor.get_weights(sess), actor.action_bound)
+    inputs = np.random.RandomState(0).uniform(-1, 1, (check_size, actor.s_dim)) # keep the global RNG intact
+    diff = np.max(np.abs(np_actor.predict(inputs) - actor.predict(sess, inputs)))
+    if not diff < 1e-4:
+        print('Warning: NumPy actor differs from TensorFlow actor by {}, using TensorFlow'.format(diff))
+        return None
+    return np_actor
+
+def sync_np_actor(sess, actor, np_actor, updates, config, learner=None):
+    """ Refresh NumPy actor weights every config['np_actor_sync'] updates, between update rounds of the learner thread """
+    if np_actor and updates - np_actor.updates >= config['np_actor_sync']:
+        if not learner:
+            np_actor.set_weights(actor.get_weights(sess), updates)
+            return
+        with learner.update_lock:
+            np_actor.set_weights(actor.get_weights(sess), updates)
+
+def make_curriculums(config):
+    curriculums = []
+    if config["curriculum"]:
+        print("Following curriculum {}".format(config["curriculum"]))
+        items = config["curriculum"].split(";")
+        for item in items:
+            params = item.split("_")
+            x = np.array(params[1:]).astype(np.float)
+            c = {'var': params[0], 'gen': cur_gen(config["steps"], x)}
+            curriculums.append(c)
+    return curriculums
+
 def normalize(x, stats):
     if stats is None:
         return x
@@ -102,6 +126,226 @@ def obs_normalize(obs, obs_rms, obs_range, o_dims, normalize_observations):
     obs[:o_dims] = np.clip(normalize(obsx, obs_rms) , obs_range[0], obs_range[1])
     return obs
 
+def sample_minibatches(replay_buffer, minibatch_size, num, prioritized):
+    """
+    Sample 'num' minibatches. Uniform minibatches come from a single call to the replay buffer.
+    Prioritized ones are sampled one by one, since stratified indexes are ordered along
+    the buffer and importance-sampling weights are normalized per sample.
+    """
+    if prioritized:
+        return [replay_buffer.sample_prioritized(minibatch_size) for _ in range(num)]
+
+    s_batch, a_batch, r_batch, t_batch, s2_batch = replay_buffer.sample_batch(num*minibatch_size)
+    minibatches = []
+    for k in range(0, len(s_batch), minibatch_size):
+        mb = slice(k, k+minibatch_size)
+        minibatches.append((s_batch[mb], a_batch[mb], r_batch[mb], t_batch[mb], s2_batch[mb], None, None))
+    return minibatches
+
+def reset_perf(perf):
+    """ Reset performance indicators accumulated between testing trials """
+    for key in ['ss', 'td', 'l2_reg', 'action_grad', 'actor_grad']:
+        perf[key] = 0
+    return perf
+
+def new_perf(prev_l2_reg):
+    """ Performance indicators together with counters which are never reset """
+    return reset_perf({'prev_l2_reg': prev_l2_reg, 'updates': 0, 'update_time': 0, 'total_updates': 0})
+
+def train_round(sess, actor, critic, fused_update, replay_buffer, perf, config):
+    """ Perform config['train_steps'] updates and accumulate their performance indicators """
+    tu = time.time()
+    for batch in sample_minibatches(replay_buffer, config["minibatch_size"], config['train_steps'], config['rb_prioritized']):
+        perf['total_updates'] += 1
+        update_targets = perf['total_updates'] % config['target_update_interval'] == 0
+        td, l2_reg, action_grad, actor_grad = update_networks(sess, actor, critic, fused_update, replay_buffer, batch, config, update_targets)
+        perf['td'] += td
+        if l2_reg is not None:
+            perf['l2_reg'] += (l2_reg - perf['prev_l2_reg'])
+            perf['prev_l2_reg'] = l2_reg
+        perf['action_grad'] += action_grad
+        perf['actor_grad'] += actor_grad
+        perf['ss'] += 1
+        perf['updates'] += 1
+    perf['update_time'] += time.time() - tu
+
+class AsyncLearner(threading.Thread):
+    """
+    Learner thread running concurrently with the acting loop. The acting loop
+    schedules update rounds as in the synchronous case, and the learner may be
+    at most 'async_max_lag' rounds ahead or behind; otherwise the faster side
+    waits. The acting loop keeps using the live actor weights.
+    """
+
+    def __init__(self, sess, actor, critic, fused_update, replay_buffer, config):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.sess = sess
+        self.actor = actor
+        self.critic = critic
+        self.fused_update = fused_update
+        self.replay_buffer = replay_buffer
+        self.config = config
+        self.max_lag = config['async_max_lag']
+        self.perf = new_perf(critic.l2_reg_(sess))
+        self.cond = threading.Condition()
+        self.scheduled = 0
+        self.done = 0
+        self.stopped = False
+        self.error = None
+        self.update_lock = threading.Lock() # held during an update round
+
+    def schedule(self, rounds):
+        """ Called by the acting loop, blocks while the learner is too far behind """
+        with self.cond:
+            self.scheduled += rounds
+            self.cond.notify_all()
+            while not self.stopped and self.scheduled - self.done > self.max_lag:
+                self.cond.wait()
+        if self.error:
+            raise self.error
+
+    def collect(self, perf):
+        """ Move performance indicators accumulated by the learner to 'perf' """
+        with self.cond:
+            for key in ['ss', 'td', 'l2_reg', 'action_grad', 'actor_grad', 'updates', 'update_time']:
+                perf[key] += self.perf[key]
+                self.perf[key] = 0
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        self.join()
+
+    def run(self):
+        perf = new_perf(self.perf['prev_l2_reg'])
+        try:
+            while True:
+                with self.cond:
+                    # nothing is scheduled before the replay buffer is filled
+                    while not self.stopped and (self.scheduled == 0 or self.done - self.scheduled >= self.max_lag):
+                        self.cond.wait()
+                    if self.stopped:
+                        break
+                with self.update_lock:
+                    train_round(self.sess, self.actor, self.critic, self.fused_update, self.replay_buffer, perf, self.config)
+                with self.cond:
+                    self.done += 1
+                    for key in ['ss', 'td', 'l2_reg', 'action_grad', 'actor_grad', 'updates', 'update_time']:
+                        self.perf[key] += perf[key]
+                        perf[key] = 0
+                    self.cond.notify_all()
+        except Exception as e:
+            self.error = e
+            with self.cond:
+                self.stopped = True
+                self.cond.notify_all()
+
+def start_learner(sess, actor, critic, fused_update, replay_buffer, config):
+    """ Start the learner thread if requested, the replay buffer becomes shared between threads """
+    if not config['async_learner']:
+        return None, replay_buffer
+    replay_buffer = LockedReplayBuffer(replay_buffer)
+    learner = AsyncLearner(sess, actor, critic, fused_update, replay_buffer, config)
+    learner.start()
+    return learner, replay_buffer
+
+def stop_learner(learner, replay_buffer, perf):
+    """ Stop the learner thread and return the replay buffer it shared """
+    if not learner:
+        return replay_buffer
+    learner.stop()
+    learner.collect(perf)
+    if learner.error:
+        raise learner.error
+    return replay_buffer.buffer
+
+def save_best(checkpoints, learner, ss, obs_rms):
+    """ Snapshot the policy between update rounds of the learner thread, so that it is not torn """
+    if not learner:
+        checkpoints.save("-best", ss, obs_rms)
+        return
+    with learner.update_lock:
+        checkpoints.save("-best", ss, obs_rms)
+
+def print_throughput(output, steps, loop_time, perf):
+    """ Throughput of simulation and learning """
+    print('train: {} env steps/s {:.1f}, updates/s {:.1f}, time spent in updates {:.1f}%'.format(
+        output, steps/loop_time if loop_time else 0,
+        perf['updates']/perf['update_time'] if perf['update_time'] else 0,
+        100*perf['update_time']/loop_time if loop_time else 0))
+
+def update_networks(sess, actor, critic, fused_update, replay_buffer, batch, config, update_targets=True):
+    """
+    Update critic, actor and, if 'update_targets' is set, target networks using one minibatch.
+    Returns performance indicators: TD error, l2 regularization (None if not
+    tracked), norms of action and actor gradients.
+    """
+    s_batch, a_batch, r_batch, t_batch, s2_batch, w_batch, idx_batch = batch
+    minibatch_size = len(s_batch)
+    td, l2_reg, action_grad, actor_grad = 0, None, 0, 0
+
+    if fused_update:
+        # Targets, critic, actor and target networks in one call
+        res = fused_update.train(sess, s_batch, a_batch, r_batch, t_batch, s2_batch, w_batch, update_targets)
+        y_i, q_out = res['y'], res['q']
+        if config['perf_td_error']:
+            td = res['td_error']
+        if config['perf_l2_reg']:
+            l2_reg = res['l2_reg']
+        if config['perf_action_grad']:
+            action_grad = np.linalg.norm(res['action_grad'], ord=2)
+        if config['perf_actor_grad']:
+            for ag in res['actor_grad']:
+                actor_grad += np.linalg.norm(ag, ord=2)
+    else:
+        # Calculate targets
+        target_q = critic.predict_target(sess, s2_batch, actor.predict_target(sess, s2_batch))
+
+        y_i = []
+        for k in range(minibatch_size):
+            if t_batch[k]:
+                y_i.append(r_batch[k])
+            else:
+                y_i.append(r_batch[k] + config["gamma"] * target_q[k][0]) # target_q: list -> float
+
+        if config['perf_td_error']:
+            q_i = critic.predict_target(sess, s_batch, a_batch)
+            td = np.sum(np.abs(q_i-np.reshape(y_i,newshape=(minibatch_size,1))))
+
+        # Update the critic given the targets
+        if config['perf_l2_reg']:
+            q_out, _, l2_reg = critic.train_(sess, s_batch, a_batch, np.reshape(y_i, (minibatch_size, 1)), w_batch)
+        else:
+            q_out, _ = critic.train(sess, s_batch, a_batch, np.reshape(y_i, (minibatch_size, 1)), w_batch)
+
+        # Update the actor policy using the sampled gradient
+        a_outs = actor.predict(sess, s_batch)
+        grad = critic.action_gradients(sess, s_batch, a_outs)[0]
+        if config['perf_action_grad']:
+            action_grad = np.linalg.norm(grad, ord=2)
+
+        if config['perf_actor_grad']:
+            _, actor_grads = actor.train_(sess, s_batch, grad)
+            for ag in actor_grads:
+                actor_grad += np.linalg.norm(ag, ord=2)
+        else:
+            actor.train(sess, s_batch, grad)
+
+        # Update target networks
+        if update_targets:
+            if config['hard_target_update']:
+                sess.run([actor.copy_target_network_params, critic.copy_target_network_params])
+            else:
+                sess.run([actor.update_target_network_params, critic.update_target_network_params])
+
+    # TD errors of the critic before the update serve as new priorities
+    if config['rb_prioritized']:
+        replay_buffer.update_priorities(idx_batch, np.reshape(y_i, (minibatch_size, 1)) - q_out)
+
+    return td, l2_reg, action_grad, actor_grad
+
 # ===========================
 #   Compare Agents
 # ===========================
@@ -112,64 +356,186 @@ def compare(env, ddpg, actor, critic, compare_with_graph, compare_with_actor,
     with tf.Session(graph=compare_with_graph, config=tf.ConfigProto(gpu_options=gpu_options)) as compare_with_sess:
         # also load balancing actor
         saver = tf.train.Saver()
-        saver.restore(compare_with_sess, config["compare_with"])
+        saver.restore(compare_with_sess, resolve_checkpoint(config["compare_with"]) or config["compare_with"])
         train(env, ddpg, actor, critic, cl_nn=cl_nn, pt=pt, cl_mode=cl_mode,
               compare_with_sess=compare_with_sess, compare_with_actor=compare_with_actor, **config)
 
 # ===========================
-#   Agent Training
+#   Parts of the training loop shared by train and train_vec
 # ===========================
-def train(env, ddpg_graph, actor, critic, cl_nn = None, pt = None, cl_mode=None, compare_with_sess=None, compare_with_actor=None, norm_complexity=0, **config):
-
-    print('train: ' + config['output'] + ' started!')
+def print_settings(config):
     print("Noise: {} and {}".format(config["ou_sigma"], config["ou_theta"]))
     print("Actor learning rate {}".format(config["actor_lr"]))
     print("Critic learning rate {}".format(config["critic_lr"]))
     print("Minibatch size {}".format(config["minibatch_size"]))
 
-    curriculums = []
-    if config["curriculum"]:
-        print("Following curriculum {}".format(config["curriculum"]))
-        items = config["curriculum"].split(";")
-        for item in items:
-            params = item.split("_")
-            x = np.array(params[1:]).astype(np.float)
-            c = {'var': params[0], 'gen': cur_gen(config["steps"], x)}
-            curriculums.append(c)
+def init_session(sess, actor, critic, cl_nn, config):
+    """ Load or initialize networks, returns the session, checkpoint manager (if saving) and NumPy actor """
+    # Check if a policy needs to be loaded
+    sess = preload_policy(sess, config)
+
+    # Initialize target network weights
+    actor.update_target_network(sess)
+    critic.update_target_network(sess)
+
+    # Policy checkpoints are written in the background
+    checkpoints = CheckpointManager(sess, config) if config['save'] else None
+
+    # Optionally, actions are computed in NumPy
+    np_actor = create_np_actor(sess, actor, config)
+
+    # Load curriculum neural network weights (provided parametes have priority)
+    if cl_nn:
+        sess = cl_nn.load(sess, config["cl_load"])
+    return sess, checkpoints, np_actor
+
+def init_replay_buffer(replay_buffer, o_dims, max_action, config):
+    """ New replay memory or the one of the previous stage, with experiences loaded from a file """
+    if replay_buffer is not None:
+        assert(replay_buffer.o_dims == o_dims)
+    replay_buffer = create_replay_buffer(config, o_dims=o_dims, replay_buffer=replay_buffer)
+
+    # rewarding object if rewards in replay buffer are to be recalculated
+    replay_buffer.load()
+    if config['reassess_for']:
+        print('Reassessing replay buffer for {}'.format(config['reassess_for']))
+        evaluator = Evaluator(max_action)
+        replay_buffer = evaluator.add_bonus(replay_buffer, how = config['reassess_for'])
+    return replay_buffer
+
+def initial_mode(sess, cl_nn, pt, cl_mode):
+    """ Mode decided by the curriculum network, its thresholds and the environment state exported at the start """
+    if not cl_nn:
+        return cl_mode, None, None, {}
+    v = pt.flatten()
+    cl_mode_new, cl_threshold = cl_nn.predict(sess, v)
+    more_info = ''.join('{:10.2f}'.format(indi) for indi in [-100, -100, -100])
+    more_info += ''.join('{:10.2f}'.format(vvv) for vv in v[0] for vvv in vv)
+    more_info += ''.join('{:10.2f}'.format(th) for th in cl_threshold)
+    columns = dict(indicators=[-100, -100, -100], pt=v, thresholds=cl_threshold)
+    return cl_mode_new, cl_threshold, more_info, columns
+
+def update_curriculums(env, curriculums, ss=None):
+    """ Reconfigure the environment when a curriculum passes its next step, all of them at the start """
+    for c in curriculums:
+        if ss is None or ss > c['ss']:
+            c['ss'], val = next(c['gen'])
+            d = {"action": "update_{}".format(c['var']), c['var']: val}
+            env.reconfigure(d)
+
+def keep_training(tt, ss, cl_nn, cl_mode_new, cl_mode, avg_test_return, reach_timeout_num, config):
+    """
+    Finish when trials finish
+    or Finish when steps finish
+    or Finishe when new mode in curriculum is switched
+    or Finish when certain return is reached
+    of Finish if trial happend to be longer then config['reach_balance'] twice in a row
+    """
+    return (config["trials"] == 0 or tt < config["trials"]) and \
+           (config["steps"]  == 0 or ss < config["steps"]) and \
+           (not cl_nn or cl_mode_new == cl_mode) and \
+           (not config['reach_return'] or avg_test_return <= config['reach_return']) and \
+           (not config['reach_timeout'] or (config['reach_timeout'] > 0 and reach_timeout_num < config['reach_timeout_num']))
+
+def learn(sess, actor, critic, fused_update, replay_buffer, learner, np_actor, perf, rounds, config):
+    """ Perform or schedule 'rounds' update rounds, then refresh the NumPy actor """
+    if learner:
+        if rounds:
+            learner.schedule(rounds)
+    else:
+        for _ in range(rounds):
+            train_round(sess, actor, critic, fused_update, replay_buffer, perf, config)
+    sync_np_actor(sess, actor, np_actor, learner.done*config['train_steps'] if learner else perf['updates'], config, learner)
+
+def test_trial_info(sess, info, perf, learner, cl_nn, pt, norm_complexity, config):
+    """
+    NN performance indicators at the end of a testing trial. Returns the line and
+    columns for the monitor, accumulated complexity and the mode and thresholds
+    predicted by the curriculum network, None without the network.
+    """
+    if learner:
+        learner.collect(perf)
+    more_info = ""
+    s = info.split()
+    norm_duration = float(s[0]) / config["env_timeout"]
+    td_per_step = perf['td']/perf['ss'] if perf['ss'] > 0 else 0
+    norm_td_error = td_per_step / config["env_td_error_scale"]
+    norm_complexity += perf['l2_reg']/perf['ss'] if perf['ss'] > 0 else 0
+    indicators = [norm_duration, norm_td_error, norm_complexity]
+    more_info += ''.join('{:14.8f}'.format(indi) for indi in indicators)
+    columns = dict(indicators=indicators)
+    prediction = None
+    if cl_nn:
+        # update PerformanceTracker
+        pt.add(indicators) # return, duration, damage
+        v = pt.flatten()
+        prediction = cl_nn.predict(sess, v)
+        more_info += ''.join('{:14.8f}'.format(vvv) for vv in v[0] for vvv in vv)
+        more_info += ''.join('{:14.8f}'.format(th) for th in prediction[1])
+        columns.update(pt=v, thresholds=prediction[1])
+    reset_perf(perf)
+    return more_info, columns, norm_complexity, prediction
+
+def track_test_returns(test_returns, trial_return, info, reach_timeout_num, config):
+    """ Average return of the last 10 testing trials and the number of trials in a row which reached the timeout """
+    test_returns.append(trial_return)
+    avg_test_return = np.mean(test_returns[max([0, len(test_returns)-10]):])
+    if float(info.split()[0]) > config['reach_timeout']:
+        reach_timeout_num += 1
+    else:
+        reach_timeout_num = 0
+    return avg_test_return, reach_timeout_num
+
+def finish_training(sess, checkpoints, replay_buffer, cl_nn, obs_rms, ss, config):
+    """ Save the last episode policy, replay memory and curriculum network """
+    if config['save']:
+        suffix="-last"
+        checkpoints.save(suffix, ss, obs_rms)
+        checkpoints.close()
+
+    replay_buffer.save()
+
+    # save curriculum network
+    if cl_nn:
+        cl_nn.save(sess, config["cl_save"])
+
+def latest_damage(info):
+    """ Damage reported in the last step """
+    if not info:
+        return 0
+    return float(info.split()[1])
+
+
+# ===========================
+#   Agent Training
+# ===========================
+def train(env, ddpg_graph, actor, critic, cl_nn = None, pt = None, cl_mode=None, compare_with_sess=None, compare_with_actor=None, norm_complexity=0, replay_buffer=None, fused_update=None, **config):
+
+    print('train: ' + config['output'] + ' started!')
+    print_settings(config)
+
+    curriculums = make_curriculums(config)
 
     gpu_options = tf.GPUOptions(per_process_gpu_memory_fraction=0.15)
     with tf.Session(graph=ddpg_graph, config=tf.ConfigProto(gpu_options=gpu_options)) as sess:
 
-        # Check if a policy needs to be loaded
-        sess = preload_policy(sess, config)
-
-        # Initialize target network weights
-        actor.update_target_network(sess)
-        critic.update_target_network(sess)
+        sess, checkpoints, np_actor = init_session(sess, actor, critic, cl_nn, config)
 
-        # Load curriculum neural network weights (provided parametes have priority)
-        if cl_nn:
-            sess = cl_nn.load(sess, config["cl_load"])
+        obs_dim = actor.s_dim
+        act_dim = actor.a_dim
+        max_action = np.minimum(np.absolute(env.action_space.high),
+                                np.absolute(env.action_space.low))
 
-        # Initialize replay memory
+        # Initialize replay memory or continue with the one of the previous stage
         o_dims=env.observation_space.shape[-1]
-        replay_buffer = ReplayBuffer(config, o_dims=o_dims)
+        replay_buffer = init_replay_buffer(replay_buffer, o_dims, max_action, config)
 
         # Observation normalization.
         obs_range = [env.observation_space.low, env.observation_space.high]
-        if config["normalize_observations"]:
-            obs_rms = RunningMeanStd(shape=env.observation_space.shape)
-        else:
-            obs_rms = None
+        obs_rms = RunningMeanStd(shape=env.observation_space.shape) if config["normalize_observations"] else None
 
         # decide mode
-        if cl_nn:
-            v = pt.flatten()
-            cl_mode_new, cl_threshold = cl_nn.predict(sess, v)
-            #cl_threshold = pt.denormalize(cl_threshold)
-        else:
-            cl_mode_new = cl_mode
-            cl_threshold = None
+        cl_mode_new, cl_threshold, more_info, columns = initial_mode(sess, cl_nn, pt, cl_mode)
 
         # Initialize constants for exploration noise
         ou_sigma = config["ou_sigma"]
@@ -178,11 +544,6 @@ def train(env, ddpg_graph, actor, critic, cl_nn = None, pt = None, cl_mode=None,
         trial_return = 0
         max_trial_return = 0
 
-        obs_dim = actor.s_dim
-        act_dim = actor.a_dim
-        max_action = np.minimum(np.absolute(env.action_space.high),
-                                np.absolute(env.action_space.low))
-
         obs = np.zeros(obs_dim)
         action = np.zeros(act_dim)
         noise = np.zeros(act_dim)
@@ -192,125 +553,70 @@ def train(env, ddpg_graph, actor, critic, cl_nn = None, pt = None, cl_mode=None,
         ss_all = 0
         terminal = 0
         reach_timeout_num = 0
-        more_info = None
-        ss_acc, td_acc, l2_reg_acc, action_grad_acc, actor_grad_acc = 0,0,0,0,0
-        prev_l2_reg = critic.l2_reg_(sess)
+        perf = new_perf(critic.l2_reg_(sess))
         ti = config["test_interval"]
         test_returns = []
         avg_test_return = config['reach_return']
 
-        # rewarding object if rewards in replay buffer are to be recalculated
-        replay_buffer.load()
-        if config['reassess_for']:
-            print('Reassessing replay buffer for {}'.format(config['reassess_for']))
-            evaluator = Evaluator(max_action)
-            #pdb.set_trace()
-            replay_buffer = evaluator.add_bonus(replay_buffer, how = config['reassess_for'])
+        # Optionally, updates are performed by a concurrent thread
+        learner, replay_buffer = start_learner(sess, actor, critic, fused_update, replay_buffer, config)
 
         # Export trajectory
         if config['trajectory']:
             trajectory = []
             if config["compare_with"]:
                 actor_sim = []
+                compare_with_np_actor = create_np_actor(compare_with_sess, compare_with_actor, config)
 
         # start environment
-        for c in curriculums:
-            c['ss'], val = next(c['gen'])
-            d = {"action": "update_{}".format(c['var']), c['var']: val}
-            env.reconfigure(d)
+        update_curriculums(env, curriculums)
         test = (ti>=0 and tt%(ti+1) == ti)
         obs = env.reset(test=test)
         obs = obs_normalize(obs, obs_rms, obs_range, o_dims, config["normalize_observations"])
 
         # Export environment state
-        if cl_nn:
-            more_info = ''.join('{:10.2f}'.format(indi) for indi in [-100, -100, -100])
-            more_info += ''.join('{:10.2f}'.format(vvv) for vv in v[0] for vvv in vv)
-            more_info += ''.join('{:10.2f}'.format(th) for th in cl_threshold)
-        env.log(more_info if cl_threshold is not None else '')
+        env.log(more_info if cl_threshold is not None else '', **columns)
 
         # Main loop over steps or trials
-        # Finish when trials finish
-        # or Finish when steps finish
-        # or Finishe when new mode in curriculum is switched
-        # or Finish when certain return is reached
-        # of Finish if trial happend to be longer then config['reach_balance'] twice in a row
-        while (config["trials"] == 0 or tt < config["trials"]) and \
-              (config["steps"]  == 0 or ss < config["steps"]) and \
-              (not cl_nn or cl_mode_new == cl_mode) and \
-              (not config['reach_return'] or avg_test_return <= config['reach_return']) and \
-              (not config['reach_timeout'] or (config['reach_timeout'] > 0 and reach_timeout_num < config['reach_timeout_num'])):
+        loop_start_time = time.time()
+        prof = PhaseProfiler(['action', 'env', 'normalize', 'buffer', 'update', 'render', 'trajectory', 'logging'])
+        while keep_training(tt, ss, cl_nn, cl_mode_new, cl_mode, avg_test_return, reach_timeout_num, config):
 
             # Compute OU noise and action
             if not test:
                 noise = ExplorationNoise.ou_noise(ou_theta, ou_mu, ou_sigma, noise, act_dim)
 
-            action = compute_action(sess, actor, obs[:o_dims], noise, test) # from [-1; 1]
+            action = compute_action(sess, actor, obs[:o_dims], noise, test, np_actor) # from [-1; 1]
+            prof.mark('action')
 
             # obtain observation of a state
             next_obs, reward, terminal, info = env.step(action*max_action)
+            prof.mark('env')
             #print('Forward promotion: ' + str(next_obs[-1]))
             #print('Reward: ' + str(reward))
             next_obs = obs_normalize(next_obs, obs_rms, obs_range, o_dims, config["normalize_observations"])
 
             reward *= config['reward_scale']
+            prof.mark('normalize')
 
             # Add the transition to replay buffer
             if not test:
                 replay_buffer.replay_buffer_add(obs, action, reward, terminal == 2, next_obs)
+            prof.mark('buffer')
 
             # Keep adding experience to the memory until
             # there are at least minibatch size samples
             if not test and replay_buffer.size() > config["rb_min_size"]:
-                minibatch_size = config["minibatch_size"]
-                s_batch, a_batch, r_batch, t_batch, s2_batch = replay_buffer.sample_batch(minibatch_size)
-
-                # Calculate targets
-                target_q = critic.predict_target(sess, s2_batch, actor.predict_target(sess, s2_batch))
-
-                y_i = []
-                for k in range(minibatch_size):
-                    if t_batch[k]:
-                        y_i.append(r_batch[k])
-                    else:
-                        y_i.append(r_batch[k] + config["gamma"] * target_q[k][0]) # target_q: list -> float
-
-                if config['perf_td_error']:
-                    q_i = critic.predict_target(sess, s_batch, a_batch)
-                    td_acc += np.sum(np.abs(q_i-np.reshape(y_i,newshape=(minibatch_size,1))))
-
-                # Update the critic given the targets
-                if config['perf_l2_reg']:
-                    _, _, l2_reg = critic.train_(sess, s_batch, a_batch, np.reshape(y_i, (minibatch_size, 1)))
-                    l2_reg_acc += (l2_reg - prev_l2_reg)
-                    prev_l2_reg = l2_reg
-                else:
-                    critic.train(sess, s_batch, a_batch, np.reshape(y_i, (minibatch_size, 1)))
-
-                # Update the actor policy using the sampled gradient
-                a_outs = actor.predict(sess, s_batch)
-                grad = critic.action_gradients(sess, s_batch, a_outs)[0]
-                if config['perf_action_grad']:
-                    action_grad_acc += np.linalg.norm(grad, ord=2)
-
-                if config['perf_actor_grad']:
-                    _, actor_grad = actor.train_(sess, s_batch, grad)
-                    for ag in actor_grad:
-                        actor_grad_acc += np.linalg.norm(ag, ord=2)
-                else:
-                    actor.train(sess, s_batch, grad)
-
-                ss_acc += 1
-
-                # Update target networks
-                actor.update_target_network(sess)
-                critic.update_target_network(sess)
+                learn(sess, actor, critic, fused_update, replay_buffer, learner, np_actor, perf,
+                      int(ss % config['train_every'] == 0), config)
+            prof.mark('update')
 
             # Render
             if config["render"]:
                 still_open = env.render("human")
                 if still_open==False:
                     break
+            prof.mark('render')
 
             # Record trajectory
             # Note that it exports all training and testing episodes
@@ -318,8 +624,9 @@ def train(env, ddpg_graph, actor, critic, cl_nn = None, pt = None, cl_mode=None,
                 real_time = ss_all * config['env_timestep']
                 trajectory.append([real_time] + obs[:o_dims].tolist() + (action*max_action).tolist() + next_obs[:o_dims].tolist() + [reward] + [terminal]) # + [info])
                 if config["compare_with"]:
-                    compare_with_action = compute_action(compare_with_sess, compare_with_actor, obs[:o_dims], noise, test)
+                    compare_with_action = compute_action(compare_with_sess, compare_with_actor, obs[:o_dims], noise, test, compare_with_np_actor)
                     actor_sim.append( [real_time] + obs[:o_dims].tolist() + (compare_with_action*max_action).tolist())
+            prof.mark('trajectory')
 
             # Prepare next step
             obs = next_obs
@@ -327,34 +634,18 @@ def train(env, ddpg_graph, actor, critic, cl_nn = None, pt = None, cl_mode=None,
 
             # Logging performance at the end of the testing trial
             if terminal and test:
-
-                # NN performance indicators
-                more_info = ""
-                s = info.split()
-                norm_duration = float(s[0]) / config["env_timeout"]
-                td_per_step = td_acc/ss_acc if ss_acc > 0 else 0
-                norm_td_error = td_per_step / config["env_td_error_scale"]
-                norm_complexity += l2_reg_acc/ss_acc if ss_acc > 0 else 0
-                indicators = [norm_duration, norm_td_error, norm_complexity]
-                more_info += ''.join('{:14.8f}'.format(indi) for indi in indicators)
-                if cl_nn:
-                    # update PerformanceTracker
-                    pt.add(indicators) # return, duration, damage
-                    v = pt.flatten()
-                    cl_mode_new, cl_threshold = cl_nn.predict(sess, v)
-                    more_info += ''.join('{:14.8f}'.format(vvv) for vv in v[0] for vvv in vv)
-                    more_info += ''.join('{:14.8f}'.format(th) for th in cl_threshold)
-                ss_acc, td_acc, l2_reg_acc, action_grad_acc, actor_grad_acc = 0,0,0,0,0
+                more_info, columns, norm_complexity, prediction = \
+                    test_trial_info(sess, info, perf, learner, cl_nn, pt, norm_complexity, config)
+                if prediction is not None:
+                    cl_mode_new, cl_threshold = prediction
                 # report
-                env.log(more_info)
+                env.log(more_info, **columns)
+                if config['profile']:
+                    env.profile(prof.report(ss_all))
 
                 # check if performance is satisfactory
-                test_returns.append(trial_return)
-                avg_test_return = np.mean(test_returns[max([0, len(test_returns)-10]):])
-                if float(info.split()[0]) > config['reach_timeout']:
-                    reach_timeout_num += 1
-                else:
-                    reach_timeout_num = 0
+                avg_test_return, reach_timeout_num = \
+                    track_test_returns(test_returns, trial_return, info, reach_timeout_num, config)
 
                 if not config['mp_debug']:
                     msg = "{:>10} {:>10} {:>10.3f} {:>10}" \
@@ -365,32 +656,37 @@ def train(env, ddpg_graph, actor, critic, cl_nn = None, pt = None, cl_mode=None,
             # Save NN if performance is better then before
             if terminal and config['save'] and trial_return > max_trial_return:
                 max_trial_return = trial_return
-                save_policy(sess, config, suffix="-best")
+                save_best(checkpoints, learner, ss, obs_rms)
 
             if not test:
                 ss += 1
-                for c in curriculums:
-                    if ss > c['ss']:
-                        c['ss'], val = next(c['gen'])
-                        d = {"action": "update_{}".format(c['var']), c['var']: val}
-                        env.reconfigure(d)
+                update_curriculums(env, curriculums, ss)
             ss_all += 1
+            prof.mark('logging')
 
             if terminal:
                 tt += 1
                 test = (ti>=0 and tt%(ti+1) == ti)
                 obs = env.reset(test=test)
                 obs = obs_normalize(obs, obs_rms, obs_range, o_dims, config["normalize_observations"])
+                prof.mark('env')
                 reward = 0
                 terminal = 0
                 trial_return = 0
                 noise = np.zeros(actor.a_dim)
 
+        replay_buffer = stop_learner(learner, replay_buffer, perf)
+
+        # Throughput of simulation and learning
+        print_throughput(config['output'], ss_all, time.time() - loop_start_time, perf)
+
         # Export final performance, but when curriculum is not used or terminated
         # not due to the curriculum swithch.
         # Becasue data is always exported when curriculum is switched over.
         if (not cl_nn or cl_mode_new == cl_mode):
-            env.log(more_info)
+            env.log(more_info, **columns)
+        if config['profile']:
+            env.profile(prof.report(ss_all))
 
         # Export trajectory
         if config['trajectory']:
@@ -402,35 +698,199 @@ def train(env, ddpg_graph, actor, critic, cl_nn = None, pt = None, cl_mode=None,
         #evaluator.reassess(replay_buffer, verify=True, task = config['reassess_for'])
         print('train: ' + config['output'] + ' finished!')
 
-        # Save the last episode policy
-        if config['save']:
-            suffix="-last"
-            save_policy(sess, config, suffix=suffix)
-            #save_policy(sess, saver, config, suffix=suffix)
-            if config["normalize_observations"]:
-                with open(config["output"]+suffix+'.obs_rms', 'w') as f:
-                    data = {'count': obs_rms.count, 'mean': obs_rms.mean.tolist(), 'std': obs_rms.std.tolist(), 'var': obs_rms.var.tolist()}
-                    json.dump(data, f)
-
-        replay_buffer.save()
-
-        # save curriculum network
-        if cl_nn:
-            cl_nn.save(sess, config["cl_save"])
+        finish_training(sess, checkpoints, replay_buffer, cl_nn, obs_rms, ss, config)
 
         # extract damage from the last step
-        damage = 0
-        info = env.get_latest_info()
-        if info:
-            s = info.split()
-            damage = float(s[1])
+        damage = latest_damage(env.get_latest_info())
 
     print('train: ' + config['output'] + ' returning ' + '{} {} {} {}'.format(avg_test_return, damage, ss, cl_mode_new))
 
-    return (avg_test_return, damage, ss, cl_mode_new, norm_complexity)
+    return (avg_test_return, damage, ss, cl_mode_new, norm_complexity, replay_buffer)
+
+
+# ===========================
+#   Agent Training with Several Environments
+# ===========================
+def train_vec(env, ddpg_graph, actor, critic, cl_nn = None, pt = None, cl_mode=None, norm_complexity=0, replay_buffer=None, fused_update=None, **config):
+    """
+    Training with copies of the environment stepped in lockstep (see vec_env.py).
+    Actions of all copies are computed with one actor call. Every copy keeps its
+    own trial counter, testing schedule and monitor log, while 'trials' and 'steps'
+    limits count trials and learning steps of all copies together. Transitions
+    beyond the 'steps' limit are not learned from.
+    """
+    assert not config['trajectory'] and not config['compare_with'], 'not supported with several environments'
+
+    print('train_vec: ' + config['output'] + ' started with {} environments!'.format(env.num_envs))
+    print_settings(config)
+
+    curriculums = make_curriculums(config)
+
+    gpu_options = tf.GPUOptions(per_process_gpu_memory_fraction=0.15)
+    with tf.Session(graph=ddpg_graph, config=tf.ConfigProto(gpu_options=gpu_options)) as sess:
+
+        sess, checkpoints, np_actor = init_session(sess, actor, critic, cl_nn, config)
+
+        num_envs = env.num_envs
+        act_dim = actor.a_dim
+        max_action = np.minimum(np.absolute(env.action_space.high),
+                                np.absolute(env.action_space.low))
+
+        # Initialize replay memory or continue with the one of the previous stage
+        o_dims=env.observation_space.shape[-1]
+        replay_buffer = init_replay_buffer(replay_buffer, o_dims, max_action, config)
 
+        # Observation normalization.
+        obs_range = [env.observation_space.low, env.observation_space.high]
+        obs_rms = RunningMeanStd(shape=env.observation_space.shape) if config["normalize_observations"] else None
 
-def start(env, pt=None, cl_mode=None, norm_complexity=0, **config):
+        # decide mode
+        cl_mode_new, cl_threshold, more_info, columns = initial_mode(sess, cl_nn, pt, cl_mode)
+
+        # Initialize constants for exploration noise
+        ou_sigma = config["ou_sigma"]
+        ou_theta = config["ou_theta"]
+        ou_mu = 0
+        max_trial_return = 0
+
+        # Per environment state
+        noise = np.zeros((num_envs, act_dim))
+        trial_return = np.zeros(num_envs)
+        tt_env = np.zeros(num_envs, dtype=int)
+
+        tt = 0
+        ss = 0
+        ss_all = 0
+        reach_timeout_num = 0
+        perf = new_perf(critic.l2_reg_(sess))
+        ti = config["test_interval"]
+        test_returns = []
+        avg_test_return = config['reach_return']
+
+        # Optionally, updates are performed by a concurrent thread
+        learner, replay_buffer = start_learner(sess, actor, critic, fused_update, replay_buffer, config)
+
+        # start environments
+        update_curriculums(env, curriculums)
+        test = np.array([ti>=0 and t%(ti+1) == ti for t in tt_env])
+        obs = np.stack([obs_normalize(env.reset(i, test=test[i]), obs_rms, obs_range, o_dims, config["normalize_observations"])
+                        for i in range(num_envs)])
+
+        # Export environment state
+        for i in range(num_envs):
+            env.log(i, more_info if cl_threshold is not None else '', **columns)
+
+        # Main loop over steps of all environments, termination criteria are the same as in train
+        loop_start_time = time.time()
+        prof = PhaseProfiler(['action', 'env', 'normalize', 'buffer', 'update', 'logging'])
+        while keep_training(tt, ss, cl_nn, cl_mode_new, cl_mode, avg_test_return, reach_timeout_num, config):
+
+            # Compute OU noise, it stays zero in testing trials
+            for i in range(num_envs):
+                if not test[i]:
+                    noise[i] = ExplorationNoise.ou_noise(ou_theta, ou_mu, ou_sigma, noise[i], act_dim)
+
+            # Actions of all environments with a single call
+            if np_actor:
+                action = np_actor.predict(obs[:, :o_dims]) + noise # from [-1; 1]
+            else:
+                action = actor.predict(sess, obs[:, :o_dims]) + noise
+            action = np.clip(action, -1, 1)
+            prof.mark('action')
+
+            # obtain observations of states
+            next_obs, reward, terminal, info = env.step(action*max_action)
+            prof.mark('env')
+            for i in range(num_envs):
+                next_obs[i] = obs_normalize(next_obs[i], obs_rms, obs_range, o_dims, config["normalize_observations"])
+
+            reward *= config['reward_scale']
+            prof.mark('normalize')
+
+            # Add transitions to replay buffer, but not more than the remaining learning steps
+            learning = np.flatnonzero(~test)
+            if config["steps"]:
+                learning = learning[:config["steps"] - ss]
+            for i in learning:
+                replay_buffer.replay_buffer_add(obs[i], action[i], reward[i], terminal[i] == 2, next_obs[i])
+            prof.mark('buffer')
+
+            # Keep the number of updates per learning step the same as in train
+            learning_steps = len(learning)
+            if learning_steps and replay_buffer.size() > config["rb_min_size"]:
+                rounds = (ss + learning_steps - 1)//config['train_every'] - (ss - 1)//config['train_every']
+                learn(sess, actor, critic, fused_update, replay_buffer, learner, np_actor, perf, rounds, config)
+            prof.mark('update')
+
+            # Prepare next step
+            obs = next_obs
+            trial_return += reward
+
+            for i in np.flatnonzero(terminal):
+
+                # Logging performance at the end of the testing trial
+                if test[i]:
+                    more_info, columns, norm_complexity, prediction = \
+                        test_trial_info(sess, info[i], perf, learner, cl_nn, pt, norm_complexity, config)
+                    if prediction is not None:
+                        cl_mode_new, cl_threshold = prediction
+                    # report
+                    env.log(i, more_info, **columns)
+                    if config['profile']:
+                        env.profile(prof.report(ss_all))
+
+                    # check if performance is satisfactory
+                    avg_test_return, reach_timeout_num = \
+                        track_test_returns(test_returns, trial_return[i], info[i], reach_timeout_num, config)
+
+                    if not config['mp_debug']:
+                        msg = "{:>10} {:>10} {:>10} {:>10.3f} {:>10}" \
+                            .format(i, tt, ss, trial_return[i], terminal[i])
+                        print("{}".format(msg))
+
+                # Save NN if performance is better then before
+                if config['save'] and trial_return[i] > max_trial_return:
+                    max_trial_return = trial_return[i]
+                    save_best(checkpoints, learner, ss, obs_rms)
+                prof.mark('logging')
+
+                tt += 1
+                tt_env[i] += 1
+                test[i] = (ti>=0 and tt_env[i]%(ti+1) == ti)
+                obs[i] = obs_normalize(env.reset(i, test=test[i]), obs_rms, obs_range, o_dims, config["normalize_observations"])
+                trial_return[i] = 0
+                noise[i] = 0
+                prof.mark('env')
+
+            ss += learning_steps
+            update_curriculums(env, curriculums, ss)
+            ss_all += num_envs
+
+        replay_buffer = stop_learner(learner, replay_buffer, perf)
+
+        # Throughput of simulation and learning
+        print_throughput(config['output'], ss_all, time.time() - loop_start_time, perf)
+
+        # Export final performance of every environment, see train
+        if (not cl_nn or cl_mode_new == cl_mode):
+            for i in range(num_envs):
+                env.log(i, more_info, **columns)
+        if config['profile']:
+            env.profile(prof.report(ss_all))
+
+        print('train_vec: ' + config['output'] + ' finished!')
+
+        finish_training(sess, checkpoints, replay_buffer, cl_nn, obs_rms, ss, config)
+
+        # extract damage from the last step of the first environment
+        damage = latest_damage(env.get_latest_info(0))
+
+    print('train_vec: ' + config['output'] + ' returning ' + '{} {} {} {}'.format(avg_test_return, damage, ss, cl_mode_new))
+
+    return (avg_test_return, damage, ss, cl_mode_new, norm_complexity, replay_buffer)
+
+
+def start(env, pt=None, cl_mode=None, norm_complexity=0, replay_buffer=None, **config):
 
     # block warnings from tf.saver if needed
     if config['mp_debug']:
@@ -451,8 +911,14 @@ def start(env, pt=None, cl_mode=None, norm_complexity=0, **config):
         act_dim = env.action_space.shape[-1]
 
         actor = ActorNetwork(obs_dim, act_dim, 1, config)
-        critic = CriticNetwork(obs_dim, act_dim, config,
-                               actor.get_num_trainable_vars())
+        if config['fused_update']:
+            critic = CriticNetwork(obs_dim, act_dim, config,
+                                   actor.get_num_trainable_vars(), actor)
+            fused_update = FusedUpdate(actor, critic, config)
+        else:
+            critic = CriticNetwork(obs_dim, act_dim, config,
+                                   actor.get_num_trainable_vars())
+            fused_update = None
 
         if config["tensorboard"] == True:
             dir_path = os.path.dirname(os.path.realpath(__file__))
@@ -474,5 +940,8 @@ def start(env, pt=None, cl_mode=None, norm_complexity=0, **config):
         return compare(env, ddpg, actor, critic, compare_with_graph, compare_with_actor, cl_nn, pt, cl_mode,
                       **config)
 
-    return train(env, ddpg, actor, critic, cl_nn, pt, cl_mode, norm_complexity, **config)
+    if hasattr(env, 'num_envs'):
+        return train_vec(env, ddpg, actor, critic, cl_nn, pt, cl_mode, norm_complexity, replay_buffer=replay_buffer, fused_update=fused_update, **config)
+
+    return train(env, ddpg, actor, critic, cl_nn, pt, cl_mode, norm_complexity, replay_buffer=replay_buffer, fused_update=fused_update, **config)
 
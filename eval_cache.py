@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache of evaluated curriculum solutions.
+
+A run is keyed by a hash of its solution, tasks, starting task, seed and the
+configuration without per-run file names and settings which do not change the
+result. Seeds are derived from the solution and a replicate number, so when an
+optimizer samples a solution again its first replicate is a repeat of the
+stored run and is not started. Reevaluations ask for fresh replicates, which
+continue after the ones stored for the solution. Damage info of finished runs
+is kept in the SQLite file 'cache.db' of the search directory.
+"""
+import os
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import numpy as np
+from results_db import RUN_KEYS
+
+CACHE_NAME = 'cache.db'
+# do not change the outcome of a run
+IGNORED_KEYS = RUN_KEYS + ('mp_debug', 'mp_timeout', 'mp_retries', 'opt_async', 'resume', 'eval_cache',
+                           'results_db', 'env_cache', 'monitor_format', 'monitor_flush_rows', 'profile',
+                           'tensorboard')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS evaluations (
+    key TEXT PRIMARY KEY,
+    solution TEXT,
+    replicate INTEGER,
+    seed INTEGER,
+    damage_info BLOB,
+    time REAL
+);
+CREATE INDEX IF NOT EXISTS evaluations_solution ON evaluations (solution);
+'''
+
+
+def solution_key(solution):
+    """ Canonical text of a solution, a list of numbers or None """
+    if solution is None:
+        return 'null'
+    return json.dumps(np.asarray(solution).tolist())
+
+
+def replicate_seed(solution, replicate, base_seed=None):
+    text = '{}:{}:{}'.format(solution_key(solution), replicate, base_seed or 0)
+    return int(hashlib.sha1(text.encode('utf8')).hexdigest()[:8], 16) // 2
+
+
+def run_key(mp_cfg, solution):
+    config, tasks, starting_task = mp_cfg
+    cfg = {k: v for k, v in config.items() if k not in IGNORED_KEYS}
+    text = json.dumps({'config': cfg, 'tasks': tasks, 'starting_task': starting_task,
+                       'solution': solution_key(solution), 'seed': config['seed']},
+                      sort_keys=True, default=str)
+    return hashlib.sha1(text.encode('utf8')).hexdigest()
+
+
+class EvaluationCache(object):
+
+    def __init__(self, root):
+        self.db = sqlite3.connect(os.path.join(root, CACHE_NAME), timeout=60)
+        self.db.executescript(SCHEMA)
+
+    def get(self, key):
+        """ Damage info of run 'key', None if it was not evaluated """
+        row = self.db.execute('SELECT damage_info FROM evaluations WHERE key = ?', (key,)).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def put(self, key, solution, replicate, seed, damage_info):
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO evaluations VALUES (?,?,?,?,?,?)',
+                            (key, solution_key(solution), replicate, seed,
+                             pickle.dumps(damage_info, 2), time.time()))
+
+    def replicates(self, solution):
+        """ First replicate number of 'solution' which is not stored """
+        row = self.db.execute('SELECT MAX(replicate) FROM evaluations WHERE solution = ?',
+                              (solution_key(solution),)).fetchone()
+        return 0 if row[0] is None else row[0] + 1
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Single-call DDPG update.
+
+The critic has to be created with the actor passed to it, so that its inputs
+and TD targets are connected to the actor networks inside the graph.
+"""
+import tensorflow as tf
+from target_update import soft_update_ops, hard_update
+
+
+class FusedUpdate(object):
+    """
+    Computes TD targets, updates the critic and the actor and moves target
+    networks towards them within one sess.run. Unlike the step-by-step update,
+    the action gradient is taken from the critic before its update.
+    Optimizers of the actor and the critic are reused, so that no variables
+    are added to the graph. Batch normalization is not supported: the online
+    critic evaluates (s, a) and (s, mu(s)) as one batch, so its statistics
+    would mix both inputs, which the step-by-step update keeps apart.
+    """
+
+    def __init__(self, actor, critic, config):
+        if config['batch_norm']:
+            raise ValueError('--fused-update requires --no-batch-norm, batch statistics of the critic inputs would be mixed')
+        self.actor = actor
+        self.critic = critic
+
+        n = tf.shape(critic.reward)[0]
+        self.action_grads = critic.action_grads[0][n:]
+
+        # Accumulated TD error of the target critic, as in the step-by-step update
+        self.td_error = tf.reduce_sum(tf.abs(critic.target_out[n:] - critic.predicted_q_value))
+
+        # Critic weights are updated only after the action gradient is computed
+        with tf.control_dependencies([self.action_grads]):
+            critic_gradients = tf.gradients(critic.loss, critic.network_params)
+            critic_train = critic.adam.apply_gradients(zip(critic_gradients, critic.network_params))
+
+        self.actor_gradients = tf.gradients(actor.scaled_out, actor.network_params,
+                                            -tf.stop_gradient(self.action_grads))
+        actor_train = actor.adam.apply_gradients(zip(self.actor_gradients, actor.network_params))
+
+        # Target networks are moved in the same call, or only every 'target_update_interval' calls
+        self.train_op = tf.group(critic_train, actor_train)
+        with tf.control_dependencies([critic_train, actor_train]):
+            if config['hard_target_update']:
+                self.update = tf.group(hard_update(actor.network_params, actor.target_network_params),
+                                       hard_update(critic.network_params, critic.target_network_params))
+            else:
+                self.update = tf.group(*(soft_update_ops(actor.network_params, actor.target_network_params, actor.tau) +
+                                         soft_update_ops(critic.network_params, critic.target_network_params, critic.tau)))
+
+        # Optional performance indicators
+        self.fetches = {'update': self.update,
+                        'q': critic.out[:n],
+                        'y': critic.predicted_q_value}
+        if config['perf_td_error']:
+            self.fetches['td_error'] = self.td_error
+        if config['perf_l2_reg']:
+            self.fetches['l2_reg'] = critic.l2_reg
+        if config['perf_action_grad']:
+            self.fetches['action_grad'] = self.action_grads
+        if config['perf_actor_grad']:
+            self.fetches['actor_grad'] = self.actor_gradients
+
+    def train(self, sess, s_batch, a_batch, r_batch, t_batch, s2_batch, weights=None, update_targets=True):
+        feed_dict = {
+            self.actor.inputs: s_batch,
+            self.actor.target_inputs: s2_batch,
+            self.critic.batch_action: a_batch,
+            self.critic.reward: r_batch,
+            self.critic.terminal: t_batch
+        }
+        if weights is not None:
+            feed_dict[self.critic.weights] = weights
+        fetches = self.fetches
+        if not update_targets:
+            fetches = dict(fetches, update=self.train_op)
+        return sess.run(fetches, feed_dict=feed_dict)
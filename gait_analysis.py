@@ -63,6 +63,7 @@ def mujoco_export(env, mp, task='Walking', policies='', trajectories='', misc=''
 
     # Run actual script.
     args['save'] = False
+    args['np_play'] = True # falls back to TensorFlow if policies were not exported
     cfg_run(**args)
 
 
@@ -95,6 +96,7 @@ def leo_export(mp, policies='', task='walking', trajectories='', misc=''):
 
     # Run actual script.
     args['save'] = False
+    args['np_play'] = True # falls back to TensorFlow if policies were not exported
     cfg_run(**args)
 
     if task == 'walking':
@@ -28,4 +28,5 @@ args['env_timestep'] = 0.03
 
 # Run actual script.
 args['save'] = False
+args['np_play'] = True # falls back to TensorFlow if policies were not exported
 cfg_run(**args)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Columnar binary monitor log.
+
+The file is a sequence of blocks appended one at a time. A block starts with
+the size of its JSON header as 8 little-endian bytes, followed by the header
+{"rows": n, "columns": [[name, dtype], ...]} and the raw column arrays in the
+same order. Blocks may hold different columns, load_log fills values missing
+in a block with NaN. Blocks are never rewritten, so an interrupted run keeps
+everything flushed before, and a truncated last block is ignored.
+"""
+import os
+import glob
+import json
+import struct
+import numpy as np
+from collections import OrderedDict
+
+LOG_EXT = 'monitor.bin'
+TEXT_EXT = 'monitor.csv'
+INFO_NAMES = ('duration', 'damage', 'distance')
+INDICATOR_NAMES = ('norm_duration', 'norm_td_error', 'norm_complexity')
+
+
+def log_row(steps, ret, terminal, info=None, indicators=None, pt=None, thresholds=None):
+    """ Typed columns of one line of the monitor log """
+    row = OrderedDict([('steps', int(steps)), ('return', float(ret)), ('terminal', int(terminal))])
+    if isinstance(info, str):
+        for i, value in enumerate(info.split()):
+            row[INFO_NAMES[i] if i < len(INFO_NAMES) else 'info{}'.format(i)] = float(value)
+    if indicators is not None:
+        for name, value in zip(INDICATOR_NAMES, indicators):
+            row[name] = float(value)
+    if pt is not None:
+        for i, value in enumerate(np.ravel(pt)):
+            row['pt{}'.format(i)] = float(value)
+    if thresholds is not None:
+        for i, value in enumerate(np.ravel(thresholds)):
+            row['threshold{}'.format(i)] = float(value)
+    return row
+
+
+class ColumnarLog(object):
+    """ Rows are kept in memory and appended as a block every 'flush_rows' rows """
+
+    def __init__(self, filename, flush_rows=64):
+        self.f = open(filename, 'wb')
+        self.flush_rows = flush_rows
+        self.rows = []
+
+    def append(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        names = []
+        for row in self.rows:
+            names += [name for name in row if name not in names]
+        columns = []
+        for name in names:
+            values = [row.get(name, np.nan) for row in self.rows]
+            if all(isinstance(v, int) for v in values):
+                columns.append(np.array(values, dtype=np.int64))
+            else:
+                columns.append(np.array(values, dtype=np.float64))
+        header = json.dumps({'rows': len(self.rows),
+                             'columns': [[name, c.dtype.str] for name, c in zip(names, columns)]}).encode('utf8')
+        self.f.write(struct.pack('<Q', len(header)) + header + b''.join(c.tobytes() for c in columns))
+        self.f.flush()
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+
+def load_log(filename):
+    """ All columns of a log as arrays; columns missing in some blocks become float with NaN """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    blocks = []
+    pos = 0
+    while pos + 8 <= len(data):
+        size, = struct.unpack('<Q', data[pos:pos+8])
+        header = json.loads(data[pos+8:pos+8+size].decode('utf8'))
+        pos += 8 + size
+        block = OrderedDict()
+        for name, dtype in header['columns']:
+            nbytes = header['rows'] * np.dtype(dtype).itemsize
+            if pos + nbytes > len(data):
+                break
+            block[name] = np.frombuffer(data, dtype=dtype, count=header['rows'], offset=pos)
+            pos += nbytes
+        if len(block) < len(header['columns']):
+            break # truncated block
+        blocks.append((header['rows'], block))
+
+    names = []
+    for _, block in blocks:
+        names += [name for name in block if name not in names]
+    columns = OrderedDict()
+    for name in names:
+        parts = [block[name] if name in block else np.full(rows, np.nan) for rows, block in blocks]
+        columns[name] = np.concatenate(parts) if parts else np.empty(0)
+    return columns
+
+
+def log_filename(monitor_filename):
+    """ Binary log next to a '.monitor.csv' file """
+    if monitor_filename.endswith(TEXT_EXT):
+        return monitor_filename[:-len(TEXT_EXT)] + LOG_EXT
+    return monitor_filename
+
+
+def read_columns(monitor_filename, names, skip=1):
+    """
+    Columns 'names' of the binary log of 'monitor_filename' stacked into a matrix,
+    None if the log does not exist. 'skip' drops the export made at the start of a run.
+    """
+    filename = log_filename(monitor_filename)
+    if not os.path.isfile(filename):
+        return None
+    columns = load_log(filename)
+    return np.column_stack([columns[name][skip:] for name in names])
+
+
+def glob_monitor(pattern):
+    """ '.monitor.csv' names matched by 'pattern', including runs which only wrote a binary log """
+    files = set(glob.glob(pattern))
+    files.update(f[:-len(LOG_EXT)] + TEXT_EXT for f in glob.glob(log_filename(pattern)))
+    return sorted(files)
@@ -5,11 +5,11 @@ import os.path
 import yaml, io
 import traceback
 import itertools
-import signal
 import random
 from datetime import datetime
 
 from ddpg import parse_args, cfg_run
+from scheduler import Scheduler, yaml_steps_cost
 
 random.seed(datetime.now())
 
@@ -45,13 +45,7 @@ def main():
               }
     L1 = rl_run(configs, alg, options, load_file="ddpg-balancing-{}-1010", rb_load="ddpg-balancing-{}-1010")
 
-    # Execute learning
-
-    # longer runs first
-    L0 = L0[::-1]
-    L1 = L1[::-1]
-    #print(L0)
-    #print(L1)
+    # Execute learning, longer runs are started first by the scheduler
     do_multiprocessing_pool(arg_cores, L0)
     do_multiprocessing_pool(arg_cores, L1)
 
@@ -156,22 +150,16 @@ def mp_run(cfg):
 
 ######################################################################################
 def do_multiprocessing_pool(arg_cores, list_of_new_cfgs):
-    """Do multiprocesing"""
-    cores = multiprocessing.Value('i', arg_cores)
-    print('cores {0}'.format(cores.value))
-    original_sigint_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
-    pool = multiprocessing.Pool(arg_cores)
-    signal.signal(signal.SIGINT, original_sigint_handler)
+    """Do multiprocesing, longer runs first"""
+    print('cores {0}'.format(arg_cores))
+    costs = [yaml_steps_cost(cfg) for cfg in list_of_new_cfgs]
     try:
-        pool.map(mp_run, list_of_new_cfgs)
+        with Scheduler(mp_run, arg_cores) as scheduler:
+            for i, _ in scheduler.imap_unordered(list_of_new_cfgs, costs):
+                print('do_multiprocessing_pool: {} finished'.format(list_of_new_cfgs[i]))
         print('Finished tasks')
     except KeyboardInterrupt:
-        pool.terminate()
-    else:
-        pool.close()
-        print('Closing complete')
-    pool.join()
-    print('Joining complete')
+        print('Termination complete')
 
 
 ######################################################################################
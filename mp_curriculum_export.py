@@ -6,11 +6,11 @@ import collections, io
 from ruamel import yaml
 import sys
 import itertools
-import signal
 import random
 from datetime import datetime
 
 from ddpg import parse_args, cfg_run
+from scheduler import Scheduler, yaml_steps_cost
 
 random.seed(datetime.now())
 
@@ -163,19 +163,15 @@ def mp_run(cfg):
 
 ######################################################################################
 def do_multiprocessing_pool(arg_cores, list_of_new_cfgs):
-    """Do multiprocesing"""
-    cores = multiprocessing.Value('i', arg_cores)
-    print('cores {0}'.format(cores.value))
-    original_sigint_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
-    pool = multiprocessing.Pool(arg_cores)
-    signal.signal(signal.SIGINT, original_sigint_handler)
+    """Do multiprocesing, longer runs first"""
+    print('cores {0}'.format(arg_cores))
+    costs = [yaml_steps_cost(cfg) for cfg in list_of_new_cfgs]
     try:
-        pool.map(mp_run, list_of_new_cfgs)
+        with Scheduler(mp_run, arg_cores) as scheduler:
+            for i, _ in scheduler.imap_unordered(list_of_new_cfgs, costs):
+                print('do_multiprocessing_pool: {} finished'.format(list_of_new_cfgs[i]))
     except KeyboardInterrupt:
-        pool.terminate()
-    else:
-        pool.close()
-    pool.join()
+        print('Termination complete')
 
 
 ######################################################################################
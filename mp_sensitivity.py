@@ -5,12 +5,12 @@ import os.path
 import yaml, collections, io
 from time import sleep
 import itertools
-import signal
 import random
 from datetime import datetime
 import numpy as np
 
 from ddpg import parse_args, cfg_run
+from scheduler import Scheduler, yaml_steps_cost
 
 counter_lock = multiprocessing.Lock()
 cores = 0
@@ -174,20 +174,17 @@ def init(cnt, num):
 
 ######################################################################################
 def do_multiprocessing_pool(arg_cores, list_of_new_cfgs):
-    """Do multiprocesing"""
+    """Do multiprocesing, longer runs first"""
     counter = multiprocessing.Value('i', 0)
     cores = multiprocessing.Value('i', arg_cores)
     print('cores {0}'.format(cores.value))
-    original_sigint_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
-    pool = multiprocessing.Pool(arg_cores, initializer = init, initargs = (counter, cores))
-    signal.signal(signal.SIGINT, original_sigint_handler)
+    costs = [yaml_steps_cost(cfg) for cfg in list_of_new_cfgs]
     try:
-        pool.map(mp_run, list_of_new_cfgs)
+        with Scheduler(mp_run, arg_cores, initializer = init, initargs = (counter, cores)) as scheduler:
+            for i, _ in scheduler.imap_unordered(list_of_new_cfgs, costs):
+                print('do_multiprocessing_pool: {} finished'.format(list_of_new_cfgs[i]))
     except KeyboardInterrupt:
-        pool.terminate()
-    else:
-        pool.close()
-    pool.join()
+        print('Termination complete')
 
 
 ######################################################################################
@@ -5,12 +5,13 @@ import os.path
 import yaml, collections, io
 import sys
 import itertools
-import signal
 import random
 from datetime import datetime
 import yaml, glob
 
 from ddpg import parse_args, run
+from scheduler import Scheduler, yaml_steps_cost
+from results_db import query
 
 random.seed(datetime.now())
 
@@ -33,7 +34,13 @@ def main():
 
     # Parameters
     L = []
-    for f in glob.glob('cl/*-02_walking.yaml'):
+    runs = query('cl', stage='02_walking')
+    if runs is None:
+        # no catalogue, see results_db.index_directory
+        files = sorted(glob.glob('cl/*-02_walking.yaml'))
+    else:
+        files = [os.path.join('cl', os.path.basename(r['config_file'])) for r in runs if r['config_file']]
+    for f in files:
         with open(f, 'r') as file:
             config = yaml.load(file)
         config['steps'] = config['steps'] + 200000
@@ -73,19 +80,15 @@ def mp_run(cfg):
 
 ######################################################################################
 def do_multiprocessing_pool(arg_cores, list_of_new_cfgs):
-    """Do multiprocesing"""
-    cores = multiprocessing.Value('i', arg_cores)
-    print('cores {0}'.format(cores.value))
-    original_sigint_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
-    pool = multiprocessing.Pool(arg_cores)
-    signal.signal(signal.SIGINT, original_sigint_handler)
+    """Do multiprocesing, longer runs first"""
+    print('cores {0}'.format(arg_cores))
+    costs = [yaml_steps_cost(cfg) for cfg in list_of_new_cfgs]
     try:
-        pool.map(mp_run, list_of_new_cfgs)
+        with Scheduler(mp_run, arg_cores) as scheduler:
+            for i, _ in scheduler.imap_unordered(list_of_new_cfgs, costs):
+                print('do_multiprocessing_pool: {} finished'.format(list_of_new_cfgs[i]))
     except KeyboardInterrupt:
-        pool.terminate()
-    else:
-        pool.close()
-    pool.join()
+        print('Termination complete')
 
 
 ######################################################################################
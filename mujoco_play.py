@@ -51,4 +51,5 @@ args['env_timestep'] = 0.0165
 
 # Run actual script.
 args['save'] = False
+args['np_play'] = True # falls back to TensorFlow if policies were not exported
 cfg_run(**args)
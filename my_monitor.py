@@ -5,25 +5,38 @@ import csv
 import os.path as osp
 import json
 from baselines.bench import Monitor
+from monitor_log import ColumnarLog, log_row
 
 class MyMonitor(Monitor):
-    def __init__(self, env, filename, allow_early_resets=False, reset_keywords=(), report='test'):
+    def __init__(self, env, filename, allow_early_resets=False, reset_keywords=(), report='test',
+                 log_format='csv', flush_rows=64, close_env=True):
+        """
+        log_format: 'csv' writes formatted lines, 'binary' writes typed columns
+        (see monitor_log.py), 'both' writes both of them
+        close_env: False if the wrapped environment is reused after the monitor is closed
+        """
         Wrapper.__init__(self, env=env)
         self.tstart = time.time()
-        if filename is None:
-            self.f = None
-            self.logger = None
-        else:
+        self.close_env = close_env
+        self.f = None
+        self.logger = None
+        self.columnar = None
+        self.basename = None
+        if filename is not None:
             if not filename.endswith(Monitor.EXT):
                 if osp.isdir(filename):
                     filename = osp.join(filename, Monitor.EXT)
                 else:
                     filename = filename + "." + Monitor.EXT
-            self.f = open(filename, "wt")
-            self.f.write('#%s\n'%json.dumps({"t_start": self.tstart, "gym_version": gym.__version__,
-                "env_id": env.spec.id if env.spec else 'Unknown'}))
-            self.logger = csv.DictWriter(self.f, fieldnames=('steps-reward-terminal-info',)+reset_keywords)
-            self.logger.writeheader()
+            self.basename = filename[:-len(Monitor.EXT)]
+            if log_format != 'binary':
+                self.f = open(filename, "wt")
+                self.f.write('#%s\n'%json.dumps({"t_start": self.tstart, "gym_version": gym.__version__,
+                    "env_id": env.spec.id if env.spec else 'Unknown'}))
+                self.logger = csv.DictWriter(self.f, fieldnames=('steps-reward-terminal-info',)+reset_keywords)
+                self.logger.writeheader()
+            if log_format != 'csv':
+                self.columnar = ColumnarLog(self.basename + 'monitor.bin', flush_rows)
 
         self.reset_keywords = reset_keywords
         self.allow_early_resets = allow_early_resets
@@ -36,6 +49,8 @@ class MyMonitor(Monitor):
         self.current_reset_info = {} # extra info about the current episode, that was passed in during reset()
         self.test = False
         self.report = report
+        self.profile_f = None
+        self.profile_logger = None
         try:
             self.env.report(self.report)
         except AttributeError:
@@ -74,7 +89,8 @@ class MyMonitor(Monitor):
             return self.episode_info
 
 
-    def log(self, more_info = None):
+    def log(self, more_info = None, **columns):
+        """ Columns of the binary log: indicators, pt and thresholds """
         eprew = sum(self.rewards)
         info = self.get_latest_info()
         if info:
@@ -88,6 +104,33 @@ class MyMonitor(Monitor):
         if self.logger:
             self.logger.writerow(epinfo)
             self.f.flush()
+        if self.columnar:
+            self.columnar.append(log_row(self.total_steps, eprew, self.done, info, **columns))
+
+
+    def profile(self, phases):
+        """ Export wall-clock time of step loop phases to '<name>.profile.csv' next to the monitor file """
+        if self.basename is None:
+            return
+        if self.profile_logger is None:
+            self.profile_f = open(self.basename + 'profile.csv', "wt")
+            self.profile_logger = csv.DictWriter(self.profile_f, fieldnames=list(phases.keys()))
+            self.profile_logger.writeheader()
+        self.profile_logger.writerow({k: '{:.6f}'.format(v) if isinstance(v, float) else v for k, v in phases.items()})
+        self.profile_f.flush()
+
+
+    def close(self):
+        if self.profile_f is not None:
+            self.profile_f.close()
+            self.profile_f = None
+        if self.columnar is not None:
+            self.columnar.close()
+            self.columnar = None
+        if self.close_env:
+            super(MyMonitor, self).close()
+        elif self.f is not None:
+            self.f.close()
 
 
     def _dict_to_string(self, rowdict):
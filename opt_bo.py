@@ -5,6 +5,7 @@ Created on Fri Feb 23 08:53:20 2018
 
 @author: ivan
 """
+import time
 import numpy as np
 import pickle
 
@@ -12,23 +13,38 @@ from skopt import Optimizer
 from skopt.learning import GaussianProcessRegressor
 from skopt.space import Real
 from outliers import dixon_test
+from bo_rff import RFFOptimizer
 
 class opt_bo(object):
     def __init__(self, config, w_num, popsize, resample, search_space):
         self.popsize = popsize
         self.resample = resample
-        self.optimizer = Optimizer(
-            dimensions=[Real(search_space[0], search_space[1])] * w_num,
-            random_state=1, # use the same seed for repeatability
-            n_initial_points=self.popsize*self.resample, # if self.resample > 1, then we will continue ask-tell cycles self.resample times
-            acq_optimizer_kwargs = {'n_points':10000} # 'n_jobs' slows down, 'noise' seem not to be used
-        )
+        if config.get('cl_bo_surrogate', 'gp') == 'rff':
+            # cost of ask and tell does not grow with the number of evaluations
+            self.optimizer = RFFOptimizer(
+                [tuple(search_space)] * w_num,
+                n_initial_points=self.popsize*self.resample,
+                n_features=config['cl_bo_features'],
+                trust_region=config['cl_bo_trust_region'],
+                random_state=1
+            )
+        else:
+            self.optimizer = Optimizer(
+                dimensions=[Real(search_space[0], search_space[1])] * w_num,
+                random_state=1, # use the same seed for repeatability
+                n_initial_points=self.popsize*self.resample, # if self.resample > 1, then we will continue ask-tell cycles self.resample times
+                acq_optimizer_kwargs = {'n_points':10000}, # 'n_jobs' slows down, 'noise' seem not to be used
+                model_queue_size=1 # keep only the last GP, the optimizer is pickled with the checkpoint
+            )
+        self.ask_time, self.tell_time = 0.0, 0.0 # seconds spent in the surrogate since the last log
 
     def stop(self):
         return False
 
     def ask(self):
+        start = time.perf_counter()
         x = self.optimizer.ask(n_points=self.popsize)
+        self.ask_time += time.perf_counter() - start
         x = [xx for xx in x for i in range(self.resample)]
         return x
 
@@ -49,23 +65,49 @@ class opt_bo(object):
                 outliers = [x + self.resample*batch_id for x in outliers]
                 rejected.append(outliers)
 
-        res = self.optimizer.tell(X, Y)
+        start = time.perf_counter()
+        res = self.optimizer.tell(X, Y) if X else None # all runs failed
+        self.tell_time += time.perf_counter() - start
         rejected = [y for x in rejected for y in x] # flatten list of rejected episodes' indexes
         return res, rejected
 
+    def ask_one(self, pending=()):
+        """ Point for a free core, points still being evaluated are told the constant liar value """
+        start = time.perf_counter()
+        optimizer = self.optimizer
+        if pending:
+            optimizer = self.optimizer.copy()
+            lie = min(optimizer.yi) if optimizer.yi else 0.0
+            optimizer.tell(list(pending), [lie]*len(pending))
+        x = optimizer.ask()
+        self.ask_time += time.perf_counter() - start
+        return x
+
+    def tell_one(self, solution, damage):
+        """ Damage of all 'resample' evaluations of one point """
+        valid_batch = [x for x in damage if x is not None]
+        valid_batch, _ = dixon_test(valid_batch, pres=-1)
+        if len(valid_batch) > 0:
+            start = time.perf_counter()
+            self.optimizer.tell(solution, np.mean(valid_batch))
+            self.tell_time += time.perf_counter() - start
+
     def reeval(self, g, solutions, damage, hp):
         pass
 
-    def log(self, root, alg, g, damage_info, reeval_damage_info, rejected):
-        ibest = np.argmin(self.optimizer.yi)
-
+    def log(self, root, alg, g, damage_info, reeval_damage_info, rejected=()):
         with open('{}/opt_bo.txt'.format(root), 'w') as f:
             for p in zip(self.optimizer.Xi,self.optimizer.yi):
                 f.write(str(p)+'\n')
 
         with open('{}/{}-g{:04}.txt'.format(root, alg, g), 'w') as f:
-            f.write(str(self.optimizer.yi[ibest])+'\n')
-            f.write(str(self.optimizer.Xi[ibest])+'\n\n\n')
+            if self.optimizer.yi: # nothing is told while all runs fail
+                ibest = np.argmin(self.optimizer.yi)
+                f.write(str(self.optimizer.yi[ibest])+'\n')
+                f.write(str(self.optimizer.Xi[ibest])+'\n')
+            f.write('evaluations {}, ask {:.3f} s, tell {:.3f} s\n\n\n'.format(
+                    len(self.optimizer.yi), self.ask_time, self.tell_time))
+            self.ask_time, self.tell_time = 0.0, 0.0
 
             for i, di in enumerate(damage_info):
                 rej_symb = '*' if i in rejected else ' '
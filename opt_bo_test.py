@@ -7,7 +7,6 @@ Created on Thu Mar  1 18:47:11 2018
 """
 
 import numpy as np
-import pickle
 import matplotlib.pyplot as plt
 
 from skopt import Optimizer
@@ -15,9 +14,10 @@ from skopt.learning import GaussianProcessRegressor
 from skopt.space import Real
 from skopt.utils import create_result
 from skopt.plots import plot_objective, partial_dependence, plot_evaluations
+from opt_checkpoint import load_checkpoint
 
-with open('opt.pkl', 'rb') as f:
-    optimizer = pickle.load(f)
+# the optimizer of a search is saved with its checkpoint
+optimizer = load_checkpoint('.')['opt'].optimizer
 
 res = create_result(optimizer.Xi, optimizer.yi, optimizer.space, optimizer.rng,
                              models=optimizer.models)
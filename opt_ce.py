@@ -10,48 +10,23 @@ import pickle
 import pdb
 import traceback
 
-def _rejection_sampling(p, solutions, n):
-    x = []
-    for i in range(n):
-        while True:
-            ci = np.random.randint(len(solutions))
-            if np.random.uniform() <= p[ci]:
-                x.append(solutions[ci])
-                break
-    return x
-
-
 class opt_ce(object):
+    """
+    Cross-entropy search over 'solutions', tuples of category indices with one
+    entry per dimension. The sampling distribution is the product of the
+    marginals of all dimensions restricted to 'solutions'.
+    """
     def __init__(self, popsize, solutions, categories):
         self.popsize = popsize
         self.solutions = solutions
         self.categories = categories
         self.psize = len(self.categories)
-        self.pa = [0.5]*self.psize
-        self.pa = [x/sum(self.pa) for x in self.pa]
-        self.pb = [0.5]*self.psize
-        self.pb = [x/sum(self.pb) for x in self.pb]
+        self.combinations = np.array(solutions, dtype=int) # solutions x dimensions
+        self.ndim = self.combinations.shape[1]
+        self.p = np.full((self.ndim, self.psize), 1.0/self.psize) # marginals, dimensions x categories
         self.alpha = 0.9 #0.8
-
-#        # priors
-#        priora = [0]*self.psize
-#        priorb = [0]*self.psize
-#        for sol in solutions:
-#            a, b = sol
-#            priora[a] += 1
-#            priorb[b] += 1
-##        priora = [1-x/(1+max(priora)) for x in priora]
-##        priorb = [1-x/(1+max(priorb)) for x in priorb]
-##        priora = [x/sum(priora) for x in priora]
-##        priorb = [x/sum(priorb) for x in priorb]
-#        minprob = 1
-#        assert(min(priora) > 0)
-#        assert(min(priorb) > 0)
-#        self.pa = [minprob * min(priora)/x for x in priora]
-#        self.pb = [minprob * min(priorb)/x for x in priorb]
-#        self.pa = [x/sum(self.pa) for x in self.pa]
-#        self.pb = [x/sum(self.pb) for x in self.pb]
-#        # priors
+        self.resample = 1
+        self.evaluated = [] # steady-state variant, see tell_one
 
         self.Xi = []
         self.Yi = []
@@ -59,20 +34,15 @@ class opt_ce(object):
     def stop(self):
         return False
 
-    def ask(self):
+    def joint(self):
+        """ Probability of every solution """
+        prob = np.prod(self.p[np.arange(self.ndim), self.combinations], axis=1)
+        return prob / prob.sum()
+
+    def ask(self, n=None):
         # sample according to rare event probability distributions
-        try:
-            # for each option multiply corresponding probablilities
-            prob = []
-            for sol in self.solutions:
-                a, b = sol
-                prob.append(self.pa[a] * self.pb[b])
-            prob = [ x/sum(prob) for x in prob]
-            sampled_solutions = _rejection_sampling(prob, self.solutions, self.popsize)
-        except KeyboardInterrupt:
-            print('opt_ce: rejection_sampling KeyboardInterrupt')
-            pdb.set_trace()
-        return sampled_solutions
+        idxs = np.random.choice(len(self.solutions), n or self.popsize, p=self.joint())
+        return [self.solutions[i] for i in idxs]
 
     def tell(self, solutions, damage):
         # sort damage
@@ -80,15 +50,12 @@ class opt_ce(object):
             idxs =np.argsort(np.array(damage)) # minimum first
             quantile_idx = idxs[:int(len(damage)*0.2)]
             if len(quantile_idx) > 0: # if there are enough samples
-                best = [solutions[x] for x in quantile_idx]
-                besta, bestb = zip(*best)
-                for ii in range(self.psize):
-                    pa_hat = sum([1 for x in besta if x==ii]) / len(besta)
-                    pb_hat = sum([1 for x in bestb if x==ii]) / len(bestb)
-                    self.pa[ii] = self.alpha * self.pa[ii] + (1-self.alpha) * pa_hat
-                    self.pb[ii] = self.alpha * self.pb[ii] + (1-self.alpha) * pb_hat
-                self.pa = [ x/sum(self.pa) for x in self.pa]
-                self.pb = [ x/sum(self.pb) for x in self.pb]
+                best = np.array(solutions, dtype=int)[quantile_idx]
+                # counts of categories of all dimensions at once, dimension d is offset by d*psize
+                counts = np.bincount((best + np.arange(self.ndim)*self.psize).ravel(), minlength=self.ndim*self.psize)
+                p_hat = counts.reshape(self.ndim, self.psize) / len(best)
+                self.p = self.alpha * self.p + (1-self.alpha) * p_hat
+                self.p /= self.p.sum(axis=1, keepdims=True)
                 self.Xi += solutions
                 self.Yi += damage
             else:
@@ -99,10 +66,24 @@ class opt_ce(object):
             pdb.set_trace()
         return quantile_idx
 
+    def ask_one(self, pending=()):
+        return self.ask(1)[0]
+
+    def tell_one(self, solution, damage):
+        """ Probabilities are updated as soon as 'popsize' solutions are evaluated """
+        damage = [d for d in damage if d is not None]
+        if not damage:
+            return
+        self.evaluated.append((solution, np.mean(damage)))
+        if len(self.evaluated) >= self.popsize:
+            solutions, damage = zip(*self.evaluated)
+            self.evaluated = []
+            self.tell(list(solutions), list(damage))
+
     def reeval(self, g, solutions, damage, hp):
         pass
 
-    def log(self, root, alg, g, damage_info, reeval_damage_info, best):
+    def log(self, root, alg, g, damage_info, reeval_damage_info, best=()):
         with open('{}/opt_ce.txt'.format(root), 'w') as f:
             for p in zip(self.Xi,self.Yi):
                 f.write(str(p)+'\n')
@@ -110,8 +91,7 @@ class opt_ce(object):
         with open('{}/{}-g{:04}.txt'.format(root, alg, g), 'w') as f:
             for i in range(self.psize):
                 f.write('{}'.format(self.categories[i]).rjust(6) + ': ' +
-                        '{:0.3f}'.format(self.pa[i]).rjust(6)  +
-                        '{:0.3f}'.format(self.pb[i]).rjust(6) + '\n')
+                        ''.join('{:0.3f}'.format(pd).rjust(6) for pd in self.p[:, i]) + '\n')
 
             f.write('\n\n')
             for i, di in enumerate(damage_info):
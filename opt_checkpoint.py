@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Checkpoint of a curriculum search.
+
+'checkpoint.pkl' in the directory of the search is a snapshot of the optimizer
+with its noise handler, the generation counter, the states of the random
+generators and the candidates which were asked but not told yet. It is taken
+once per generation and replaced atomically, a crash while saving leaves the
+previous one intact.
+
+Between snapshots, the asynchronous search appends its ask and tell records to
+'history.pkl'; a snapshot stores the position up to which they are included,
+the rest is replayed when resuming. The synchronous search does not need them,
+its optimizer asks again from the restored random state.
+
+Finished runs are appended to the journal 'evaluations.pkl' as soon as they
+return. Runs are identified by their output name, which is the same when a
+generation is repeated after resuming, so only the missing runs are started.
+"""
+import os
+import random
+import pickle
+import numpy as np
+
+CHECKPOINT = 'checkpoint.pkl'
+HISTORY = 'history.pkl'
+JOURNAL = 'evaluations.pkl'
+
+
+def save_checkpoint(root, opt, g, pending=None, **state):
+    """ 'pending' are candidates being evaluated, 'state' is anything else the search loop needs """
+    ckpt = dict(state, opt=opt, g=g, pending=pending,
+                np_random=np.random.get_state(), random=random.getstate())
+    filename = os.path.join(root, CHECKPOINT)
+    with open(filename + '.tmp', 'wb') as f:
+        pickle.dump(ckpt, f, 2)
+    os.replace(filename + '.tmp', filename)
+
+
+def load_checkpoint(root):
+    """ Checkpoint as a dict, random generators are restored. None if there is no checkpoint """
+    filename = os.path.join(root, CHECKPOINT)
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, 'rb') as f:
+        ckpt = pickle.load(f)
+    np.random.set_state(ckpt['np_random'])
+    random.setstate(ckpt['random'])
+    return ckpt
+
+
+class Journal(object):
+    """ Damage info of finished runs by output name, a new search starts with an empty journal """
+
+    def __init__(self, root, resume=False):
+        self.filename = os.path.join(root, JOURNAL)
+        self.runs = {}
+        if resume and os.path.isfile(self.filename):
+            self.read()
+        else:
+            open(self.filename, 'wb').close()
+
+    def read(self):
+        with open(self.filename, 'rb') as f:
+            end = 0
+            while True:
+                try:
+                    output, damage_info = pickle.load(f)
+                except Exception: # end of file or a record truncated by a crash
+                    break
+                self.runs[output] = damage_info
+                end = f.tell()
+        # records appended after a truncated one would not be readable
+        os.truncate(self.filename, end)
+
+    def get(self, mp_cfg):
+        return self.runs.get(mp_cfg[0]['output'])
+
+    def record(self, mp_cfg, damage_info):
+        output = mp_cfg[0]['output']
+        self.runs[output] = damage_info
+        with open(self.filename, 'ab') as f:
+            pickle.dump((output, damage_info), f, 2)
+
+
+class History(object):
+    """ Records of the search appended one at a time, a new search starts with an empty history """
+
+    def __init__(self, root, resume=False):
+        self.filename = os.path.join(root, HISTORY)
+        if not resume or not os.path.isfile(self.filename):
+            open(self.filename, 'wb').close()
+
+    def append(self, *record):
+        with open(self.filename, 'ab') as f:
+            pickle.dump(record, f, 2)
+
+    def position(self):
+        return os.path.getsize(self.filename)
+
+    def read(self, start=0):
+        """ Records after position 'start', a record truncated by a crash is dropped """
+        records = []
+        with open(self.filename, 'rb') as f:
+            f.seek(start)
+            end = start
+            while True:
+                try:
+                    records.append(pickle.load(f))
+                except Exception:
+                    break
+                end = f.tell()
+        os.truncate(self.filename, end)
+        return records
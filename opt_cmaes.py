@@ -7,6 +7,7 @@ Created on Fri Feb 23 08:53:20 2018
 """
 import os
 import cma
+import pickle
 import numpy as np
 
 
@@ -50,8 +51,9 @@ class MyNoiseHandler(cma.NoiseHandler):
 
         # calculate median value for all
         for i in self.idx:
-            damage_of_index = [damage[j] for j, x in enumerate(self.mp_idxs) if x == i]
-            self.fitre[i] = fagg(damage_of_index)
+            damage_of_index = [damage[j] for j, x in enumerate(self.mp_idxs) if x == i and damage[j] is not None]
+            if damage_of_index: # otherwise all reevaluations failed, the first value is kept
+                self.fitre[i] = fagg(damage_of_index)
 
         self.evaluations_just_done = evals * len(self.idx)
         return self.fit, self.fitre, self.idx
@@ -59,6 +61,16 @@ class MyNoiseHandler(cma.NoiseHandler):
     def print(self):
         return 'alphasigma = {:0.5f}, evaluations = {:0.5f}'.format(self.alphasigma, self.evaluations)
 
+def contains(solutions, solution):
+    return any(np.array_equal(s, solution) for s in solutions)
+
+
+def valid_(solutions, damage):
+    """ Solutions and damage without the runs which returned None """
+    valid = [(s, d) for s, d in zip(solutions, damage) if d is not None]
+    return [s for s, _ in valid], [d for _, d in valid]
+
+
 class opt_cmaes(object):
     def __init__(self, config, w_num, popsize, reeval_num0):
         # initialize CMA-ES with all mean zeros
@@ -71,6 +83,11 @@ class opt_cmaes(object):
         cma_inopts['bounds'] = [-1, 1]
         init = [0] * w_num
         self.es = cma.CMAEvolutionStrategy(init, sigma0=config['cl_cmaes_sigma0'], inopts=cma_inopts)
+        self.popsize = popsize
+        self.resample = 1
+        self.candidates = [] # steady-state variant, see ask_one
+        self.population = [] # candidates sampled from the current distribution
+        self.evaluated = []
         self.nh = MyNoiseHandler(self.es.N, maxevals=[0, reeval_num0, 5.01], parallel=True, aggregate=np.mean)
         self.logger = cma.CMADataLogger().register(self.es)
 
@@ -81,9 +98,47 @@ class opt_cmaes(object):
         return self.es.ask()
 
     def tell(self, solutions, damage):
-        return self.es.tell(solutions, damage)
+        # runs which failed all attempts are left out
+        solutions, damage = valid_(solutions, damage)
+        if solutions:
+            return self.es.tell(solutions, damage)
+
+    def ask_one(self, pending=()):
+        """
+        Candidates of the current distribution are handed out one at a time,
+        except the ones still being evaluated. The noise handler is not used,
+        reeval needs a whole generation.
+        """
+        while True:
+            if not self.candidates:
+                self.candidates = self.es.ask()
+                self.population += self.candidates
+            solution = self.candidates.pop()
+            if not contains(pending, solution):
+                return solution
+
+    def tell_one(self, solution, damage):
+        """
+        The distribution is updated as soon as 'popsize' candidates are evaluated.
+        Candidates sampled from a previous distribution are discarded.
+        """
+        damage = [d for d in damage if d is not None]
+        if not damage or not contains(self.population, solution):
+            return
+        # a candidate told when resuming may not be handed out again
+        self.candidates = [c for c in self.candidates if not np.array_equal(c, solution)]
+        self.evaluated.append((solution, np.mean(damage)))
+        if len(self.evaluated) == self.popsize:
+            solutions, damage = zip(*self.evaluated)
+            self.es.tell(list(solutions), list(damage))
+            self.evaluated = []
+            self.candidates = self.es.ask() # sampled now to be part of a checkpoint
+            self.population = list(self.candidates)
 
     def reeval(self, g, solutions, damage, hp):
+        solutions, damage = valid_(solutions, damage)
+        if not solutions:
+            return
         self.es.sigma *= self.nh(solutions, damage, hp, self.es.ask, args=(g, len(solutions)))  # see method __call__
         self.es.countevals += self.nh.evaluations_just_done
 
@@ -106,8 +161,20 @@ class opt_cmaes(object):
                     f.write('{:2d}'.format(self.nh.mp_idxs[i]).rjust(3) + ': ' +  str(di) + '\n')
                 f.write('\n' + self.nh.print() + '\n')
 
-    def save(self, fname):
-        pass
+    def __getstate__(self):
+        # the logger writes to files, it is registered again when unpickled
+        state = self.__dict__.copy()
+        del state['logger']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.logger = cma.CMADataLogger().register(self.es, append=True)
+
+    def save(self, root, fname):
+        with open(root+'/'+fname, 'wb') as f:
+            pickle.dump(self, f, 2)
 
-    def load(self, fname):
-        pass
\ No newline at end of file
+    def load(self, root, fname):
+        with open(root+'/'+fname, 'rb') as f:
+            self.__dict__.update(pickle.load(f).__dict__)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Playing a policy exported to '.npz' without TensorFlow.
+
+Mirrors testing trials of ddpg_loop.train: no exploration noise, no learning,
+observations are normalized with the saved statistics and trajectories are
+exported in the same format.
+"""
+import random
+import pickle
+import numpy as np
+from actor_np import load_policy_npz, find_policy_npz
+
+
+def dump_pkl_csv(fname, data):
+    if len(data):
+        if '.pkl' in fname:
+            with open(fname,'wb') as f:
+                pickle.dump(np.array(data), f)
+        else:
+            np.savetxt(fname+'.csv', data)
+
+
+def obs_normalize(obs, obs_rms, obs_range, o_dims):
+    obsx = obs[np.newaxis, :o_dims]
+    if obs_rms is not None:
+        obsx = (obsx - obs_rms['mean']) / obs_rms['std']
+    obs[:o_dims] = np.clip(obsx, obs_range[0], obs_range[1])
+    return obs
+
+
+def can_play(**config):
+    """ Policies and the policy to compare with are exported """
+    return find_policy_npz(config['load_file']) and \
+        (not config['compare_with'] or find_policy_npz(config['compare_with']))
+
+
+def play(env, **config):
+    actor, obs_rms = load_policy_npz(find_policy_npz(config['load_file']))
+    if not config["normalize_observations"]:
+        obs_rms = None
+    if config['compare_with']:
+        compare_with_actor, _ = load_policy_npz(find_policy_npz(config['compare_with']))
+    print('play: ' + config['output'] + ' started!')
+
+    # setup random number generators for predicatbility
+    random.seed(config['seed'])
+    np.random.seed(random.randint(0, 1000000))
+    random.randint(0, 1000000) # seed of TensorFlow in ddpg_loop.start
+    env.seed(random.randint(0, 1000000))
+
+    o_dims = env.observation_space.shape[-1]
+    obs_range = [env.observation_space.low, env.observation_space.high]
+    max_action = np.minimum(np.absolute(env.action_space.high),
+                            np.absolute(env.action_space.low))
+
+    trajectory = []
+    actor_sim = []
+    tt = 0
+    ss_all = 0
+    still_open = True
+    while still_open and (config["trials"] == 0 or tt < config["trials"]) and \
+          (config["steps"]  == 0 or ss_all < config["steps"]):
+        obs = obs_normalize(env.reset(test=True), obs_rms, obs_range, o_dims)
+        terminal = 0
+        trial_return = 0
+        while not terminal:
+            action = np.clip(actor.predict(obs[np.newaxis, :o_dims])[0], -1, 1)
+            next_obs, reward, terminal, info = env.step(action*max_action)
+            next_obs = obs_normalize(next_obs, obs_rms, obs_range, o_dims)
+            reward *= config['reward_scale']
+
+            if config["render"]:
+                still_open = env.render("human")
+                if still_open==False:
+                    break
+
+            if config['trajectory']:
+                real_time = ss_all * config['env_timestep']
+                trajectory.append([real_time] + obs[:o_dims].tolist() + (action*max_action).tolist() + next_obs[:o_dims].tolist() + [reward] + [terminal])
+                if config["compare_with"]:
+                    compare_with_action = np.clip(compare_with_actor.predict(obs[np.newaxis, :o_dims])[0], -1, 1)
+                    actor_sim.append( [real_time] + obs[:o_dims].tolist() + (compare_with_action*max_action).tolist())
+
+            obs = next_obs
+            trial_return += reward
+            ss_all += 1
+
+        env.log('')
+        print("{:>10} {:>10} {:>10.3f} {:>10}".format(tt, ss_all, trial_return, terminal))
+        tt += 1
+
+    if config['trajectory']:
+        dump_pkl_csv(config['trajectory'], trajectory)
+        if config["compare_with"]:
+            dump_pkl_csv(config['trajectory']+'_sim', actor_sim)
+
+    print('play: ' + config['output'] + ' finished!')
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Wall-clock profile of the step loop.
+
+Each phase is closed by mark(), which adds the time elapsed since the
+previous mark to that phase, so a step costs one monotonic clock reading per
+phase. report() returns the accumulated times and starts a new interval.
+"""
+import time
+
+
+class PhaseProfiler(object):
+
+    def __init__(self, phases):
+        self.phases = phases
+        self.acc = dict.fromkeys(phases, 0.0)
+        self.last = time.perf_counter()
+        self.start = self.last
+        self.steps = 0
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.acc[phase] += now - self.last
+        self.last = now
+
+    def report(self, steps):
+        """
+        Seconds spent in each phase since the previous report, 'steps' is the
+        current step counter. Time outside of the marked phases is 'other'.
+        """
+        now = time.perf_counter()
+        total = now - self.start
+        profile = {'steps': steps - self.steps, 'total': total}
+        profile.update(self.acc)
+        profile['other'] = total - sum(self.acc.values())
+        self.acc = dict.fromkeys(self.phases, 0.0)
+        self.start = now
+        self.steps = steps
+        return profile
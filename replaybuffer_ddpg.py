@@ -8,14 +8,31 @@ from collections import deque
 import random
 import numpy as np
 import pickle
+import json
 import os
+import sys
+import threading
+
+RB_EXT = '.rb'
+RB_COLUMNS = ('s', 'a', 'r', 't', 's2', 'fw')
+RB_CHUNK = 65536 # number of experiences copied at once
+
+def max_size(config):
+    """ Capacity of a buffer, which has to be set, e.g. with --rb-max-size """
+    size = config["rb_max_size"]
+    if size is None or size < 1:
+        raise ValueError("rb_max_size must be a positive number of experiences, got {}".format(size))
+    return int(size)
+
 
 class ReplayBuffer(object):
     def __init__(self, config, o_dims):
         """
-        The right side of the deque contains the most recent experiences
+        The right side of the deque contains the most recent experiences.
+        Loading a file keeps all its experiences even if there are more than
+        buffer_size of them, new ones then replace the oldest.
         """
-        self.buffer_size = config["rb_max_size"]
+        self.buffer_size = max_size(config)
         self.replay_buffer_count = 0
         self.replay_buffer = deque()
         self.save_filename = config['rb_save_filename']
@@ -60,20 +77,432 @@ class ReplayBuffer(object):
         return s_batch, a_batch, r_batch, t_batch, s2_batch
 
     def clear(self):
-        self.deque.clear()
+        self.replay_buffer.clear()
         self.replay_buffer_count = 0
 
+    def reconfigure(self, config):
+        """ Adopt size and filenames of a new stage which reuses this buffer """
+        self.buffer_size = max_size(config)
+        self.save_filename = config['rb_save_filename']
+        self.load_filename = config['rb_load_filename']
+        while self.replay_buffer_count > self.buffer_size:
+            self.replay_buffer.popleft()
+            self.replay_buffer_count -= 1
+
     def load(self):
         """ Load experiences """
-        if self.load_filename and os.path.isfile(self.load_filename + '.db'):
-            with open(self.load_filename + '.db', 'rb') as f:
-                self.replay_buffer = pickle.load(f)
-                f.close()
-                self.replay_buffer_count += len(self.replay_buffer)
+        if self.load_filename and os.path.isdir(self.load_filename + RB_EXT):
+            count, columns = load_columns(self.load_filename)
+            self.replay_buffer = columns_to_experiences(count, columns)
+            self.replay_buffer_count += len(self.replay_buffer)
+        elif self.load_filename and os.path.isfile(self.load_filename + '.db'):
+            self.replay_buffer = load_db(self.load_filename)
+            self.replay_buffer_count += len(self.replay_buffer)
 
     def save(self):
         if self.save_filename:
-            with open(self.save_filename + '.db', 'wb') as f:
-                pickle.dump(self.replay_buffer, f, protocol=pickle.HIGHEST_PROTOCOL)
+            save_columns(self.save_filename, *experiences_to_columns(self.replay_buffer))
+
+
+class ArrayReplayBuffer(ReplayBuffer):
+    def __init__(self, config, o_dims):
+        """
+        Experiences are stored column-wise in preallocated numpy arrays which
+        are filled as a circular buffer. Arrays are allocated at the first
+        insertion, when the action shape is known. Once the buffer is full,
+        self.ptr points to the oldest experience. As with the deque, a loaded
+        file with more than buffer_size experiences is kept whole, the buffer
+        grows to its size.
+        """
+        self.s, self.a, self.r, self.t, self.s2, self.fw = [None]*6
+        self.ptr = 0
+        super(ArrayReplayBuffer, self).__init__(config, o_dims)
+
+
+    def _allocate(self, s_dtype, a_shape, a_dtype, fw):
+        self.s  = np.empty((self.buffer_size, self.o_dims), dtype=s_dtype)
+        self.a  = np.empty((self.buffer_size,) + a_shape, dtype=a_dtype)
+        self.r  = np.empty(self.buffer_size)
+        self.t  = np.empty(self.buffer_size, dtype=bool)
+        self.s2 = np.empty((self.buffer_size, self.o_dims), dtype=s_dtype)
+        if fw:
+            self.fw = np.empty(self.buffer_size)
+        else:
+            self.fw = None
+
+
+    def _append(self, s, a, r, t, s2, fw=None):
+        if self.s is None:
+            a = np.asarray(a)
+            self._allocate(s.dtype, a.shape, a.dtype, fw is not None)
+
+        i = self.ptr
+        self.s[i]  = s[0:self.o_dims]
+        self.a[i]  = a
+        self.r[i]  = r
+        self.t[i]  = t
+        self.s2[i] = s2[0:self.o_dims]
+        if self.fw is not None:
+            self.fw[i] = fw
+
+        self.ptr = (self.ptr + 1) % self.buffer_size
+        if self.replay_buffer_count < self.buffer_size:
+            self.replay_buffer_count += 1
+
+
+    def replay_buffer_add(self, s, a, r, t, s2):
+        if s.size == self.o_dims:
+            self._append(s, a, r, t, s2)
+        else:
+            # the last element is forward promotion of the robot
+            self._append(s, a, r, t, s2, s2[-1])
+        return False
+
+
+    def sample_batch(self, batch_size):
+        n = min(batch_size, self.replay_buffer_count)
+        idx = np.array(random.sample(range(self.replay_buffer_count), n), dtype=np.intp)
+        return self.s[idx], self.a[idx], self.r[idx], self.t[idx], self.s2[idx]
+
+
+    def _order(self):
+        """ Indexes of stored experiences from the oldest to the most recent one """
+        if self.replay_buffer_count < self.buffer_size:
+            return np.arange(self.replay_buffer_count)
+        return np.roll(np.arange(self.buffer_size), -self.ptr)
+
+
+    def _chunks(self):
+        """ Slices of stored experiences from the oldest to the most recent one """
+        if self.replay_buffer_count < self.buffer_size:
+            return [slice(0, self.replay_buffer_count)]
+        return [slice(self.ptr, self.buffer_size), slice(0, self.ptr)]
+
+
+    def columns(self):
+        """ Arrays of the buffer, None for absent forward promotion """
+        return dict(zip(RB_COLUMNS, (self.s, self.a, self.r, self.t, self.s2, self.fw)))
+
+
+    def ordered_columns(self, n=None):
+        """ Copies of the columns with the 'n' most recent experiences, from the oldest one """
+        order = self._order()
+        if n is not None:
+            order = order[len(order)-min(n, len(order)):]
+        return len(order), dict((name, column[order]) for name, column in self.columns().items() if column is not None)
+
+
+    @property
+    def replay_buffer(self):
+        """
+        Experiences as a deque of tuples, built in O(n). Only for conversions
+        between storages, use columns() otherwise.
+        """
+        experiences = deque()
+        for i in self._order():
+            if self.fw is None:
+                experiences.append((self.s[i], self.a[i], self.r[i], self.t[i], self.s2[i]))
+            else:
+                experiences.append((self.s[i], self.a[i], self.r[i], self.t[i], self.s2[i], self.fw[i]))
+        return experiences
+
+
+    @replay_buffer.setter
+    def replay_buffer(self, experiences):
+        """ Refill arrays from an iterable of experience tuples """
+        experiences = list(experiences)
+        self.buffer_size = max(self.buffer_size, len(experiences))
+        self.clear()
+        if experiences:
+            self.s = None
+            for e in experiences:
+                self._append(*e)
+
+
+    def clear(self):
+        self.ptr = 0
+        self.replay_buffer_count = 0
+
+
+    def reconfigure(self, config):
+        """ Adopt size and filenames of a new stage which reuses this buffer """
+        self.save_filename = config['rb_save_filename']
+        self.load_filename = config['rb_load_filename']
+        if max_size(config) != self.buffer_size:
+            count, columns = self.ordered_columns(max_size(config))
+            self.buffer_size = max_size(config)
+            self._set_columns(count, columns)
+
+
+    def load(self):
+        """
+        Load experiences. Column files are memory-mapped, so that workers
+        loading the same buffer share the page cache. If the file holds at
+        least as many experiences as fit into the buffer, the buffer takes its
+        size and the columns are used directly as copy-on-write maps without
+        copying anything.
+        """
+        if self.load_filename and os.path.isdir(self.load_filename + RB_EXT):
+            count, columns = load_columns(self.load_filename, mmap_mode='c')
+            self._set_columns(count, columns)
+        elif self.load_filename and os.path.isfile(self.load_filename + '.db'):
+            self.replay_buffer = load_db(self.load_filename)
+
+
+    def _set_columns(self, count, columns):
+        self.ptr = 0
+        self.replay_buffer_count = count
+        if count == 0:
+            # allocated for the new size at the next insertion
+            self.s, self.a, self.r, self.t, self.s2, self.fw = [None]*6
+            return
+
+        if count >= self.buffer_size:
+            self.buffer_size = count
+            for name in RB_COLUMNS:
+                setattr(self, name, columns[name][:count] if name in columns else None)
+            return
+
+        self._allocate(columns['s'].dtype, columns['a'].shape[1:], columns['a'].dtype, 'fw' in columns)
+        for begin in range(0, count, RB_CHUNK):
+            end = min(begin + RB_CHUNK, count)
+            for name, column in columns.items():
+                getattr(self, name)[begin:end] = column[begin:end]
+        self.ptr = count % self.buffer_size
+
+
+    def save(self):
+        if self.save_filename:
+            save_columns(self.save_filename, self.replay_buffer_count, self.columns(), self._chunks())
+
+
+class SumTree(object):
+    def __init__(self, size):
+        """
+        Binary tree stored in a flat array, where every node holds the sum
+        of its children. The root is at index 1, leaves are at indexes
+        [self.capacity, 2*self.capacity). All operations accept arrays of
+        leaf indexes and are vectorized over them.
+        """
+        self.depth = max(1, int(np.ceil(np.log2(size))))
+        self.capacity = 2**self.depth
+        self.tree = np.zeros(2*self.capacity)
+
+    def total(self):
+        return self.tree[1]
+
+    def get(self, idx):
+        return self.tree[idx + self.capacity]
+
+    def update(self, idx, values):
+        """ Set leaves and recompute sums on the way to the root """
+        nodes = np.asarray(idx) + self.capacity
+        self.tree[nodes] = values
+        for _ in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2*nodes] + self.tree[2*nodes+1]
+
+    def find(self, values):
+        """ Leaf indexes at which cumulative sums reach the given values """
+        values = np.array(values, dtype=float)
+        nodes = np.ones(values.shape, dtype=np.intp)
+        for _ in range(self.depth):
+            left = self.tree[2*nodes]
+            right = values >= left
+            values -= left*right
+            nodes = 2*nodes + right
+        return nodes - self.capacity
+
+
+class PrioritizedReplayBuffer(ArrayReplayBuffer):
+    def __init__(self, config, o_dims):
+        """
+        Proportional prioritized experience replay. Priorities (|td| + eps)^alpha
+        are kept in a sum-tree, so that sampling and updates cost O(log n).
+        New experiences receive the maximum priority seen so far.
+        """
+        self.tree = SumTree(max_size(config))
+        self.max_priority = 1.0
+        self.alpha = config["rb_alpha"]
+        self.beta = config["rb_beta"]
+        self.eps = 1e-6
+        super(PrioritizedReplayBuffer, self).__init__(config, o_dims)
+
+
+    def _append(self, s, a, r, t, s2, fw=None):
+        self.tree.update([self.ptr], self.max_priority**self.alpha)
+        super(PrioritizedReplayBuffer, self)._append(s, a, r, t, s2, fw)
+
+
+    def clear(self):
+        self.tree = SumTree(self.buffer_size)
+        super(PrioritizedReplayBuffer, self).clear()
+
+
+    def sample_prioritized(self, batch_size):
+        """
+        Stratified sampling proportional to priorities. In addition to the
+        experiences, returns normalized importance-sampling weights and
+        indexes, which are needed to update priorities later on.
+        """
+        n = min(batch_size, self.replay_buffer_count)
+        segment = self.tree.total() / n
+        values = (np.arange(n) + np.random.uniform(size=n)) * segment
+        idx = np.minimum(self.tree.find(values), self.replay_buffer_count-1)
+
+        probs = self.tree.get(idx) / self.tree.total()
+        weights = np.power(self.replay_buffer_count * probs, -self.beta)
+        weights = np.reshape(weights / weights.max(), (n, 1))
+        return self.s[idx], self.a[idx], self.r[idx], self.t[idx], self.s2[idx], weights, idx
+
+
+    def update_priorities(self, idx, td_errors):
+        priorities = np.abs(np.reshape(td_errors, -1)) + self.eps
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.tree.update(idx, np.power(priorities, self.alpha))
+
+
+    def _set_columns(self, count, columns):
+        """ Experiences which come from a file receive the maximum priority """
+        super(PrioritizedReplayBuffer, self)._set_columns(count, columns)
+        self.tree = SumTree(self.buffer_size) # the buffer may have grown
+        self.tree.update(np.arange(self.replay_buffer_count), self.max_priority**self.alpha)
+
+
+    def reconfigure(self, config):
+        self.alpha = config["rb_alpha"]
+        self.beta = config["rb_beta"]
+        if max_size(config) != self.buffer_size:
+            # keep priorities of experiences which remain in the buffer
+            priorities = self.tree.get(self._order())[-max_size(config):]
+            super(PrioritizedReplayBuffer, self).reconfigure(config)
+            self.tree.update(np.arange(len(priorities)), priorities)
+        else:
+            super(PrioritizedReplayBuffer, self).reconfigure(config)
+
+
+class LockedReplayBuffer(object):
+    """ Serializes calls to a replay buffer shared by acting and learning threads """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attr = getattr(self.buffer, name)
+        if not callable(attr):
+            return attr
+
+        def locked(*args, **kwargs):
+            with self.lock:
+                return attr(*args, **kwargs)
+        return locked
+
+
+def save_columns(filename, count, columns, chunks=None):
+    """
+    Write experiences into <filename>.rb directory, which contains a small json
+    header and one .npy file per column. Rows of each column are taken from
+    'chunks', a list of slices which are written one after the other.
+    """
+    path = filename + RB_EXT
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    if chunks is None:
+        chunks = [slice(0, count)]
+
+    names = [name for name in RB_COLUMNS if columns.get(name) is not None]
+    for name in names:
+        column = columns[name]
+        out = np.lib.format.open_memmap(os.path.join(path, name + '.npy'), mode='w+',
+                                        dtype=column.dtype, shape=(count,) + column.shape[1:])
+        begin = 0
+        for chunk in chunks:
+            for b in range(chunk.start, chunk.stop, RB_CHUNK):
+                e = min(b + RB_CHUNK, chunk.stop)
+                out[begin:begin+e-b] = column[b:e]
+                begin += e-b
+        out.flush()
+        del out
+
+    # header is written last, so that an incomplete save is not picked up
+    with open(os.path.join(path, 'header.json'), 'w') as f:
+        json.dump({'count': count, 'columns': names}, f)
+
+
+def load_columns(filename, mmap_mode='r'):
+    """ Open columns of <filename>.rb as memory maps """
+    path = filename + RB_EXT
+    with open(os.path.join(path, 'header.json'), 'r') as f:
+        header = json.load(f)
+    columns = {}
+    for name in header['columns']:
+        columns[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+    return header['count'], columns
+
+
+def experiences_to_columns(experiences):
+    """ Convert an iterable of experience tuples into column arrays """
+    experiences = list(experiences)
+    columns = {}
+    if experiences:
+        for i, name in enumerate(RB_COLUMNS[:len(experiences[0])]):
+            columns[name] = np.array([e[i] for e in experiences])
+    return len(experiences), columns
+
+
+def columns_to_experiences(count, columns):
+    """ Convert column arrays into a deque of experience tuples """
+    names = [name for name in RB_COLUMNS if name in columns]
+    return deque(zip(*[np.asarray(columns[name][:count]) for name in names]))
+
+
+def load_db(filename):
+    """ Load experiences pickled into <filename>.db by earlier versions """
+    with open(filename + '.db', 'rb') as f:
+        return pickle.load(f)
+
+
+def convert_db(filename):
+    """ Convert pickled <filename>.db into <filename>.rb column format """
+    save_columns(filename, *experiences_to_columns(load_db(filename)))
+
+
+def create_replay_buffer(config, o_dims, replay_buffer=None):
+    """
+    Create replay buffer of the type specified by config. If a buffer of the
+    previous stage is given, it is reused, or its experiences are copied if
+    the type has changed. Experiences which are already columns, loaded from
+    a '.rb' file or kept in arrays by the previous stage, stay in array
+    storage even if deque is configured, so they are not copied into tuples.
+    """
+    load_filename = config['rb_load_filename']
+    if config['rb_prioritized']:
+        cls = PrioritizedReplayBuffer
+    elif config['rb_storage'] == 'array' or isinstance(replay_buffer, ArrayReplayBuffer) or \
+         (load_filename and os.path.isdir(load_filename + RB_EXT)):
+        cls = ArrayReplayBuffer
+    else:
+        cls = ReplayBuffer
+
+    if replay_buffer is not None and type(replay_buffer) is cls:
+        replay_buffer.reconfigure(config)
+        return replay_buffer
+
+    new_replay_buffer = cls(config, o_dims)
+    if isinstance(replay_buffer, ArrayReplayBuffer) and isinstance(new_replay_buffer, ArrayReplayBuffer):
+        new_replay_buffer._set_columns(*replay_buffer.ordered_columns(new_replay_buffer.buffer_size))
+    elif replay_buffer is not None:
+        experiences = list(replay_buffer.replay_buffer)[-new_replay_buffer.buffer_size:]
+        new_replay_buffer.replay_buffer = deque(experiences)
+        new_replay_buffer.replay_buffer_count = len(experiences)
+    return new_replay_buffer
 
 
+if __name__ == '__main__':
+    # Usage: python replaybuffer_ddpg.py name [name ...], where name.db exists
+    for filename in sys.argv[1:]:
+        if filename.endswith('.db'):
+            filename = filename[:-len('.db')]
+        convert_db(filename)
+        print("Converted {}.db into {}{}".format(filename, filename, RB_EXT))
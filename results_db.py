@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Catalogue of finished runs.
+
+Runs are registered in an SQLite file 'results.db' in the directory of their
+output as soon as they finish. A run is keyed by experiment, generation, mp
+index and curriculum stage, which are parsed from output names such as
+'cl/ddpg-g0001-mp12-01_balancing', and by a hash of its configuration without
+the per-run file names and seed. Rows point to the configuration and monitor
+files of the run; rows without a stage hold the total damage of a curriculum
+run. Analysis queries the catalogue instead of globbing the directory, which
+is only done for directories without a catalogue.
+
+Usage: python3 results_db.py <dir> registers runs written before the
+catalogue existed from their '.yaml' files.
+"""
+import os
+import re
+import sys
+import glob
+import json
+import fnmatch
+import time
+import yaml
+import sqlite3
+import hashlib
+from monitor_log import LOG_EXT, TEXT_EXT, glob_monitor
+
+DB_NAME = 'results.db'
+NAME_RE = re.compile(r'^(?P<experiment>.*)-g(?P<generation>\d+)-mp(?P<mp>\d+)(?:-(?P<stage>\d\d_\w+))?$')
+STAGE_RE = re.compile(r'^(?P<experiment>.*)-(?P<stage>\d\d_\w+)$')
+# differ between runs of the same configuration
+RUN_KEYS = ('output', 'save', 'seed', 'cores', 'cl_save', 'cl_load', 'cl_pt_load', 'load_file',
+            'rb_save_filename', 'rb_load_filename', 'trajectory')
+COLUMNS = ('output', 'experiment', 'generation', 'mp', 'stage', 'config_hash', 'config_file',
+           'monitor', 'damage', 'steps', 'time')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    output TEXT PRIMARY KEY,
+    experiment TEXT,
+    generation INTEGER,
+    mp INTEGER,
+    stage TEXT,
+    config_hash TEXT,
+    config_file TEXT,
+    monitor TEXT,
+    damage REAL,
+    steps INTEGER,
+    time REAL
+);
+CREATE INDEX IF NOT EXISTS runs_key ON runs (experiment, generation, mp, stage);
+CREATE INDEX IF NOT EXISTS runs_config ON runs (config_hash);
+'''
+
+
+def db_filename(output):
+    """ Catalogue in the directory of 'output' """
+    return os.path.join(os.path.dirname(output), DB_NAME)
+
+
+def config_hash(config):
+    cfg = {k: v for k, v in config.items() if k not in RUN_KEYS}
+    return hashlib.sha1(json.dumps(cfg, sort_keys=True, default=str).encode('utf8')).hexdigest()[:16]
+
+
+def parse_output(output):
+    """ Experiment, generation, mp index and stage of an output name """
+    name = os.path.normpath(output)
+    m = NAME_RE.match(name)
+    if m:
+        return m.group('experiment'), int(m.group('generation')), int(m.group('mp')), m.group('stage')
+    m = STAGE_RE.match(name)
+    if m:
+        return m.group('experiment'), None, None, m.group('stage')
+    return name, None, None, None
+
+
+def connect(filename):
+    # several workers of a sweep register their runs at the same time
+    db = sqlite3.connect(filename, timeout=60)
+    db.executescript(SCHEMA)
+    return db
+
+
+def monitor_filename(output):
+    """ '.monitor.csv' name of the run as used by the loaders, also if only the binary log was written """
+    if any(os.path.isfile(output + '.' + ext) for ext in (TEXT_EXT, LOG_EXT)):
+        return output + '.' + TEXT_EXT
+    return None
+
+
+def register(config, damage=None, steps=None):
+    """ Add a finished run described by its 'config' to the catalogue of its directory """
+    output = config['output']
+    if not output:
+        return
+    experiment, generation, mp, stage = parse_output(output)
+    config_file = output + '.yaml'
+    row = (output, experiment, generation, mp, stage, config_hash(config),
+           config_file if os.path.isfile(config_file) else None,
+           monitor_filename(output),
+           damage, steps, time.time())
+    db = connect(db_filename(output))
+    try:
+        with db:
+            db.execute('INSERT OR REPLACE INTO runs VALUES ({})'.format(','.join('?'*len(COLUMNS))), row)
+    finally:
+        db.close()
+
+
+def query(path, **keys):
+    """
+    Rows of the catalogue in directory 'path' as dicts. Keys are matched
+    exactly, a list matches any of its values, e.g. query('cl', generation=[1, 2], stage='02_walking')
+    """
+    filename = os.path.join(path, DB_NAME)
+    if not os.path.isfile(filename):
+        return None
+    where, args = [], []
+    for k, v in keys.items():
+        assert k in COLUMNS, 'Unknown column {}'.format(k)
+        if isinstance(v, (list, tuple, range)):
+            where.append('{} IN ({})'.format(k, ','.join('?'*len(v))))
+            args += list(v)
+        else:
+            where.append('{} IS ?'.format(k))
+            args.append(v)
+    sql = 'SELECT {} FROM runs'.format(','.join(COLUMNS))
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY experiment, generation, mp, stage'
+    db = connect(filename)
+    try:
+        return [dict(zip(COLUMNS, row)) for row in db.execute(sql, args)]
+    finally:
+        db.close()
+
+
+def find_monitors(pattern, experiment, generation, stage):
+    """
+    Monitor files of runs of 'experiment' (the name before '-g<generation>' without the
+    directory) whose names match the glob 'pattern'. The catalogue in the directory of
+    'pattern' is queried, files are taken from that directory as it may have been moved.
+    Only without a catalogue the directory is globbed; runs written before the catalogue
+    existed are added to it with index_directory.
+    """
+    path = os.path.dirname(pattern)
+    runs = query(path, generation=generation, stage=stage)
+    if runs is None:
+        return glob_monitor(pattern)
+    files = [os.path.join(path, os.path.basename(run['monitor'])) for run in runs
+             if run['monitor'] and os.path.basename(run['experiment']) == experiment]
+    return [f for f in files if fnmatch.fnmatch(f, pattern)]
+
+
+def index_directory(path):
+    """ Register runs of 'path' from their configuration files """
+    count = 0
+    for f in sorted(glob.glob(os.path.join(path, '*.yaml'))):
+        with open(f, 'r') as file:
+            config = yaml.load(file, Loader=yaml.Loader)
+        if not isinstance(config, dict) or config.get('output') != f[:-len('.yaml')]:
+            continue
+        if not monitor_filename(config['output']):
+            continue
+        register(config)
+        count += 1
+    return count
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        print('{}: {} runs registered'.format(path, index_directory(path)))
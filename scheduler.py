@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Task queue for the sweep drivers.
+
+Unlike pool.map, which splits the task list into fixed chunks, a worker gets
+the next task as soon as it finishes the previous one. Tasks are handed out
+longest first according to their cost estimates (e.g. the number of steps),
+so long walking runs do not start last and leave most cores idle at the end
+of a generation. Results are returned as tasks complete.
+
+Tasks are either mapped in batches or submitted one by one and collected as
+they finish. Every worker is connected by its own pipe, so the scheduler
+knows which task a worker runs. A worker which exceeds the timeout is killed
+and replaced, as well as a worker which crashed. Failed tasks are retried a
+bounded number of times, optionally modified by 'retry' (e.g. a fresh seed),
+and then given up with None as their result. Failures are appended to a
+JSON-lines file.
+"""
+import time
+import json
+import signal
+import traceback
+import multiprocessing
+from multiprocessing.connection import wait
+from collections import deque
+import yaml
+
+POLL = 1.0 # seconds between checks of timeouts
+
+
+def steps_cost(config):
+    """ Number of steps of a run, stage-wise steps are summed """
+    steps = config.get('steps', 0) or 0
+    if isinstance(steps, (list, tuple)):
+        return sum(steps)
+    return steps
+
+
+def yaml_steps_cost(filename):
+    """ Number of steps of a run described by a '.yaml' configuration """
+    try:
+        with open(filename, 'r') as file:
+            return steps_cost(yaml.load(file, Loader=yaml.Loader))
+    except Exception:
+        return 0
+
+
+def worker(remote, fn, initializer, initargs):
+    if initializer:
+        initializer(*initargs)
+    while True:
+        item = remote.recv()
+        if item is None:
+            break
+        i, task = item
+        try:
+            remote.send((i, True, fn(task)))
+        except (Exception, SystemExit): # mp_run of some scripts calls sys.exit()
+            tb = traceback.format_exc()
+            print('scheduler: task {} failed\n{}'.format(i, tb))
+            remote.send((i, False, tb))
+    remote.close()
+
+
+class Scheduler(object):
+    """
+    Worker processes applying 'fn' to tasks.
+    timeout: seconds after which a task is killed, 0 disables
+    retries: number of times a failed task is run again
+    retry: retry(task, attempt) returns the task to run instead
+    failures: file where failures are recorded
+    describe: describe(task) returns a JSON-serializable description of a task for the record
+    """
+
+    def __init__(self, fn, cores, initializer=None, initargs=(), timeout=0, retries=0, retry=None,
+                 failures=None, describe=str):
+        self.fn = fn
+        self.initializer = initializer
+        self.initargs = initargs
+        self.timeout = timeout
+        self.retries = retries
+        self.retry = retry
+        self.failures = failures
+        self.describe = describe
+        self.workers = [None] * cores
+        for w in range(cores):
+            self.spawn(w)
+        self.queue = deque() # (id, task) waiting for a worker
+        self.running = {} # worker -> (id, task, start time)
+        self.attempts = {} # id -> number of retries
+        self.finished = deque() # (id, result, task which ran) not collected yet
+        self.next_id = 0
+        self.closed = False
+
+    def spawn(self, w):
+        remote, work_remote = multiprocessing.Pipe()
+        # workers ignore Ctrl-C, it is handled by the main process
+        original_sigint_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
+        p = multiprocessing.Process(target=worker, args=(work_remote, self.fn, self.initializer, self.initargs))
+        p.daemon = True # as workers of multiprocessing.Pool, do not keep the main process from exiting
+        p.start()
+        signal.signal(signal.SIGINT, original_sigint_handler)
+        work_remote.close()
+        self.workers[w] = (p, remote)
+
+    def respawn(self, w):
+        p, remote = self.workers[w]
+        if p.is_alive():
+            p.terminate()
+        p.join()
+        remote.close()
+        self.spawn(w)
+
+    def record(self, task, attempt, reason, details):
+        print('scheduler: {} failed ({}), attempt {}'.format(self.describe(task), reason, attempt))
+        if not self.failures:
+            return
+        with open(self.failures, 'a') as f:
+            f.write(json.dumps({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'task': self.describe(task),
+                                'attempt': attempt, 'reason': reason, 'details': details}) + '\n')
+
+    def submit(self, task):
+        """ Queue 'task', returns its id for collect() """
+        tid = self.next_id
+        self.next_id += 1
+        self.attempts[tid] = 0
+        self.queue.append((tid, task))
+        self.dispatch()
+        return tid
+
+    def idle(self):
+        """ Number of workers which would not have a task """
+        return len(self.workers) - len(self.running) - len(self.queue)
+
+    def collect(self, with_task=False):
+        """
+        (id, result) of the next finished task, result is None if the task failed.
+        With 'with_task' also the task which ran, it differs from the submitted one after a retry.
+        Raises RuntimeError if no task is outstanding.
+        """
+        while not self.finished:
+            if not self.attempts:
+                raise RuntimeError('Scheduler.collect: no task was submitted or all results were collected')
+            self.poll()
+        tid, ret, task = self.finished.popleft()
+        return (tid, ret, task) if with_task else (tid, ret)
+
+    def dispatch(self):
+        for w in range(len(self.workers)):
+            if w not in self.running and self.queue:
+                tid, task = self.queue.popleft()
+                try:
+                    self.workers[w][1].send((tid, task))
+                    sent = True
+                except (BrokenPipeError, EOFError, OSError): # worker died while waiting
+                    sent = False
+                if not sent:
+                    self.respawn(w)
+                    self.workers[w][1].send((tid, task))
+                self.running[w] = (tid, task, time.time())
+
+    def poll(self):
+        """ Wait for results at most POLL seconds, handle timeouts and failures """
+        failed = []
+        ready = wait([self.workers[w][1] for w in self.running], timeout=POLL)
+        for w in list(self.running):
+            p, remote = self.workers[w]
+            tid, task, start = self.running[w]
+            if remote in ready:
+                del self.running[w]
+                try:
+                    _, ok, ret = remote.recv()
+                except EOFError:
+                    ok, ret = None, None
+                if ok is None: # not respawned in the except clause, forked workers would inherit the exception
+                    self.respawn(w)
+                    failed.append((tid, task, 'crash', 'exit code {}'.format(p.exitcode)))
+                elif ok:
+                    del self.attempts[tid]
+                    self.finished.append((tid, ret, task))
+                else:
+                    failed.append((tid, task, 'exception', ret))
+            elif self.timeout and time.time() - start > self.timeout:
+                del self.running[w]
+                self.respawn(w)
+                failed.append((tid, task, 'timeout', '{} s'.format(self.timeout)))
+
+        for tid, task, reason, details in failed:
+            self.record(task, self.attempts[tid], reason, details)
+            if self.attempts[tid] < self.retries:
+                self.attempts[tid] += 1
+                self.queue.appendleft((tid, self.retry(task, self.attempts[tid]) if self.retry else task))
+            else:
+                del self.attempts[tid]
+                self.finished.append((tid, None, task))
+        self.dispatch()
+
+    def imap_unordered(self, tasks, costs=None, with_task=False):
+        """
+        Yield (index, result) of 'tasks' in the order of completion, result is None if a task failed.
+        With 'with_task' also the task which ran, see collect().
+        """
+        order = range(len(tasks))
+        if costs is not None:
+            order = sorted(order, key=lambda i: -costs[i]) # stable for equal costs
+        index = {self.submit(tasks[i]): i for i in order}
+        for _ in range(len(tasks)):
+            tid, ret, task = self.collect(with_task=True)
+            yield (index[tid], ret, task) if with_task else (index[tid], ret)
+
+    def map(self, tasks, costs=None):
+        """ Results of 'tasks' in the order of 'tasks' """
+        results = [None] * len(tasks)
+        for i, ret in self.imap_unordered(tasks, costs):
+            results[i] = ret
+        return results
+
+    def close(self):
+        for p, remote in self.workers:
+            try:
+                remote.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for p, remote in self.workers:
+            p.join()
+            remote.close()
+        self.closed = True
+
+    def terminate(self):
+        for p, _ in self.workers:
+            p.terminate()
+        for p, remote in self.workers:
+            p.join()
+            remote.close()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
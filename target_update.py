@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Target network updates built as single grouped ops.
+"""
+import tensorflow as tf
+
+
+def soft_update_ops(network_params, target_network_params, tau):
+    return [target_network_params[i].assign(tf.multiply(network_params[i], tau) +
+                                            tf.multiply(target_network_params[i], 1. - tau))
+            for i in range(len(target_network_params))]
+
+
+def soft_update(network_params, target_network_params, tau):
+    """ Move target networks towards online networks by 'tau' """
+    return tf.group(*soft_update_ops(network_params, target_network_params, tau))
+
+
+def hard_update(network_params, target_network_params):
+    """ Copy online networks to target networks """
+    return tf.group(*[target_network_params[i].assign(network_params[i])
+                      for i in range(len(target_network_params))])
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NumpyActor against the TensorFlow actor it is exported from.
+
+Run from the repository root: python3 -m pytest tests
+"""
+import os
+import sys
+import tempfile
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from actor_np import NumpyActor, actor_layers, save_policy_npz, load_policy_npz
+
+STATE_DIM, ACTION_DIM, ACTION_BOUND = 5, 2, 2.0
+
+
+def random_layers(rng, batch_norm):
+    layers = []
+    for n_in, n_out in [(STATE_DIM, 400), (400, 300), (300, ACTION_DIM)]:
+        layer = {'W': rng.uniform(-0.1, 0.1, (n_in, n_out)), 'b': rng.uniform(-0.1, 0.1, n_out)}
+        if batch_norm and n_out != ACTION_DIM:
+            layer.update(gamma=rng.uniform(0.5, 1.5, n_out), beta=rng.uniform(-0.1, 0.1, n_out),
+                         moving_mean=rng.uniform(-0.1, 0.1, n_out), moving_variance=rng.uniform(0.5, 1.5, n_out))
+        layers.append(layer)
+    return layers
+
+
+def reference_predict(layers, inputs):
+    """ Forward pass without folding batch normalization """
+    x = inputs
+    for i, layer in enumerate(layers):
+        x = x.dot(layer['W']) + layer['b']
+        if 'gamma' in layer:
+            x = (x - layer['moving_mean']) / np.sqrt(layer['moving_variance'] + 1e-5) * layer['gamma'] + layer['beta']
+        x = np.maximum(x, 0) if i < len(layers) - 1 else np.tanh(x)
+    return x * ACTION_BOUND
+
+
+@pytest.mark.parametrize('batch_norm', [False, True])
+def test_folded_batch_norm(batch_norm):
+    rng = np.random.RandomState(0)
+    layers = random_layers(rng, batch_norm)
+    inputs = rng.uniform(-1, 1, (16, STATE_DIM))
+    actor = NumpyActor(layers, ACTION_BOUND)
+    assert np.allclose(actor.predict(inputs), reference_predict(layers, inputs), atol=1e-5)
+
+
+def test_npz_round_trip():
+    rng = np.random.RandomState(1)
+    layers = random_layers(rng, True)
+    values = {'{}{}/{}'.format(name, '_norm' if key in ('gamma', 'beta', 'moving_mean', 'moving_variance') else '', key): v
+              for name, layer in zip(['actorLayer1', 'actorLayer2', 'actorOutput'], layers) for key, v in layer.items()}
+    inputs = rng.uniform(-1, 1, (4, STATE_DIM))
+    obs_rms = {'mean': np.zeros(STATE_DIM), 'std': np.ones(STATE_DIM)}
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'policy')
+        save_policy_npz(filename, actor_layers(values), obs_rms, ACTION_BOUND)
+        actor, loaded_rms = load_policy_npz(filename)
+    assert np.allclose(actor.predict(inputs), reference_predict(layers, inputs), atol=1e-5)
+    assert np.array_equal(loaded_rms['std'], obs_rms['std'])
+
+
+@pytest.mark.parametrize('batch_norm', [False, True])
+def test_matches_tensorflow(batch_norm):
+    tf = pytest.importorskip('tensorflow')
+    pytest.importorskip('tflearn')
+    from actor import ActorNetwork
+
+    config = {'actor_lr': 0.0001, 'tau': 0.001, 'batch_norm': batch_norm}
+    graph = tf.Graph()
+    with graph.as_default():
+        actor = ActorNetwork(STATE_DIM, ACTION_DIM, ACTION_BOUND, config)
+        init = tf.global_variables_initializer()
+
+    # another graph is the default one, as for compare_with_actor during training
+    with tf.Graph().as_default(), tf.Session(graph=graph) as sess:
+        sess.run(init)
+        np_actor = NumpyActor(actor.get_weights(sess), actor.action_bound)
+        inputs = np.random.RandomState(2).uniform(-1, 1, (32, STATE_DIM))
+        assert np.allclose(np_actor.predict(inputs), actor.predict(sess, inputs), atol=1e-4)
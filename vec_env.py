@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Several copies of an environment stepped in lockstep.
+
+Every copy is wrapped in its own MyMonitor, so each of them writes its own
+log. The first copy logs to the usual file, the others to '<output>-env<i>'.
+The profile of the step loop is exported by the first copy.
+Subprocess workers are used for environments which step in C++ without
+releasing the interpreter (GRL), the in-process variant suits Roboschool.
+"""
+
+# GRL should be imported before tensorflow.
+# Otherwise, error : "dlopen: cannot load any more object with static TLS"
+try:
+    from grlgym.envs.grl import Leo
+except ImportError:
+    pass
+
+import os
+import multiprocessing
+import numpy as np
+import gym
+from my_monitor import MyMonitor
+
+
+def make_env(cfg, output, report='test', log_format='csv', flush_rows=64):
+    """ Create Leo from a configuration file or a gym environment by its name """
+    if os.path.isfile(cfg):
+        env = Leo(cfg)
+    else:
+        import roboschool
+        env = gym.make(cfg)
+    return MyMonitor(env, output, report=report, log_format=log_format, flush_rows=flush_rows)
+
+
+def env_output(output, i):
+    if not output or i == 0:
+        return output
+    return '{}-env{}'.format(output, i)
+
+
+class VecEnv(object):
+    """ In-process copies of the environment """
+
+    def __init__(self, cfg, num_envs, output, report='test', log_format='csv', flush_rows=64):
+        self.num_envs = num_envs
+        self.envs = [make_env(cfg, env_output(output, i), report, log_format, flush_rows) for i in range(num_envs)]
+        self.observation_space = self.envs[0].observation_space
+        self.action_space = self.envs[0].action_space
+
+    def seed(self, seed):
+        for i, env in enumerate(self.envs):
+            env.seed(seed + i)
+
+    def reset(self, i, test=False):
+        return self.envs[i].reset(test=test)
+
+    def step(self, actions):
+        results = [env.step(a) for env, a in zip(self.envs, actions)]
+        obs, rews, dones, infos = zip(*results)
+        return np.stack(obs), np.array(rews), np.array(dones), list(infos)
+
+    def reconfigure(self, d=None):
+        for env in self.envs:
+            env.reconfigure(d)
+
+    def log(self, i, more_info=None, **columns):
+        self.envs[i].log(more_info, **columns)
+
+    def get_latest_info(self, i=0):
+        return self.envs[i].get_latest_info()
+
+    def profile(self, phases):
+        self.envs[0].profile(phases)
+
+    def close(self):
+        for env in self.envs:
+            env.close()
+
+
+def worker(remote, parent_remote, cfg, output, report, log_format, flush_rows):
+    parent_remote.close()
+    env = make_env(cfg, output, report, log_format, flush_rows)
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == 'step':
+                remote.send(env.step(data))
+            elif cmd == 'reset':
+                remote.send(env.reset(test=data))
+            elif cmd == 'seed':
+                env.seed(data)
+            elif cmd == 'reconfigure':
+                env.reconfigure(data)
+            elif cmd == 'log':
+                env.log(data[0], **data[1])
+            elif cmd == 'profile':
+                env.profile(data)
+            elif cmd == 'get_latest_info':
+                remote.send(env.get_latest_info())
+            elif cmd == 'get_spaces':
+                remote.send((env.observation_space, env.action_space))
+            elif cmd == 'close':
+                break
+            else:
+                raise NotImplementedError(cmd)
+    except KeyboardInterrupt:
+        print('vec_env worker: got KeyboardInterrupt')
+    finally:
+        env.close()
+        remote.close()
+
+
+class SubprocVecEnv(VecEnv):
+    """ Copies of the environment running in their own processes """
+
+    def __init__(self, cfg, num_envs, output, report='test', log_format='csv', flush_rows=64):
+        self.num_envs = num_envs
+        self.remotes, work_remotes = zip(*[multiprocessing.Pipe() for _ in range(num_envs)])
+        self.ps = [multiprocessing.Process(target=worker, args=(work_remote, remote, cfg, env_output(output, i), report,
+                                                                     log_format, flush_rows))
+                   for i, (work_remote, remote) in enumerate(zip(work_remotes, self.remotes))]
+        for p in self.ps:
+            p.daemon = True # if the main process crashes, we should not cause things to hang
+            p.start()
+        for remote in work_remotes:
+            remote.close()
+        self.remotes[0].send(('get_spaces', None))
+        self.observation_space, self.action_space = self.remotes[0].recv()
+        self.closed = False
+
+    def seed(self, seed):
+        for i, remote in enumerate(self.remotes):
+            remote.send(('seed', seed + i))
+
+    def reset(self, i, test=False):
+        self.remotes[i].send(('reset', test))
+        return self.remotes[i].recv()
+
+    def step(self, actions):
+        for remote, a in zip(self.remotes, actions):
+            remote.send(('step', a))
+        results = [remote.recv() for remote in self.remotes]
+        obs, rews, dones, infos = zip(*results)
+        return np.stack(obs), np.array(rews), np.array(dones), list(infos)
+
+    def reconfigure(self, d=None):
+        for remote in self.remotes:
+            remote.send(('reconfigure', d))
+
+    def log(self, i, more_info=None, **columns):
+        self.remotes[i].send(('log', (more_info, columns)))
+
+    def get_latest_info(self, i=0):
+        self.remotes[i].send(('get_latest_info', None))
+        return self.remotes[i].recv()
+
+    def profile(self, phases):
+        self.remotes[0].send(('profile', phases))
+
+    def close(self):
+        if self.closed:
+            return
+        for remote in self.remotes:
+            remote.send(('close', None))
+        for p in self.ps:
+            p.join()
+        self.closed = True
+
+
+def make_vec_env(cfg, num_envs, output, report='test', subproc=True, log_format='csv', flush_rows=64):
+    # Daemonic processes, e.g. workers of multiprocessing.Pool, are not allowed to have children
+    if subproc and not multiprocessing.current_process().daemon:
+        return SubprocVecEnv(cfg, num_envs, output, report, log_format, flush_rows)
+    return VecEnv(cfg, num_envs, output, report, log_format, flush_rows)